@@ -0,0 +1,39 @@
+"""user_state and rate_limits tables
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2024-03-08 12:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'user_state',
+        sa.Column('kind', sa.String(), nullable=False),
+        sa.Column('key', sa.Integer(), nullable=False),
+        sa.Column('data', sa.LargeBinary(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('kind', 'key'),
+    )
+    op.create_table(
+        'rate_limits',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('events', sa.Text(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('user_id'),
+    )
+
+
+def downgrade():
+    op.drop_table('rate_limits')
+    op.drop_table('user_state')
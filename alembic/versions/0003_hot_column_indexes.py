@@ -0,0 +1,27 @@
+"""indexes for per-user history and premium expiry scans
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2024-03-15 12:00:00
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # История пользователя: WHERE user_id = ? ORDER BY timestamp
+    op.create_index('ix_queries_user_id_timestamp', 'queries', ['user_id', 'timestamp'])
+    # Истечение подписок: WHERE is_premium AND premium_expiration < ?
+    op.create_index('ix_users_is_premium_premium_expiration', 'users', ['is_premium', 'premium_expiration'])
+
+
+def downgrade():
+    op.drop_index('ix_users_is_premium_premium_expiration', table_name='users')
+    op.drop_index('ix_queries_user_id_timestamp', table_name='queries')
@@ -0,0 +1,32 @@
+"""response_cache table
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2024-03-22 12:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'response_cache',
+        sa.Column('key', sa.String(length=64), nullable=False),
+        sa.Column('response', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('key'),
+    )
+    op.create_index(op.f('ix_response_cache_created_at'), 'response_cache', ['created_at'])
+
+
+def downgrade():
+    op.drop_index(op.f('ix_response_cache_created_at'), table_name='response_cache')
+    op.drop_table('response_cache')
@@ -0,0 +1,40 @@
+"""payments ledger
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2024-04-02 12:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'payments',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('order_id', sa.String(length=64), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=True),
+        sa.Column('amount', sa.String(length=32), nullable=True),
+        sa.Column('status', sa.String(), nullable=True),
+        sa.Column('provider_payment_id', sa.String(length=64), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_payments_order_id', 'payments', ['order_id'], unique=True)
+    op.create_index('ix_payments_user_id', 'payments', ['user_id'], unique=False)
+    op.create_index('ix_payments_created_at', 'payments', ['created_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_payments_created_at', table_name='payments')
+    op.drop_index('ix_payments_user_id', table_name='payments')
+    op.drop_index('ix_payments_order_id', table_name='payments')
+    op.drop_table('payments')
@@ -0,0 +1,38 @@
+"""payment processing state
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2024-04-05 12:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0007'
+down_revision = '0006'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('payments') as batch_op:
+        batch_op.add_column(sa.Column('provider_status', sa.String(length=16), nullable=True))
+        batch_op.add_column(sa.Column('attempts', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('next_attempt_at', sa.DateTime(), nullable=True))
+        batch_op.add_column(sa.Column('claimed_at', sa.DateTime(), nullable=True))
+        batch_op.add_column(sa.Column('processed_at', sa.DateTime(), nullable=True))
+        batch_op.add_column(sa.Column('last_error', sa.Text(), nullable=True))
+    op.create_index('ix_payments_status_next_attempt_at', 'payments', ['status', 'next_attempt_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_payments_status_next_attempt_at', table_name='payments')
+    with op.batch_alter_table('payments') as batch_op:
+        batch_op.drop_column('last_error')
+        batch_op.drop_column('processed_at')
+        batch_op.drop_column('claimed_at')
+        batch_op.drop_column('next_attempt_at')
+        batch_op.drop_column('attempts')
+        batch_op.drop_column('provider_status')
@@ -0,0 +1,132 @@
+# benchmarks/bench_indexes.py
+#
+# Планы и время запросов к queries/users до и после индексов из миграции 0003.
+# Запуск: python benchmarks/bench_indexes.py [--rows 1000000] [--users 50000]
+
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+INDEXES = [
+    "CREATE INDEX ix_queries_user_id_timestamp ON queries (user_id, timestamp)",
+    "CREATE INDEX ix_users_is_premium_premium_expiration ON users (is_premium, premium_expiration)",
+]
+
+NOW = datetime(2024, 3, 15, 12, 0, 0)
+
+
+def fmt(dt):
+    return dt.strftime('%Y-%m-%d %H:%M:%S.%f')
+
+
+def build(path, rows, users):
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.execute("""CREATE TABLE users (
+        id INTEGER PRIMARY KEY, username VARCHAR, chat_id INTEGER, first_name VARCHAR, last_name VARCHAR,
+        is_premium BOOLEAN, premium_expiration DATETIME, last_message_time DATETIME,
+        message_count INTEGER, last_feedback_time DATETIME)""")
+    conn.execute("""CREATE TABLE queries (
+        id INTEGER PRIMARY KEY, user_id INTEGER REFERENCES users (id),
+        text VARCHAR, response VARCHAR, timestamp DATETIME)""")
+
+    rnd = random.Random(42)
+    user_rows = []
+    for user_id in range(1, users + 1):
+        premium = rnd.random() < 0.1
+        expiration = fmt(NOW + timedelta(days=rnd.randint(-30, 30))) if premium else None
+        user_rows.append((user_id, f'user{user_id}', user_id, 'Name', None, premium, expiration))
+    conn.executemany(
+        "INSERT INTO users (id, username, chat_id, first_name, last_name, is_premium, premium_expiration) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)", user_rows)
+
+    # Время вопросов возрастает, как в реальном журнале; user_id распределен неравномерно
+    start = NOW - timedelta(days=90)
+    step = timedelta(days=90) / rows
+    batch = []
+    for i in range(rows):
+        user_id = min(int(rnd.paretovariate(1.2)), users)
+        batch.append((user_id, 'question text', 'response text ' * 4, fmt(start + step * i)))
+        if len(batch) == 50000:
+            conn.executemany("INSERT INTO queries (user_id, text, response, timestamp) VALUES (?, ?, ?, ?)", batch)
+            batch = []
+    if batch:
+        conn.executemany("INSERT INTO queries (user_id, text, response, timestamp) VALUES (?, ?, ?, ?)", batch)
+    conn.commit()
+    return conn
+
+
+def workload(users):
+    hour_ago = fmt(NOW - timedelta(hours=1))
+    return [
+        ("last 20 queries of a user",
+         "SELECT id, text, response, timestamp FROM queries WHERE user_id = ? ORDER BY timestamp DESC LIMIT 20",
+         lambda rnd: (rnd.randint(1, users),)),
+        ("queries of a user in the last hour",
+         "SELECT count(*) FROM queries WHERE user_id = ? AND timestamp >= ?",
+         lambda rnd: (rnd.randint(1, users), hour_ago)),
+        ("expired premium users",
+         "SELECT id FROM users WHERE is_premium = 1 AND premium_expiration < ?",
+         lambda rnd: (fmt(NOW),)),
+    ]
+
+
+def run(conn, users, repeat):
+    results = {}
+    for name, sql, params in workload(users):
+        rnd = random.Random(7)
+        plan = conn.execute("EXPLAIN QUERY PLAN " + sql, params(rnd)).fetchall()
+        started = time.perf_counter()
+        for _ in range(repeat):
+            conn.execute(sql, params(rnd)).fetchall()
+        elapsed = (time.perf_counter() - started) / repeat
+        results[name] = (elapsed, [row[-1] for row in plan])
+    return results
+
+
+def report(title, results):
+    print(f"\n== {title}")
+    for name, (elapsed, plan) in results.items():
+        print(f"{name}: {elapsed * 1000:.3f} ms")
+        for line in plan:
+            print(f"    {line}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query plans and timings for the queries/users indexes")
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--users', type=int, default=50000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        started = time.perf_counter()
+        conn = build(os.path.join(tmp, 'bench.db'), args.rows, args.users)
+        print(f"built {args.rows} queries / {args.users} users in {time.perf_counter() - started:.1f} s")
+
+        before = run(conn, args.users, args.repeat)
+        report("without indexes", before)
+
+        started = time.perf_counter()
+        for statement in INDEXES:
+            conn.execute(statement)
+        conn.execute("ANALYZE")
+        conn.commit()
+        print(f"\nindexes created in {time.perf_counter() - started:.1f} s")
+
+        after = run(conn, args.users, args.repeat)
+        report("with indexes", after)
+
+        print("\n== speedup")
+        for name in before:
+            print(f"{name}: x{before[name][0] / after[name][0]:.1f}")
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+# benchmarks/bench_markdown.py
+#
+# Время перевода больших синтетических ответов в MarkdownV2: прежняя пара регулярных выражений
+# против bot.utils.markdown. Запуск: python benchmarks/bench_markdown.py [--size 20000] [--repeat 200]
+# Перед замером проверяются известные регрессии рендера (REGRESSIONS)
+
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+
+# Прежняя реализация из bot/utils/helpers.py - только для сравнения
+def format_code_block(response_text):
+    pattern = r'```(\w+)?\s*(.+?)\s*```'
+    return re.sub(pattern, r'```\n\2\n```', response_text, flags=re.DOTALL)
+
+
+def escape_markdown_v2(text):
+    parts = re.split(r'(```.*?```)', text, flags=re.DOTALL)
+    escaped_parts = []
+    for part in parts:
+        if part.startswith('```') and part.endswith('```'):
+            escaped_parts.append(part)
+        else:
+            escaped_parts.append(re.sub(r'([_*\[\]()~`>#\+=\-|{}\.!])', r'\\\1', part))
+    return ''.join(escaped_parts)
+
+
+WORDS = ['порт', 'сканер', 'request', 'payload', 'socket', 'connect()', 'v1.2', 'a+b', 'x_y', '#tag', '{key}', '!']
+
+
+def synthetic_response(size, rnd):
+    parts = []
+    length = 0
+    while length < size:
+        kind = rnd.random()
+        if kind < 0.2:
+            lines = [f"    result = scan(host, port={rnd.randint(1, 65535)})  # `{rnd.choice(WORDS)}`"
+                     for _ in range(rnd.randint(3, 15))]
+            part = "```python\n" + "\n".join(lines) + "\n```"
+        elif kind < 0.3:
+            part = "## " + " ".join(rnd.choice(WORDS) for _ in range(5))
+        elif kind < 0.5:
+            part = "\n".join(f"- **{rnd.choice(WORDS)}**: use `{rnd.choice(WORDS)}` and *{rnd.choice(WORDS)}*"
+                             for _ in range(rnd.randint(2, 6)))
+        else:
+            part = " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(20, 80))) + "."
+        parts.append(part)
+        length += len(part) + 2
+    return "\n\n".join(parts)
+
+
+# Известные ответы, которые рендер когда-то портил: перед замером проверяем, что результат не изменился
+REGRESSIONS = [
+    ('*use my_var here*', ['_use my\\_var here_']),
+    ('_see some_func for details_', ['_see some\\_func for details_']),
+    ('_*', ['\\_\\*']),
+]
+
+
+def check_regressions(render_chunks):
+    for text, expected in REGRESSIONS:
+        result = render_chunks(text)
+        assert result == expected, f"render_chunks({text!r}) = {result!r}, expected {expected!r}"
+
+
+def bench(name, fn, samples, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for sample in samples:
+            fn(sample)
+    elapsed = (time.perf_counter() - started) / (repeat * len(samples))
+    print(f"{name:<28} {elapsed * 1e6:10.1f} us/response")
+    return elapsed
+
+
+def main():
+    # Импорт здесь: synthetic_response используют заглушки нагрузочного теста до настройки окружения бота
+    from bot.utils.markdown import render, render_chunks
+
+    parser = argparse.ArgumentParser(description="MarkdownV2 rendering micro-benchmark")
+    parser.add_argument('--size', type=int, default=20000, help="approximate response size, characters")
+    parser.add_argument('--samples', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    check_regressions(render_chunks)
+    rnd = random.Random(42)
+    samples = [synthetic_response(args.size, rnd) for _ in range(args.samples)]
+    print(f"{args.samples} responses of ~{args.size} chars, {args.repeat} rounds")
+
+    old = bench("regex (previous)", lambda text: escape_markdown_v2(format_code_block(text)), samples, args.repeat)
+    new = bench("render", render, samples, args.repeat)
+    bench("render_chunks (4096)", render_chunks, samples, args.repeat)
+    print(f"render vs regex: x{old / new:.2f}")
+
+    chunks = [len(render_chunks(sample)) for sample in samples]
+    print(f"messages per response: min {min(chunks)}, max {max(chunks)}")
+
+
+if __name__ == '__main__':
+    main()
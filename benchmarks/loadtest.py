@@ -0,0 +1,226 @@
+# benchmarks/loadtest.py
+#
+# Нагрузочный тест обработки сообщений: заглушки HackerGPT и Bot API поднимаются локально, синтетические
+# Update с заданной частотой проходят через handle_message из bot/main.py в пуле update_executor.
+# База - временный файл SQLite. Результат печатается и сохраняется в JSON для сравнения версий:
+#   python benchmarks/loadtest.py --rate 20 --duration 30 --users 200 --latency 0.5 --output results.json
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stubs import start_hackergpt_stub, start_telegram_stub  # noqa: E402
+
+TOKEN = '123456:LOADTEST'
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def configure_environment(args, workdir, hackergpt_url):
+    # Модули бота создают движок, клиентов и пулы при импорте - окружение задается до него
+    os.environ.update({
+        'DATABASE_URL': f"sqlite:///{os.path.join(workdir, 'loadtest.db')}",
+        'HACKERGPT_LINK': hackergpt_url + '/',
+        'HACKERGPT_API_KEY': 'loadtest',
+        'TELEGRAM_BOT_TOKEN': TOKEN,
+        'BOT_WORKERS': str(args.workers),
+        'BOT_MAX_PENDING_UPDATES': '0',
+        'STREAM_RESPONSES': 'true' if args.stream else 'false',
+        'RESPONSE_CACHE_ENABLED': 'true' if args.cache else 'false',
+        'METRICS_PORT': '0',
+        'LOG_LEVEL': args.log_level,
+        'BOT_LOG_FILE': os.path.join(workdir, 'bot.log'),
+        'STREAM_EDIT_INTERVAL': str(args.edit_interval),
+    })
+
+
+def make_update(bot, update_id, user_id, text):
+    from telegram import Update
+    return Update.de_json({
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private', 'first_name': f'user{user_id}'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}', 'username': f'user{user_id}'},
+            'text': text,
+        },
+    }, bot)
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run(args):
+    workdir = tempfile.mkdtemp(prefix='loadtest-')
+    hackergpt = start_hackergpt_stub(args.latency, args.jitter, args.size, args.error_rate)
+    telegram = start_telegram_stub(args.telegram_latency)
+    configure_environment(args, workdir, hackergpt.url)
+
+    from queue import Queue
+    from telegram import Bot
+    from telegram.ext import CallbackContext, Dispatcher
+    from telegram.utils.request import Request
+    from bot import main as bot_main
+    from bot.api.telegram_dispatcher import telegram_dispatcher
+    from bot.database.query_writer import query_writer
+    from bot.database.storage import init_db, storage_stats
+    from bot.utils.metrics import stage_duration, stage_errors
+    from bot.utils.rate_limiter import rate_limiter
+
+    init_db()
+    telegram_dispatcher.API_URL = f'{telegram.url}/bot{TOKEN}/sendMessage'
+    # Уведомления о новых пользователях идут в один чат администратора, с паузой 1 с между ними
+    # выход из теста ждал бы их минутами; на путь обработки сообщения это не влияет
+    telegram_dispatcher.chat_interval = 0
+    if not args.respect_limits:
+        # Лимиты вопросов в час иначе остановят почти все сообщения уже в первую минуту
+        rate_limiter.limit_regular = rate_limiter.limit_premium = 10 ** 9
+
+    bot = Bot(TOKEN, base_url=f'{telegram.url}/bot', request=Request(con_pool_size=args.workers + 4))
+    dispatcher = Dispatcher(bot, Queue(), workers=1, use_context=True)
+    executor = bot_main.update_executor
+
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+
+    def handle(update, context, scheduled_at):
+        try:
+            bot_main.handle_message(update, context)
+        except Exception:
+            with lock:
+                errors[0] += 1
+            raise
+        finally:
+            with lock:
+                latencies.append(time.perf_counter() - scheduled_at)
+
+    total = int(args.rate * args.duration)
+    interval = 1.0 / args.rate
+    started = time.perf_counter()
+    rejected = 0
+    for index in range(total):
+        # Открытая модель нагрузки: апдейты приходят по расписанию, не дожидаясь обработки предыдущих
+        scheduled_at = started + index * interval
+        delay = scheduled_at - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        user_id = 1000 + index % args.users
+        update = make_update(bot, index + 1, user_id, f"{args.text} #{index}")
+        context = CallbackContext.from_update(update, dispatcher)
+        if not executor.submit(user_id, handle, update, context, scheduled_at):
+            rejected += 1
+    sent_at = time.perf_counter()
+
+    deadline = time.monotonic() + args.drain_timeout
+    while time.monotonic() < deadline:
+        with lock:
+            done = len(latencies)
+        if done + rejected >= total:
+            break
+        time.sleep(0.05)
+    finished_at = time.perf_counter()
+    query_writer.close()
+
+    with lock:
+        samples = sorted(latencies)
+    stages = {key[0]: value for key, value in stage_duration.snapshot().items()}
+    db_stages = {stage: value for stage, value in stages.items() if stage.startswith('db.')}
+    db_time = sum(value['sum'] for value in db_stages.values())
+    completed = len(samples)
+    results = {
+        'sent': total,
+        'completed': completed,
+        'rejected': rejected,
+        'errors': errors[0],
+        'send_duration': sent_at - started,
+        'duration': finished_at - started,
+        'throughput': completed / (finished_at - started) if completed else 0.0,
+        'latency': {
+            'avg': sum(samples) / completed if completed else 0.0,
+            'p50': percentile(samples, 0.5),
+            'p95': percentile(samples, 0.95),
+            'p99': percentile(samples, 0.99),
+            'max': samples[-1] if samples else 0.0,
+        },
+        'db': {
+            'time_total': db_time,
+            'time_per_update': db_time / completed if completed else 0.0,
+            'storage': storage_stats(),
+        },
+        'stages': {stage: dict(value, avg=value['sum'] / value['count'] if value['count'] else 0.0)
+                   for stage, value in sorted(stages.items())},
+        'stage_errors': {f'{stage}:{error}': count for (stage, error), count in stage_errors.snapshot().items()},
+        'executor': executor.stats(),
+        'upstream_requests': {'hackergpt': hackergpt.requests, 'telegram': telegram.requests},
+    }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Message-handling load test with stub HackerGPT and Bot API")
+    parser.add_argument('--rate', type=float, default=10, help="updates per second")
+    parser.add_argument('--duration', type=float, default=20, help="seconds of load")
+    parser.add_argument('--users', type=int, default=100, help="distinct users (chats)")
+    parser.add_argument('--workers', type=int, default=8, help="BOT_WORKERS")
+    parser.add_argument('--latency', type=float, default=0.5, help="HackerGPT stub delay, seconds")
+    parser.add_argument('--jitter', type=float, default=0.1, help="HackerGPT stub delay deviation, seconds")
+    parser.add_argument('--size', type=int, default=2000, help="HackerGPT response size, characters")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="share of HackerGPT 503 answers")
+    parser.add_argument('--telegram-latency', type=float, default=0.02, help="Bot API stub delay, seconds")
+    parser.add_argument('--stream', action='store_true', help="use streaming responses")
+    parser.add_argument('--cache', action='store_true', help="enable the response cache")
+    parser.add_argument('--edit-interval', type=float, default=1.0, help="STREAM_EDIT_INTERVAL")
+    parser.add_argument('--respect-limits', action='store_true', help="keep the per-hour question limits")
+    parser.add_argument('--text', default='Как просканировать порты?')
+    parser.add_argument('--drain-timeout', type=float, default=120)
+    parser.add_argument('--log-level', default='WARNING')
+    parser.add_argument('--output', help="write results to this JSON file")
+    args = parser.parse_args()
+
+    results = run(args)
+    latency = results['latency']
+    print(f"sent {results['sent']}, completed {results['completed']}, rejected {results['rejected']}, "
+          f"errors {results['errors']}")
+    print(f"throughput {results['throughput']:.1f} updates/s over {results['duration']:.1f}s")
+    print(f"latency p50 {latency['p50'] * 1000:.0f} ms, p95 {latency['p95'] * 1000:.0f} ms, "
+          f"p99 {latency['p99'] * 1000:.0f} ms, max {latency['max'] * 1000:.0f} ms")
+    print(f"db time {results['db']['time_per_update'] * 1000:.2f} ms/update, "
+          f"lock wait avg {results['db']['storage']['lock_wait_avg'] * 1000:.2f} ms")
+    for stage, value in results['stages'].items():
+        print(f"  {stage:<40} {value['count']:>7} x {value['avg'] * 1000:9.2f} ms")
+
+    if args.output:
+        report = {
+            'revision': git_revision(),
+            'timestamp': datetime.utcnow().isoformat(),
+            'config': vars(args),
+            'results': results,
+        }
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False, default=str)
+        print(f"results saved to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+# benchmarks/stubs.py
+#
+# Локальные заглушки внешних сервисов для нагрузочных тестов: HackerGPT (HACKERGPT_LINK) с заданной
+# задержкой и размером ответа и Telegram Bot API, отвечающий на sendMessage/editMessageText и getUpdates.
+# Отдельный запуск заглушки HackerGPT: python benchmarks/stubs.py --port 18080 --latency 0.5 --size 2000
+
+import argparse
+import itertools
+import json
+import os
+import random
+import sys
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import parse_qsl
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from bench_markdown import synthetic_response  # noqa: E402
+
+
+class _StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+    def __init__(self, address, handler):
+        super().__init__(address, handler)
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def count(self):
+        with self._lock:
+            self.requests += 1
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+
+class _QuietHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def _reply(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class HackerGPTStubHandler(_QuietHandler):
+    def do_POST(self):
+        server = self.server
+        server.count()
+        try:
+            request = json.loads(self._read_body() or b'{}')
+        except ValueError:
+            request = {}
+        # Ошибки upstream с заданной вероятностью - для проверки повторов и отказоустойчивости
+        if server.error_rate and random.random() < server.error_rate:
+            time.sleep(server.latency)
+            self._reply(503, b'{"error": "stub overloaded"}', 'application/json')
+            return
+        delay = max(0.0, random.gauss(server.latency, server.jitter)) if server.jitter else server.latency
+        text = server.responses[next(server.counter) % len(server.responses)]
+        if not request.get('stream'):
+            time.sleep(delay)
+            self._reply(200, text.encode('utf-8'), 'text/plain; charset=utf-8')
+            return
+        # Поток SSE: первая часть после половины задержки, остальное равномерно
+        parts = [text[i:i + 200] for i in range(0, len(text), 200)] or ['']
+        events = [b'data: ' + json.dumps({'choices': [{'delta': {'content': part}}]}).encode('utf-8') + b'\n\n'
+                  for part in parts] + [b'data: [DONE]\n\n']
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream; charset=utf-8')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        time.sleep(delay / 2)
+        step = delay / 2 / len(events)
+        for event in events:
+            self.wfile.write(f'{len(event):X}\r\n'.encode() + event + b'\r\n')
+            self.wfile.flush()
+            time.sleep(step)
+        self.wfile.write(b'0\r\n\r\n')
+
+
+def start_hackergpt_stub(latency=0.5, jitter=0.0, size=2000, error_rate=0.0, host='127.0.0.1', port=0, seed=42):
+    server = _StubServer((host, port), HackerGPTStubHandler)
+    server.latency = latency
+    server.jitter = jitter
+    server.error_rate = error_rate
+    rnd = random.Random(seed)
+    server.responses = [synthetic_response(size, rnd) for _ in range(20)]
+    server.counter = itertools.count()
+    threading.Thread(target=server.serve_forever, name='hackergpt-stub', daemon=True).start()
+    return server
+
+
+class TelegramStubHandler(_QuietHandler):
+    def do_POST(self):
+        server = self.server
+        server.count()
+        body = self._read_body()
+        content_type = self.headers.get('Content-Type', '')
+        try:
+            params = json.loads(body) if 'json' in content_type and body else {}
+        except ValueError:
+            params = {}
+        if not params and body:
+            params = dict(parse_qsl(body.decode('utf-8', 'replace')))
+        method = self.path.rsplit('/', 1)[-1]
+        if server.latency:
+            time.sleep(server.latency)
+        if method == 'getMe':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'loadtest', 'username': 'loadtest_bot'}
+        elif method in ('sendMessage', 'editMessageText'):
+            chat_id = int(params.get('chat_id') or 0)
+            result = {
+                'message_id': int(params.get('message_id') or next(server.message_ids)),
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'},
+                'text': params.get('text', ''),
+            }
+        elif method == 'getUpdates':
+            # Long polling без входящих апдейтов: держим запрос, но не дольше секунды
+            time.sleep(min(float(params.get('timeout') or 0), 1.0))
+            result = []
+        else:
+            result = True
+        payload = json.dumps({'ok': True, 'result': result}).encode('utf-8')
+        self._reply(200, payload, 'application/json')
+
+
+def start_telegram_stub(latency=0.0, host='127.0.0.1', port=0):
+    server = _StubServer((host, port), TelegramStubHandler)
+    server.latency = latency
+    server.message_ids = itertools.count(1)
+    threading.Thread(target=server.serve_forever, name='telegram-stub', daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stub HackerGPT endpoint")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=18080)
+    parser.add_argument('--latency', type=float, default=0.5, help="response delay, seconds")
+    parser.add_argument('--jitter', type=float, default=0.0, help="standard deviation of the delay, seconds")
+    parser.add_argument('--size', type=int, default=2000, help="response size, characters")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="share of requests answered with 503")
+    args = parser.parse_args()
+    server = start_hackergpt_stub(args.latency, args.jitter, args.size, args.error_rate, args.host, args.port)
+    print(f"HackerGPT stub on {server.url}/ (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+# benchmarks/webhook_stub.py
+#
+# Заглушка Telegram для проверки режима webhook локально: шлет JSON апдейтов с секретным заголовком,
+# как это делает Bot API. Запуск (бот с BOT_MODE=webhook и пустым WEBHOOK_URL):
+#   python benchmarks/webhook_stub.py --url http://127.0.0.1:8443/telegram --secret $WEBHOOK_SECRET_TOKEN
+
+import argparse
+import itertools
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+def make_update(update_id, user_id, text):
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private', 'first_name': f'user{user_id}'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}'},
+            'text': text,
+        },
+    }
+
+
+def post(url, secret, payload):
+    request = urllib.request.Request(url, data=json.dumps(payload).encode('utf-8'), method='POST',
+                                     headers={'Content-Type': 'application/json', SECRET_HEADER: secret})
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except OSError:
+        status = 'error'
+    return status, time.perf_counter() - started
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Posts synthetic Telegram updates to the bot webhook")
+    parser.add_argument('--url', default='http://127.0.0.1:8443/telegram')
+    parser.add_argument('--secret', required=True)
+    parser.add_argument('--count', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=10, help="parallel connections, like max_connections")
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--text', default='/start')
+    parser.add_argument('--first-update-id', type=int, default=1)
+    args = parser.parse_args()
+
+    update_ids = itertools.count(args.first_update_id)
+    lock = threading.Lock()
+    statuses = {}
+    latencies = []
+
+    def send(index):
+        with lock:
+            update_id = next(update_ids)
+        status, latency = post(args.url, args.secret, make_update(update_id, 1000 + index % args.users, args.text))
+        with lock:
+            statuses[status] = statuses.get(status, 0) + 1
+            latencies.append(latency)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(send, range(args.count)))
+    elapsed = time.perf_counter() - started
+
+    print(f"{args.count} updates in {elapsed:.2f}s ({args.count / elapsed:.0f}/s)")
+    print("statuses: " + ", ".join(f"{status}: {count}" for status, count in sorted(statuses.items(), key=str)))
+    print(f"latency p50 {percentile(latencies, 0.5) * 1000:.1f} ms, p95 {percentile(latencies, 0.95) * 1000:.1f} ms, "
+          f"p99 {percentile(latencies, 0.99) * 1000:.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+# bot/api/admission.py
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from bot.utils.metrics import stage_duration
+from config.settings import (ADMISSION_MAX_CONCURRENT, ADMISSION_MAX_QUEUE, ADMISSION_QUEUE_TIMEOUT,
+                             ADMISSION_PREMIUM_HEAD_START, ADMISSION_POSITION_INTERVAL)
+
+class AdmissionRejected(Exception):
+    pass
+
+class _Waiter:
+    __slots__ = ('key', 'premium', 'granted', 'cancelled')
+
+    def __init__(self, key, premium):
+        self.key = key
+        self.premium = premium
+        self.granted = False
+        self.cancelled = False
+
+# Ограничение одновременных запросов к HackerGPT с очередью по приоритету.
+# Ключ очереди - время постановки, у премиум-запроса уменьшенное на head_start: премиум обгоняет
+# обычные запросы, пришедшие не раньше чем за head_start секунд, а дольше ждущий обычный запрос
+# оказывается впереди новых премиум-запросов, так что очередь не голодает.
+# Не дождавшийся места за queue_timeout запрос получает AdmissionRejected
+class PriorityAdmission:
+    def __init__(self, max_concurrent=ADMISSION_MAX_CONCURRENT, max_queue=ADMISSION_MAX_QUEUE,
+                 queue_timeout=ADMISSION_QUEUE_TIMEOUT, premium_head_start=ADMISSION_PREMIUM_HEAD_START,
+                 position_interval=ADMISSION_POSITION_INTERVAL):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.premium_head_start = premium_head_start
+        self.position_interval = position_interval
+        self._cond = threading.Condition()
+        self._heap = []
+        self._sequence = itertools.count()
+        self._active = 0
+        self._queued = {True: 0, False: 0}
+        self._admitted = {True: 0, False: 0}
+        self._shed = {True: 0, False: 0}
+        self._rejected = 0
+        self._wait_time_total = {True: 0.0, False: 0.0}
+
+    @contextmanager
+    def slot(self, premium=False, on_position=None):
+        # on_position(position) вызывается вне блокировки, пока запрос ждет, и не чаще position_interval
+        if not self.max_concurrent:
+            yield
+            return
+        self.acquire(premium, on_position)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def acquire(self, premium=False, on_position=None):
+        started = time.monotonic()
+        with self._cond:
+            if self._active < self.max_concurrent and not (self._queued[True] or self._queued[False]):
+                # В куче могут остаться только записи отказавшихся по таймауту
+                self._heap.clear()
+                self._active += 1
+                self._admitted[premium] += 1
+                self._observe(premium, 0.0)
+                return
+            if self.max_queue and self._queued[True] + self._queued[False] >= self.max_queue:
+                self._rejected += 1
+                raise AdmissionRejected("admission queue is full")
+            key = started - (self.premium_head_start if premium else 0.0)
+            waiter = _Waiter(key, premium)
+            heapq.heappush(self._heap, (key, next(self._sequence), waiter))
+            self._queued[premium] += 1
+
+        deadline = started + self.queue_timeout
+        shown_position = None
+        next_report = started
+        while True:
+            with self._cond:
+                now = time.monotonic()
+                if waiter.granted:
+                    self._admitted[premium] += 1
+                    self._observe(premium, now - started)
+                    return
+                if now >= deadline:
+                    # Запись остается в куче и пропускается при выдаче места
+                    waiter.cancelled = True
+                    self._queued[premium] -= 1
+                    self._shed[premium] += 1
+                    self._observe(premium, now - started, admitted=False)
+                    raise AdmissionRejected(f"no upstream slot within {self.queue_timeout}s")
+                position = self._position(waiter) if on_position else None
+            if on_position and position != shown_position and now >= next_report:
+                shown_position = position
+                next_report = now + self.position_interval
+                try:
+                    on_position(position)
+                except Exception as e:
+                    logging.warning(f"Could not report queue position: {e}")
+            with self._cond:
+                if not waiter.granted:
+                    remaining = deadline - time.monotonic()
+                    self._cond.wait(min(remaining, self.position_interval) if on_position else remaining)
+
+    def release(self):
+        with self._cond:
+            self._active -= 1
+            while self._heap and self._active < self.max_concurrent:
+                _, _, waiter = heapq.heappop(self._heap)
+                if waiter.cancelled:
+                    continue
+                waiter.granted = True
+                self._queued[waiter.premium] -= 1
+                self._active += 1
+            self._cond.notify_all()
+
+    def _position(self, waiter):
+        return 1 + sum(1 for key, _, other in self._heap
+                       if not other.cancelled and not other.granted and key < waiter.key)
+
+    def _observe(self, premium, wait_time, admitted=True):
+        if admitted:
+            self._wait_time_total[premium] += wait_time
+        stage_duration.observe('admission.wait.premium' if premium else 'admission.wait.regular', value=wait_time)
+
+    def stats(self):
+        with self._cond:
+            stats = {
+                'max_concurrent': self.max_concurrent,
+                'active': self._active,
+                'queued': self._queued[True] + self._queued[False],
+                'rejected': self._rejected,
+            }
+            for premium, name in ((True, 'premium'), (False, 'regular')):
+                admitted = self._admitted[premium]
+                stats[name] = {
+                    'queued': self._queued[premium],
+                    'admitted': admitted,
+                    'shed': self._shed[premium],
+                    'wait_time_avg': self._wait_time_total[premium] / admitted if admitted else 0.0,
+                }
+            return stats
+
+# Один на процесс: общий лимит для всех потоков пула обработки
+admission = PriorityAdmission()
@@ -0,0 +1,175 @@
+# bot/api/balancer.py
+
+import logging
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+from bot.api.resilience import CircuitBreaker, CircuitOpenError, UpstreamUnavailable, OPEN
+from config.settings import (HACKERGPT_LINK, HACKERGPT_API_KEY, HACKERGPT_ENDPOINTS, HACKERGPT_ENDPOINT_MAX_CONCURRENT,
+                             CLUSTER_WORKERS, BALANCER_EWMA_DECAY, BALANCER_INITIAL_LATENCY, BALANCER_EJECT_ERROR_RATE,
+                             BALANCER_EJECT_MIN_REQUESTS)
+
+def process_share(max_concurrent, workers=CLUSTER_WORKERS):
+    # Лимит ключа общий для всех процессов, а считается в памяти каждого: в кластере воркер получает
+    # свою долю. Меньше одного запроса на воркер не бывает, поэтому лимит меньше числа воркеров превышается
+    if not max_concurrent or workers <= 1:
+        return max_concurrent
+    if max_concurrent < workers:
+        logging.warning(f"Endpoint limit {max_concurrent} is below CLUSTER_WORKERS={workers}, "
+                        f"each worker still gets 1 concurrent request")
+    return max(1, max_concurrent // workers)
+
+def parse_endpoints(spec=HACKERGPT_ENDPOINTS, default_url=HACKERGPT_LINK, default_key=HACKERGPT_API_KEY,
+                    default_max_concurrent=HACKERGPT_ENDPOINT_MAX_CONCURRENT, workers=CLUSTER_WORKERS):
+    # "url|key|max_concurrent,url|key" - ключ и лимит можно опустить, тогда берутся HACKERGPT_API_KEY
+    # и HACKERGPT_ENDPOINT_MAX_CONCURRENT; без HACKERGPT_ENDPOINTS - один HACKERGPT_LINK
+    endpoints = []
+    for item in (spec or '').split(','):
+        parts = [part.strip() for part in item.split('|')]
+        if not parts[0]:
+            continue
+        url = parts[0]
+        api_key = parts[1] if len(parts) > 1 and parts[1] else default_key
+        max_concurrent = int(parts[2]) if len(parts) > 2 and parts[2] else default_max_concurrent
+        endpoints.append(Endpoint(str(len(endpoints)), url, api_key, process_share(max_concurrent, workers)))
+    if not endpoints and default_url:
+        endpoints.append(Endpoint('0', default_url, default_key, process_share(default_max_concurrent, workers)))
+    return endpoints
+
+# Адрес HackerGPT со своим ключом: лимит одновременных запросов на ключ, EWMA задержки и доли ошибок,
+# размыкатель цепи - исключение из ротации и возврат после пробного запроса
+class Endpoint:
+    def __init__(self, name, url, api_key, max_concurrent=0):
+        self.name = name
+        self.url = url
+        self.api_key = api_key
+        self.max_concurrent = max_concurrent
+        self.breaker = CircuitBreaker(f'hackergpt {name} ({urlsplit(url).netloc})')
+        self.outstanding = 0
+        self.requests = 0
+        self.errors = 0
+        self.ejected = 0
+        self.latency = BALANCER_INITIAL_LATENCY
+        self.error_rate = 0.0
+
+    def available(self):
+        return self.breaker.state != OPEN and (not self.max_concurrent or self.outstanding < self.max_concurrent)
+
+    def score(self):
+        # Меньше - лучше: ожидаемое время ответа с учетом уже отправленных запросов, ошибки штрафуются
+        return self.latency * (self.outstanding + 1) / (1.0 - min(self.error_rate, 0.9))
+
+    def stats(self):
+        return {
+            'outstanding': self.outstanding,
+            'max_concurrent': self.max_concurrent,
+            'requests': self.requests,
+            'errors': self.errors,
+            'ejected': self.ejected,
+            'latency_ewma': self.latency,
+            'error_rate_ewma': self.error_rate,
+            'breaker': self.breaker.stats(),
+        }
+
+# Выданный запросу адрес: record() - итог попытки (задержка до ответа), release() - запрос завершен
+class Lease:
+    def __init__(self, balancer, endpoint):
+        self.balancer = balancer
+        self.endpoint = endpoint
+        self.started = time.monotonic()
+        self._released = False
+
+    def record(self, ok, latency=True):
+        self.balancer.observe(self.endpoint, time.monotonic() - self.started if latency else None, ok)
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self.balancer.release(self.endpoint)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+# Выбор адреса для каждой попытки: из доступных (цепь не разомкнута, лимит ключа не исчерпан)
+# берется адрес с наименьшей оценкой EWMA задержки * (запросов в работе + 1)
+class Balancer:
+    def __init__(self, endpoints, decay=BALANCER_EWMA_DECAY, eject_error_rate=BALANCER_EJECT_ERROR_RATE,
+                 eject_min_requests=BALANCER_EJECT_MIN_REQUESTS):
+        self.endpoints = endpoints
+        self.decay = decay
+        self.eject_error_rate = eject_error_rate
+        self.eject_min_requests = eject_min_requests
+        self._cond = threading.Condition()
+        self._waits = 0
+
+    def check(self):
+        # Быстрый отказ, пока все адреса исключены из ротации
+        if all(endpoint.breaker.state == OPEN for endpoint in self.endpoints):
+            raise CircuitOpenError("all HackerGPT endpoints are ejected")
+
+    def acquire(self, timeout):
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                candidates = [endpoint for endpoint in self.endpoints if endpoint.available()]
+                # Случайный порядок перед сортировкой: при равных оценках нагрузка делится поровну
+                random.shuffle(candidates)
+                for endpoint in sorted(candidates, key=Endpoint.score):
+                    try:
+                        endpoint.breaker.allow()
+                    except CircuitOpenError:
+                        # Полуоткрытая цепь уже пропустила свои пробные запросы
+                        continue
+                    endpoint.outstanding += 1
+                    endpoint.requests += 1
+                    return Lease(self, endpoint)
+                if all(endpoint.breaker.state == OPEN for endpoint in self.endpoints):
+                    raise CircuitOpenError("all HackerGPT endpoints are ejected")
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise UpstreamUnavailable("all HackerGPT endpoints are at their concurrency limit")
+                # Все ключи заняты до предела - ждем завершения любого запроса; раз в секунду
+                # заново проверяем цепи, которые могли перейти к пробе
+                self._waits += 1
+                self._cond.wait(min(remaining, 1.0))
+
+    def release(self, endpoint):
+        with self._cond:
+            endpoint.outstanding -= 1
+            self._cond.notify()
+
+    def observe(self, endpoint, latency, ok):
+        with self._cond:
+            if latency is not None:
+                endpoint.latency += self.decay * (latency - endpoint.latency)
+            endpoint.error_rate += self.decay * ((0.0 if ok else 1.0) - endpoint.error_rate)
+            if not ok:
+                endpoint.errors += 1
+            eject = (not ok and endpoint.requests >= self.eject_min_requests
+                     and endpoint.error_rate >= self.eject_error_rate)
+            if eject:
+                # После возврата адрес начинает с чистой статистикой ошибок
+                endpoint.error_rate = 0.0
+                endpoint.ejected += 1
+        if ok:
+            endpoint.breaker.record_success()
+        elif eject:
+            endpoint.breaker.trip()
+        else:
+            endpoint.breaker.record_failure()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'endpoints_total': len(self.endpoints),
+                'endpoints_available': sum(1 for endpoint in self.endpoints if endpoint.breaker.state != OPEN),
+                'capacity_waits': self._waits,
+                'endpoints': {endpoint.name: endpoint.stats() for endpoint in self.endpoints},
+            }
+
+# Один на процесс: оценки задержек и лимиты ключей общие для всех экземпляров HackerGPTAPI
+hackergpt_balancer = Balancer(parse_endpoints())
@@ -1,14 +1,17 @@
 # bot/api/freekassa.py
 
 import hashlib
-from datetime import datetime
-import logging
-import requests
 import os
-from config.settings import TELEGRAM_BOT_TOKEN, MERCHANT_ID, SECRET_KEY_1
+import uuid
+from bot.api.telegram_dispatcher import telegram_dispatcher
+from config.settings import MERCHANT_ID, SECRET_KEY_1
+
+def new_order_id():
+    # Случайный uuid4: номера заказов не совпадают ни между пользователями, ни между процессами
+    return uuid.uuid4().hex
 
 def generate_payment_link(user_id, amount, merchant_id=MERCHANT_ID, SECRET_KEY_1=SECRET_KEY_1, currency="RUB", lang="ru"):
-    order_id = str(int(datetime.now().timestamp()))
+    order_id = new_order_id()
 
     # Формирование строки подписи
     sign_str = f"{merchant_id}:{amount}:{SECRET_KEY_1}:{currency}:{order_id}"
@@ -22,19 +25,6 @@ def get_chat_id_for_user(user_id, db_manager):
     user = db_manager.get_user_by_id(user_id)
     return user.chat_id if user else None
 
-# Функция для отправки уведомлений в Telegram
+# Функция для отправки уведомлений в Telegram: сообщение ставится в очередь, отправка - в фоне
 def send_telegram_notification(user_id, message, db_manager):
-    chat_id = get_chat_id_for_user(user_id, db_manager)
-    if not chat_id:
-        logging.error(f"Chat ID not found for user {user_id}")
-        return
-    telegram_api_url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
-    data = {
-        'chat_id': chat_id,
-        'text': message
-    }
-    try:
-        response = requests.post(telegram_api_url, data=data)
-        response.raise_for_status()
-    except requests.exceptions.RequestException as e:
-        logging.error(f"Error sending Telegram notification: {e}")
+    telegram_dispatcher.notify_user(user_id, message, db_manager)
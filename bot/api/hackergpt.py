@@ -2,36 +2,137 @@
 
 import requests
 import logging
-from os import getenv
-from requests.adapters import HTTPAdapter
-from requests.packages.urllib3.util.retry import Retry
-from config.settings import HACKERGPT_API_KEY, HACKERGPT_LINK
+import json
+import time
+from bot.api.http_client import get_http_client
+from bot.api.admission import admission
+from bot.api.resilience import hackergpt_retry, UpstreamUnavailable
+from bot.api.balancer import hackergpt_balancer
+from bot.utils.metrics import track, stage_duration
+from config.settings import HACKERGPT_ATTEMPT_TIMEOUT
 
 class HackerGPTAPI:
-    API_URL = HACKERGPT_LINK
-    API_KEY = HACKERGPT_API_KEY
-    TIMEOUT = 20  # Timeout for API requests
+    TIMEOUT = HACKERGPT_ATTEMPT_TIMEOUT  # Timeout for one attempt, cut to what is left of the deadline
 
     def __init__(self):
-        if not self.API_KEY:
+        # Endpoints come from HACKERGPT_ENDPOINTS or HACKERGPT_LINK; each needs its key
+        self.balancer = hackergpt_balancer
+        if not self.balancer.endpoints or not all(endpoint.api_key for endpoint in self.balancer.endpoints):
             raise ValueError("API key for HackerGPT is not set in environment variables.")
+        # Shared keep-alive client, so repeated calls skip the TCP+TLS handshake
+        self.client = get_http_client()
+        self.retry = hackergpt_retry
 
-    def send_message(self, message_history):
-        headers = {
+    @staticmethod
+    def _headers(endpoint):
+        return {
             'Content-Type': 'application/json',
-            'Authorization': f'Bearer {self.API_KEY}'
+            'Authorization': f'Bearer {endpoint.api_key}'
         }
+
+    def send_message(self, message_history, premium=False, on_queue_position=None):
         data = {
             'model': 'hackergpt',
             'messages': message_history
         }
-        session = requests.Session()
-        retries = Retry(total=5, backoff_factor=1, status_forcelist=[502, 503, 504])
-        session.mount('https://', HTTPAdapter(max_retries=retries))
-        try:
-            response = session.post(self.API_URL, json=data, headers=headers, timeout=self.TIMEOUT)
+
+        def attempt(endpoint, timeout):
+            response = self.client.post(endpoint.url, json=data, headers=self._headers(endpoint), timeout=timeout)
             response.raise_for_status()
             return response.text
-        except requests.exceptions.RequestException as e:
-            logging.error(f"API Request error: {e}")
-            raise
+
+        # While every endpoint is ejected, fail before taking a place in the admission queue
+        self.balancer.check()
+        # Замер включает повторы; ожидание допуска считается отдельно
+        with admission.slot(premium, on_queue_position), track('hackergpt.send_message'):
+            try:
+                text, lease = self.retry.call(attempt, self.balancer)
+            except (requests.exceptions.RequestException, UpstreamUnavailable) as e:
+                logging.error(f"API Request error: {e}")
+                raise
+            lease.release()
+            return text
+
+    def stream_message(self, message_history, premium=False, on_queue_position=None):
+        data = {
+            'model': 'hackergpt',
+            'messages': message_history,
+            'stream': True
+        }
+
+        def attempt(endpoint, timeout):
+            response = self.client.post(endpoint.url, json=data, headers=self._headers(endpoint), timeout=timeout,
+                                        stream=True)
+            try:
+                response.raise_for_status()
+            except requests.exceptions.HTTPError:
+                response.close()
+                raise
+            return response
+
+        self.balancer.check()
+        # The admission slot and the endpoint are held until the stream is read; the stage covers the whole
+        # stream, time to the first chunk is recorded separately. Retries cover the request up to the
+        # response headers; once chunks have been shown, there is no retry
+        with admission.slot(premium, on_queue_position), track('hackergpt.stream_message'):
+            started = time.perf_counter()
+            try:
+                response, lease = self.retry.call(attempt, self.balancer)
+            except (requests.exceptions.RequestException, UpstreamUnavailable) as e:
+                logging.error(f"API Request error: {e}")
+                raise
+            # Leaving the with-block releases the connection back to the pool
+            with lease, response:
+                content_type = response.headers.get('Content-Type', '')
+                # requests falls back to ISO-8859-1 for text/* without charset; SSE is always UTF-8
+                if 'charset' not in content_type:
+                    response.encoding = 'utf-8'
+                if 'text/event-stream' in content_type:
+                    chunks = self._iter_sse(response)
+                else:
+                    # Plain chunked body: forward chunks as they arrive
+                    chunks = (chunk for chunk in response.iter_content(chunk_size=None, decode_unicode=True) if chunk)
+                first = True
+                try:
+                    for chunk in chunks:
+                        if first:
+                            stage_duration.observe('hackergpt.first_chunk', value=time.perf_counter() - started)
+                            first = False
+                        yield chunk
+                except requests.exceptions.RequestException as e:
+                    # A stream cut off midway counts against the endpoint too
+                    lease.record(False, latency=False)
+                    logging.error(f"API stream error: {e}")
+                    raise
+
+    @staticmethod
+    def _iter_sse(response):
+        done = False
+        for line in response.iter_lines(chunk_size=None, decode_unicode=True):
+            # Read to the end even after [DONE] so the connection goes back to the pool intact
+            if done or not line or not line.startswith('data:'):
+                continue
+            payload = line[5:].strip()
+            if payload == '[DONE]':
+                done = True
+                continue
+            try:
+                event = json.loads(payload)
+            except ValueError:
+                yield payload
+                continue
+            if isinstance(event, dict) and event.get('choices'):
+                choice = event['choices'][0]
+                content = (choice.get('delta') or {}).get('content') or choice.get('text')
+            elif isinstance(event, dict):
+                content = event.get('content')
+            else:
+                content = str(event)
+            if content:
+                yield content
+
+    def pool_stats(self):
+        return self.client.pool_stats()
+
+    def resilience_stats(self):
+        return dict(self.retry.stats(), balancer=self.balancer.stats())
@@ -0,0 +1,126 @@
+# bot/api/http_client.py
+
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.poolmanager import PoolManager
+from requests.packages.urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from requests.packages.urllib3.util.retry import Retry
+from config.settings import HACKERGPT_POOL_CONNECTIONS, HACKERGPT_POOL_MAXSIZE, HACKERGPT_POOL_BLOCK
+
+class PoolStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.connections_opened = 0
+        self.connections_reused = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+    def record_checkout(self, wait_time, reused):
+        with self._lock:
+            self.checkouts += 1
+            if reused:
+                self.connections_reused += 1
+            else:
+                self.connections_opened += 1
+            self.wait_time_total += wait_time
+            if wait_time > self.wait_time_max:
+                self.wait_time_max = wait_time
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'checkouts': self.checkouts,
+                'connections_opened': self.connections_opened,
+                'connections_reused': self.connections_reused,
+                'wait_time_total': self.wait_time_total,
+                'wait_time_avg': self.wait_time_total / self.checkouts if self.checkouts else 0.0,
+                'wait_time_max': self.wait_time_max,
+            }
+
+class _InstrumentedPoolMixin:
+    stats = None
+
+    def _get_conn(self, timeout=None):
+        # При pool_block=True здесь же ждем свободное соединение, поэтому замер включает очередь
+        started = time.monotonic()
+        conn = super()._get_conn(timeout=timeout)
+        if self.stats is not None:
+            # Сокет остается открытым у соединения, вернувшегося в пул живым
+            reused = getattr(conn, 'sock', None) is not None
+            self.stats.record_checkout(time.monotonic() - started, reused)
+        return conn
+
+class InstrumentedHTTPConnectionPool(_InstrumentedPoolMixin, HTTPConnectionPool):
+    pass
+
+class InstrumentedHTTPSConnectionPool(_InstrumentedPoolMixin, HTTPSConnectionPool):
+    pass
+
+class InstrumentedPoolManager(PoolManager):
+    def __init__(self, stats, **kwargs):
+        super().__init__(**kwargs)
+        self.stats = stats
+        self.pool_classes_by_scheme = {
+            'http': InstrumentedHTTPConnectionPool,
+            'https': InstrumentedHTTPSConnectionPool,
+        }
+
+    def _new_pool(self, scheme, host, port, request_context=None):
+        pool = super()._new_pool(scheme, host, port, request_context=request_context)
+        pool.stats = self.stats
+        return pool
+
+class PooledHTTPAdapter(HTTPAdapter):
+    def __init__(self, stats, **kwargs):
+        self.stats = stats
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        self._pool_connections = connections
+        self._pool_maxsize = maxsize
+        self._pool_block = block
+        self.poolmanager = InstrumentedPoolManager(
+            self.stats, num_pools=connections, maxsize=maxsize, block=block, **pool_kwargs
+        )
+
+class HTTPClient:
+    def __init__(self, pool_connections=HACKERGPT_POOL_CONNECTIONS, pool_maxsize=HACKERGPT_POOL_MAXSIZE,
+                 pool_block=HACKERGPT_POOL_BLOCK, max_retries=None):
+        if max_retries is None:
+            # Повторы со сроком и размыкателем делает bot/api/resilience.py; здесь - ни одного
+            max_retries = Retry(total=0, read=False)
+        self.stats = PoolStats()
+        self.session = requests.Session()
+        adapter = PooledHTTPAdapter(
+            self.stats,
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            pool_block=pool_block,
+            max_retries=max_retries,
+        )
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def post(self, url, **kwargs):
+        return self.session.post(url, **kwargs)
+
+    def pool_stats(self):
+        return self.stats.snapshot()
+
+    def close(self):
+        self.session.close()
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_http_client():
+    # Один клиент на процесс: все экземпляры HackerGPTAPI делят пул keep-alive соединений
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = HTTPClient()
+    return _client
@@ -0,0 +1,115 @@
+# bot/api/payment_processor.py
+
+import atexit
+import logging
+import threading
+from datetime import datetime, timedelta
+from bot.api.freekassa import send_telegram_notification
+from bot.database.manager import db_manager
+from config.settings import (PAYMENT_POLL_INTERVAL, PAYMENT_BATCH_SIZE, PAYMENT_MAX_ATTEMPTS, PAYMENT_RETRY_BASE_DELAY,
+                             PAYMENT_CLAIM_TIMEOUT, PREMIUM_DURATION_DAYS)
+
+PAID_MESSAGE = "Ваша подписка активирована! Наслаждайтесь премиум-возможностями."
+FAILED_MESSAGE = "Не удалось обработать ваш платеж."
+
+# Фоновая обработка сохраненных уведомлений кассы: активация премиума и уведомление пользователя.
+# Веб-хук только будит поток; платежи берутся из таблицы payments, поэтому события, принятые
+# процессом, который потом упал, подхватит любой другой воркер
+class PaymentProcessor:
+    def __init__(self, db_manager=db_manager, poll_interval=PAYMENT_POLL_INTERVAL, batch_size=PAYMENT_BATCH_SIZE,
+                 max_attempts=PAYMENT_MAX_ATTEMPTS, retry_base_delay=PAYMENT_RETRY_BASE_DELAY,
+                 claim_timeout=PAYMENT_CLAIM_TIMEOUT):
+        self.db_manager = db_manager
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_base_delay = retry_base_delay
+        self.claim_timeout = claim_timeout
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._counts = {'processed': 0, 'paid': 0, 'failed': 0, 'retried': 0, 'gave_up': 0}
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='payment-processor', daemon=True)
+            self._thread.start()
+
+    def notify(self):
+        # Вызывается веб-хуком после сохранения события
+        self.start()
+        self._wakeup.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wakeup.clear()
+            try:
+                claimed = self.process_pending()
+            except Exception:
+                logging.exception("Unexpected error in payment processor")
+                claimed = 0
+            if claimed < self.batch_size:
+                self._wakeup.wait(self.poll_interval)
+
+    def process_pending(self):
+        rows = self.db_manager.claim_payments(self.batch_size, self.claim_timeout)
+        for row in rows:
+            self._process(row)
+        return len(rows)
+
+    def _process(self, row):
+        try:
+            user = self.db_manager.get_user_by_id(row.user_id)
+            if row.provider_status == '1':
+                if user is None:
+                    raise LookupError(f"user {row.user_id} not found")
+                premium_days = PREMIUM_DURATION_DAYS
+                status, message = 'paid', PAID_MESSAGE
+            else:
+                premium_days = 0
+                status, message = 'failed', FAILED_MESSAGE
+            if not self.db_manager.complete_payment(row.id, row.user_id, status, premium_days):
+                raise RuntimeError("could not save payment result")
+        except (LookupError, RuntimeError) as e:
+            self._retry(row, str(e))
+            return
+        # Уведомление уходит в очередь telegram_dispatcher, у которого свои повторы
+        if user is not None and user.chat_id:
+            send_telegram_notification(row.user_id, message, self.db_manager)
+        else:
+            logging.error(f"Chat ID not found for user {row.user_id}")
+        logging.info(f"Payment {row.order_id} for user {row.user_id} processed: {status}")
+        self._record(status)
+
+    def _retry(self, row, error):
+        give_up = row.attempts + 1 >= self.max_attempts
+        delay = self.retry_base_delay * 2 ** row.attempts
+        self.db_manager.retry_payment(row.id, datetime.utcnow() + timedelta(seconds=delay), error, give_up)
+        with self._lock:
+            self._counts['gave_up' if give_up else 'retried'] += 1
+        if give_up:
+            logging.error(f"Payment {row.order_id} for user {row.user_id} failed after {row.attempts + 1} attempts: {error}")
+        else:
+            logging.warning(f"Payment {row.order_id} will be retried in {delay}s: {error}")
+
+    def _record(self, status):
+        with self._lock:
+            self._counts['processed'] += 1
+            self._counts[status] += 1
+
+    def close(self, timeout=10):
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counts)
+
+payment_processor = PaymentProcessor()
+atexit.register(payment_processor.close)
@@ -0,0 +1,207 @@
+# bot/api/resilience.py
+
+import logging
+import random
+import threading
+import time
+import requests
+from config.settings import (HACKERGPT_DEADLINE, HACKERGPT_ATTEMPT_TIMEOUT, HACKERGPT_MAX_ATTEMPTS,
+                             HACKERGPT_RETRY_BASE_DELAY, HACKERGPT_RETRY_MAX_DELAY, BREAKER_FAILURE_THRESHOLD,
+                             BREAKER_RECOVERY_TIMEOUT, BREAKER_HALF_OPEN_CALLS)
+
+CLOSED, HALF_OPEN, OPEN = 'closed', 'half_open', 'open'
+STATE_CODES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Повтор не поможет, но виноват адрес, а не запрос: отозванный ключ, нет доступа, неверный URL
+ENDPOINT_FAULT_STATUSES = (401, 403, 404)
+
+class UpstreamUnavailable(Exception):
+    pass
+
+class CircuitOpenError(UpstreamUnavailable):
+    pass
+
+class DeadlineExceeded(UpstreamUnavailable):
+    pass
+
+def is_endpoint_fault(error):
+    return (isinstance(error, requests.exceptions.HTTPError) and error.response is not None
+            and error.response.status_code in ENDPOINT_FAULT_STATUSES)
+
+def is_retryable(error):
+    # Сбой соединения, таймаут или ответ перегруженного upstream; остальные 4xx повтор не исправит
+    if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+    if isinstance(error, requests.exceptions.HTTPError) and error.response is not None:
+        return error.response.status_code in RETRY_STATUSES
+    return False
+
+# Размыкатель цепи: после failure_threshold сбоев подряд запросы сразу получают CircuitOpenError.
+# Через recovery_timeout пропускается до half_open_calls пробных запросов: успех замыкает цепь,
+# сбой снова размыкает ее на recovery_timeout
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold=BREAKER_FAILURE_THRESHOLD, recovery_timeout=BREAKER_RECOVERY_TIMEOUT,
+                 half_open_calls=BREAKER_HALF_OPEN_CALLS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_calls = half_open_calls
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+        self._opened = 0
+        self._rejected = 0
+        self._successes = 0
+        self._failures_total = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state(time.monotonic())
+
+    def _current_state(self, now):
+        if self._state == OPEN and now - self._opened_at >= self.recovery_timeout:
+            self._state = HALF_OPEN
+            self._probes = 0
+            logging.info(f"Circuit {self.name} is half-open, probing upstream")
+        return self._state
+
+    def check(self):
+        # Быстрый отказ до постановки в очереди: цепь разомкнута и время пробы еще не пришло
+        with self._lock:
+            if self._current_state(time.monotonic()) == OPEN:
+                self._rejected += 1
+                raise CircuitOpenError(f"circuit {self.name} is open")
+
+    def allow(self):
+        with self._lock:
+            state = self._current_state(time.monotonic())
+            if state == CLOSED:
+                return
+            if state == HALF_OPEN and self._probes < self.half_open_calls:
+                self._probes += 1
+                return
+            self._rejected += 1
+            raise CircuitOpenError(f"circuit {self.name} is {state}")
+
+    def record_success(self):
+        with self._lock:
+            self._successes += 1
+            self._failures = 0
+            if self._state != CLOSED:
+                logging.info(f"Circuit {self.name} closed")
+                self._state = CLOSED
+
+    def record_failure(self):
+        with self._lock:
+            self._failures_total += 1
+            self._failures += 1
+            if self._state == HALF_OPEN or (self._state == CLOSED and self._failures >= self.failure_threshold):
+                logging.error(f"Circuit {self.name} opened after {self._failures} consecutive failures")
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+                self._opened += 1
+
+    def trip(self):
+        # Принудительное размыкание, например по доле ошибок у балансировщика
+        with self._lock:
+            self._failures_total += 1
+            if self._state != OPEN:
+                logging.error(f"Circuit {self.name} opened by error rate")
+                self._opened += 1
+            self._state = OPEN
+            self._opened_at = time.monotonic()
+
+    def stats(self):
+        with self._lock:
+            state = self._current_state(time.monotonic())
+            return {
+                'state': STATE_CODES[state],
+                'open': state == OPEN,
+                'consecutive_failures': self._failures,
+                'successes': self._successes,
+                'failures': self._failures_total,
+                'opened': self._opened,
+                'rejected': self._rejected,
+            }
+
+# Повторы в пределах общего срока запроса: таймаут попытки урезается до остатка срока,
+# пауза - случайная от 0 до base * 2**attempt (не больше max_delay), и если она не помещается в срок,
+# повтора не будет
+class RetryPolicy:
+    def __init__(self, deadline=HACKERGPT_DEADLINE, attempt_timeout=HACKERGPT_ATTEMPT_TIMEOUT,
+                 max_attempts=HACKERGPT_MAX_ATTEMPTS, base_delay=HACKERGPT_RETRY_BASE_DELAY,
+                 max_delay=HACKERGPT_RETRY_MAX_DELAY):
+        self.deadline = deadline
+        self.attempt_timeout = attempt_timeout
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._lock = threading.Lock()
+        self._calls = 0
+        self._retries = 0
+        self._deadline_exceeded = 0
+
+    def call(self, fn, balancer):
+        # fn(endpoint, timeout) выполняет одну попытку; каждая попытка получает адрес у балансировщика,
+        # так что повтор уходит на лучший на этот момент адрес. Возвращает (результат, lease) -
+        # адрес остается занятым, пока вызывающий не освободит lease
+        deadline = time.monotonic() + self.deadline
+        with self._lock:
+            self._calls += 1
+        attempt = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self._count_deadline()
+                raise DeadlineExceeded(f"no response within {self.deadline}s")
+            lease = balancer.acquire(remaining)
+            try:
+                result = fn(lease.endpoint, min(self.attempt_timeout, deadline - time.monotonic()))
+            except requests.exceptions.RequestException as e:
+                lease.release()
+                if not is_retryable(e):
+                    if is_endpoint_fault(e):
+                        lease.record(False)
+                    else:
+                        # Ошибка самого запроса (400, 413 и т.п.): адрес она не штрафует
+                        lease.record(True, latency=False)
+                    raise
+                lease.record(False)
+                attempt += 1
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+                if attempt >= self.max_attempts:
+                    raise
+                if time.monotonic() + delay >= deadline:
+                    self._count_deadline()
+                    raise
+                logging.warning(f"Upstream attempt {attempt} via endpoint {lease.endpoint.name} failed, "
+                                f"retrying in {delay:.2f}s: {e}")
+                with self._lock:
+                    self._retries += 1
+                time.sleep(delay)
+                continue
+            except Exception:
+                # Иначе пробный запрос полуоткрытой цепи остался бы незавершенным навсегда
+                lease.release()
+                lease.record(False)
+                raise
+            lease.record(True)
+            return result, lease
+
+    def _count_deadline(self):
+        with self._lock:
+            self._deadline_exceeded += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'calls': self._calls,
+                'retries': self._retries,
+                'deadline_exceeded': self._deadline_exceeded,
+            }
+
+# Общий для всех экземпляров HackerGPTAPI процесса
+hackergpt_retry = RetryPolicy()
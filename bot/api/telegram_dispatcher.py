@@ -0,0 +1,284 @@
+# bot/api/telegram_dispatcher.py
+
+import atexit
+import heapq
+import itertools
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+import requests
+from urllib3.util.retry import Retry
+from bot.api.http_client import HTTPClient
+from config.settings import (TELEGRAM_BOT_TOKEN, TELEGRAM_BASE_URL, TELEGRAM_SEND_RATE, TELEGRAM_CHAT_INTERVAL, TELEGRAM_SENDER_THREADS,
+                             TELEGRAM_SEND_QUEUE_SIZE, TELEGRAM_SEND_MAX_ATTEMPTS, TELEGRAM_CHAT_ID_CACHE_SIZE)
+
+DELIVERED = 'delivered'
+FAILED = 'failed'
+BLOCKED = 'blocked'  # 403: пользователь заблокировал бота или удалил аккаунт
+
+class OutgoingMessage:
+    def __init__(self, text, chat_id=None, user_id=None, db_manager=None, params=None, on_result=None):
+        self.text = text
+        self.chat_id = chat_id
+        self.user_id = user_id
+        self.db_manager = db_manager
+        self.params = params or {}
+        self.on_result = on_result
+        self.attempts = 0
+        self.enqueued_at = time.monotonic()
+
+# Общий для всех потоков лимит Bot API на отправку (сообщений в секунду).
+# Запас burst по умолчанию - одно сообщение: отправки идут ровно, без всплеска в начале секунды
+class TokenBucket:
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(float(self.burst), self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if now >= self._paused_until and self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = max(self._paused_until - now, (1 - self._tokens) / self.rate)
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0.0
+
+# Очередь исходящих сообщений: вызывающий код только ставит сообщение в очередь,
+# потоки отправки соблюдают общий лимит и паузу между сообщениями в один чат, повторяют 429 через retry_after
+class TelegramDispatcher:
+    API_URL = f"{TELEGRAM_BASE_URL}{TELEGRAM_BOT_TOKEN}/sendMessage"
+    TIMEOUT = 10
+
+    def __init__(self, rate=TELEGRAM_SEND_RATE, chat_interval=TELEGRAM_CHAT_INTERVAL, threads=TELEGRAM_SENDER_THREADS,
+                 max_queue=TELEGRAM_SEND_QUEUE_SIZE, max_attempts=TELEGRAM_SEND_MAX_ATTEMPTS,
+                 chat_id_cache_size=TELEGRAM_CHAT_ID_CACHE_SIZE):
+        self.chat_interval = chat_interval
+        self.threads = threads
+        self.max_queue = max_queue
+        self.max_attempts = max_attempts
+        self.chat_id_cache_size = chat_id_cache_size
+        self.bucket = TokenBucket(rate)
+        # sendMessage не идемпотентен: повторяем только ошибки соединения, остальное решает _send
+        self.client = HTTPClient(pool_connections=1, pool_maxsize=threads, pool_block=True,
+                                 max_retries=Retry(total=3, connect=3, read=0, status=0, backoff_factor=0.5))
+        self._heap = []  # (когда можно отправлять, порядковый номер, сообщение)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._next_chat_slot = {}  # chat_id -> время, раньше которого в чат не пишем
+        self._chat_ids = OrderedDict()  # user_id -> chat_id
+        self._in_flight = 0
+        self._workers = []
+        self._closed = False
+        self._counts = {'queued': 0, 'rejected': 0, DELIVERED: 0, FAILED: 0, BLOCKED: 0, 'retried': 0,
+                        'rate_limited': 0, 'chat_id_hits': 0, 'chat_id_misses': 0}
+        self._latency_total = 0.0
+
+    def _ensure_started(self):
+        if self._workers:
+            return
+        with self._cond:
+            if self._workers:
+                return
+            for index in range(self.threads):
+                worker = threading.Thread(target=self._run, name=f'telegram-sender-{index}', daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+    def _push(self, ready_at, message):
+        heapq.heappush(self._heap, (ready_at, next(self._seq), message))
+        self._cond.notify()
+
+    def _enqueue(self, message):
+        with self._cond:
+            if self._closed or len(self._heap) >= self.max_queue:
+                self._counts['rejected'] += 1
+                logging.warning(f"Telegram send queue is full, dropping message to {message.chat_id or message.user_id}")
+                return False
+            self._counts['queued'] += 1
+            self._push(time.monotonic(), message)
+        self._ensure_started()
+        return True
+
+    def send(self, chat_id, text, on_result=None, **params):
+        return self._enqueue(OutgoingMessage(text, chat_id=chat_id, params=params, on_result=on_result))
+
+    def notify_user(self, user_id, text, db_manager, on_result=None, **params):
+        # chat_id ищется уже в потоке отправки, вызывающий код в базу не ходит
+        return self._enqueue(OutgoingMessage(text, user_id=user_id, db_manager=db_manager, params=params,
+                                             on_result=on_result))
+
+    def remember_chat_id(self, user_id, chat_id):
+        with self._cond:
+            self._chat_ids[int(user_id)] = chat_id
+            self._chat_ids.move_to_end(int(user_id))
+            while len(self._chat_ids) > self.chat_id_cache_size:
+                self._chat_ids.popitem(last=False)
+
+    def _resolve_chat_id(self, message):
+        user_id = int(message.user_id)
+        with self._cond:
+            chat_id = self._chat_ids.get(user_id)
+            if chat_id is not None:
+                self._chat_ids.move_to_end(user_id)
+                self._counts['chat_id_hits'] += 1
+                return chat_id
+            self._counts['chat_id_misses'] += 1
+        user = message.db_manager.get_user_by_id(user_id) if message.db_manager else None
+        chat_id = user.chat_id if user else None
+        if chat_id:
+            self.remember_chat_id(user_id, chat_id)
+        return chat_id
+
+    def _next_ready(self):
+        # Вызывается под self._cond: ждет сообщение, время которого подошло
+        while True:
+            now = time.monotonic()
+            if self._heap and self._heap[0][0] <= now:
+                self._in_flight += 1
+                return heapq.heappop(self._heap)[2]
+            if self._closed and not self._heap:
+                return None
+            self._cond.wait(self._heap[0][0] - now if self._heap else None)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                message = self._next_ready()
+            if message is None:
+                return
+            try:
+                self._process(message)
+            except Exception:
+                logging.exception("Unexpected error in Telegram sender")
+                self._finish(message, FAILED)
+            finally:
+                with self._cond:
+                    self._in_flight -= 1
+                    self._cond.notify_all()
+
+    def _process(self, message):
+        if message.chat_id is None:
+            message.chat_id = self._resolve_chat_id(message)
+            if not message.chat_id:
+                logging.error(f"Chat ID not found for user {message.user_id}")
+                self._finish(message, FAILED)
+                return
+        # Сначала пауза чата, потом общий лимит: отложенное сообщение не должно тратить токен,
+        # иначе поток сообщений в один чат тормозит все остальные
+        with self._cond:
+            now = time.monotonic()
+            slot = self._next_chat_slot.get(message.chat_id, 0.0)
+            if slot > now:
+                # В этот чат писали меньше chat_interval назад - откладываем, не занимая поток.
+                # Бесконечность - другой поток уже ждет токен для этого чата
+                self._push(slot if slot != math.inf else now + self.chat_interval, message)
+                return
+            self._next_chat_slot[message.chat_id] = math.inf
+        self.bucket.acquire()
+        with self._cond:
+            # Время отправки в чат фиксируем уже после ожидания токена
+            now = time.monotonic()
+            self._next_chat_slot[message.chat_id] = now + self.chat_interval
+            if len(self._next_chat_slot) > 10 * self.chat_id_cache_size:
+                self._next_chat_slot = {chat: at for chat, at in self._next_chat_slot.items() if at > now}
+        self._send(message)
+
+    def _retry(self, message, delay):
+        with self._cond:
+            self._counts['retried'] += 1
+            self._push(time.monotonic() + delay, message)
+
+    def _send(self, message):
+        message.attempts += 1
+        data = dict(message.params, chat_id=message.chat_id, text=message.text)
+        try:
+            response = self.client.post(self.API_URL, data=data, timeout=self.TIMEOUT)
+        except requests.exceptions.RequestException as e:
+            logging.error(f"Error sending Telegram message to {message.chat_id}: {e}")
+            if message.attempts < self.max_attempts:
+                self._retry(message, 2 ** message.attempts)
+            else:
+                self._finish(message, FAILED)
+            return
+        if response.status_code == 200:
+            self._finish(message, DELIVERED)
+            return
+        try:
+            retry_after = response.json().get('parameters', {}).get('retry_after')
+        except ValueError:
+            retry_after = None
+        if response.status_code == 429 and retry_after is not None:
+            # Telegram сообщает, сколько ждать: пауза общая, чтобы не получить 429 и на другие чаты
+            logging.warning(f"Telegram flood limit, retrying chat {message.chat_id} in {retry_after}s")
+            with self._cond:
+                self._counts['rate_limited'] += 1
+                self._next_chat_slot[message.chat_id] = time.monotonic() + retry_after
+            self.bucket.pause(retry_after)
+            if message.attempts < self.max_attempts:
+                self._retry(message, retry_after)
+            else:
+                self._finish(message, FAILED)
+        elif response.status_code >= 500 and message.attempts < self.max_attempts:
+            self._retry(message, 2 ** message.attempts)
+        else:
+            logging.error(f"Error sending Telegram message to {message.chat_id}: {response.status_code} {response.text}")
+            self._finish(message, BLOCKED if response.status_code == 403 else FAILED)
+
+    def _finish(self, message, result):
+        with self._cond:
+            self._counts[result] += 1
+            if result == DELIVERED:
+                self._latency_total += time.monotonic() - message.enqueued_at
+        if message.on_result:
+            try:
+                message.on_result(message, result)
+            except Exception:
+                logging.exception("Error in Telegram send result callback")
+
+    def flush(self, timeout=None):
+        # Ждет, пока очередь опустеет и все отправки завершатся
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._heap or self._in_flight:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def close(self, timeout=10):
+        if self._workers:
+            self.flush(timeout)
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        for worker in self._workers:
+            worker.join(timeout)
+        self.client.close()
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._counts)
+            stats['queue_depth'] = len(self._heap)
+            stats['in_flight'] = self._in_flight
+            stats['delivery_latency_avg'] = (self._latency_total / self._counts[DELIVERED]
+                                             if self._counts[DELIVERED] else 0.0)
+        stats['pool'] = self.client.pool_stats()
+        return stats
+
+telegram_dispatcher = TelegramDispatcher()
+atexit.register(telegram_dispatcher.close)
@@ -0,0 +1,324 @@
+# bot/cluster.py
+
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+from telegram import Bot, Update
+from telegram.error import TelegramError, RetryAfter
+from telegram.utils.request import Request
+from config.settings import (TELEGRAM_BOT_TOKEN, TELEGRAM_BASE_URL, ADMIN_TELEGRAM_ID, BOT_MODE, BOT_LOG_FILE,
+                             METRICS_LISTEN, METRICS_PORT, WEBHOOK_QUEUE_SIZE, CLUSTER_WORKERS, CLUSTER_QUEUE_SIZE,
+                             CLUSTER_HEARTBEAT_INTERVAL, CLUSTER_HEARTBEAT_TIMEOUT, CLUSTER_POLL_TIMEOUT)
+
+def shard_for(user_id, workers):
+    return user_id % workers
+
+def update_key(update):
+    # Все апдейты пользователя идут в один воркер: история, лимиты и кеши живут в его памяти
+    if update.effective_user:
+        return update.effective_user.id
+    if update.effective_chat:
+        return update.effective_chat.id
+    return 0
+
+def worker_log_file(index, log_file=BOT_LOG_FILE):
+    # Ротация по размеру рассчитана на один процесс: у каждого воркера свой файл
+    if not log_file:
+        return log_file
+    root, ext = os.path.splitext(log_file)
+    return f'{root}-worker{index}{ext}'
+
+def run_worker(index, workers, updates, status, heartbeat_interval):
+    # Воркер: обычный диспетчер с пулом update_executor; апдейты приходят из очереди главного процесса.
+    # Ctrl+C обрабатывает главный процесс и присылает None, после чего воркер дорабатывает очередь
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    from bot import main as bot_main
+    from bot.utils.broadcast import broadcast_runner
+
+    updater, persistence = bot_main.create_updater()
+    bot_main.register_metrics(persistence, start_server=False)
+    dispatcher = updater.dispatcher
+    dispatcher_ready = threading.Event()
+    updater.job_queue.start()
+    threading.Thread(target=dispatcher.start, kwargs={'ready': dispatcher_ready},
+                     name='dispatcher', daemon=True).start()
+    dispatcher_ready.wait()
+
+    # Рассылку запускает администратор, значит она принадлежит его воркеру
+    if shard_for(ADMIN_TELEGRAM_ID, workers) == index:
+        broadcast_runner.resume_interrupted()
+
+    processed = [0]
+    stopping = threading.Event()
+
+    def heartbeat():
+        while not stopping.is_set():
+            status.put({
+                'index': index,
+                'pid': os.getpid(),
+                'time': time.time(),
+                'processed': processed[0],
+                'executor': bot_main.update_executor.stats(),
+            })
+            stopping.wait(heartbeat_interval)
+
+    threading.Thread(target=heartbeat, name='cluster-heartbeat', daemon=True).start()
+    logging.info(f"Cluster worker {index} started, pid {os.getpid()}")
+
+    while True:
+        data = updates.get()
+        if data is None:
+            break
+        try:
+            update = Update.de_json(data, updater.bot)
+        except (ValueError, TypeError, KeyError) as e:
+            logging.error(f"Cluster worker {index} got a malformed update: {e}")
+            continue
+        dispatcher.update_queue.put(update)
+        processed[0] += 1
+
+    stopping.set()
+    dispatcher.stop()
+    updater.job_queue.stop()
+    bot_main.shutdown(persistence)
+    logging.info(f"Cluster worker {index} stopped after {processed[0]} updates")
+
+class _Worker:
+    def __init__(self, index, updates):
+        self.index = index
+        self.updates = updates
+        self.process = None
+        self.started_at = 0.0
+        self.routed = 0
+        self.restarts = 0
+        self.lost = 0
+        self.heartbeat = None
+
+# Главный процесс: получает апдейты (polling или webhook), раздает их воркерам по user_id,
+# следит за heartbeat и перезапускает упавшие или зависшие воркеры
+class Cluster:
+    def __init__(self, workers=CLUSTER_WORKERS, queue_size=CLUSTER_QUEUE_SIZE,
+                 heartbeat_interval=CLUSTER_HEARTBEAT_INTERVAL, heartbeat_timeout=CLUSTER_HEARTBEAT_TIMEOUT):
+        # spawn: воркер не наследует потоки, соединения и блокировки главного процесса
+        self._context = multiprocessing.get_context('spawn')
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_timeout = heartbeat_timeout
+        self.queue_size = queue_size
+        self._status = self._context.Queue()
+        self._workers = [_Worker(index, self._context.Queue(queue_size)) for index in range(workers)]
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._monitor = None
+
+    def start(self):
+        for worker in self._workers:
+            self._start_worker(worker)
+        self._monitor = threading.Thread(target=self._run_monitor, name='cluster-monitor', daemon=True)
+        self._monitor.start()
+
+    def _start_worker(self, worker):
+        process = self._context.Process(
+            target=run_worker, name=f'bot-worker-{worker.index}',
+            args=(worker.index, len(self._workers), worker.updates, self._status, self.heartbeat_interval))
+        # Настройки читаются из окружения при импорте, а оно копируется в процесс при запуске
+        previous = os.environ.get('BOT_LOG_FILE')
+        os.environ['BOT_LOG_FILE'] = worker_log_file(worker.index)
+        try:
+            process.start()
+        finally:
+            if previous is None:
+                os.environ.pop('BOT_LOG_FILE', None)
+            else:
+                os.environ['BOT_LOG_FILE'] = previous
+        worker.process = process
+        worker.started_at = time.monotonic()
+        worker.heartbeat = None
+        logging.info(f"Started cluster worker {worker.index}, pid {process.pid}")
+
+    def _worker_for(self, update):
+        return self._workers[shard_for(update_key(update), len(self._workers))]
+
+    def put(self, update, block=True, timeout=None):
+        worker = self._worker_for(update)
+        with self._lock:
+            updates = worker.updates
+        updates.put(update.to_dict(), block, timeout)
+        with self._lock:
+            worker.routed += 1
+
+    def put_nowait(self, update):
+        self.put(update, block=False)
+
+    def qsize(self):
+        # Для WebhookServer: суммарная глубина; переполнение одного воркера - queue.Full из put_nowait
+        return sum(self._depth(worker) for worker in self._workers)
+
+    @staticmethod
+    def _depth(worker):
+        try:
+            return worker.updates.qsize()
+        except NotImplementedError:
+            return 0
+
+    def _run_monitor(self):
+        while not self._stop.is_set():
+            deadline = time.monotonic() + self.heartbeat_interval
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    beat = self._status.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                worker = self._workers[beat['index']]
+                # Сигнал от уже замененного процесса не считается
+                if worker.process is not None and worker.process.pid == beat['pid']:
+                    with self._lock:
+                        worker.heartbeat = dict(beat, received_at=time.monotonic())
+            if not self._stop.is_set():
+                self._check_health()
+
+    def _healthy(self, worker, now):
+        if not worker.process.is_alive():
+            return False
+        last = worker.heartbeat['received_at'] if worker.heartbeat else worker.started_at
+        return now - last <= self.heartbeat_timeout
+
+    def _check_health(self):
+        now = time.monotonic()
+        for worker in self._workers:
+            if self._healthy(worker, now):
+                continue
+            process = worker.process
+            logging.error(f"Cluster worker {worker.index} (pid {process.pid}) is "
+                          f"{'not responding' if process.is_alive() else f'dead, exit code {process.exitcode}'}, restarting")
+            if process.is_alive():
+                process.kill()
+            process.join(5)
+            # Убитый процесс мог держать блокировку чтения очереди, поэтому новому воркеру - новая очередь;
+            # апдейты, которые не успел забрать прежний, теряются
+            lost = self._depth(worker)
+            if lost:
+                logging.error(f"Cluster worker {worker.index} lost {lost} queued updates")
+            with self._lock:
+                worker.updates = self._context.Queue(self.queue_size)
+                worker.restarts += 1
+                worker.lost += lost
+            self._start_worker(worker)
+
+    def stop(self, timeout=60):
+        # Каждый воркер получает None после своих апдейтов и завершает уже принятые
+        self._stop.set()
+        if self._monitor is not None:
+            self._monitor.join()
+        for worker in self._workers:
+            worker.updates.put(None)
+        deadline = time.monotonic() + timeout
+        for worker in self._workers:
+            worker.process.join(max(0.0, deadline - time.monotonic()))
+            if worker.process.is_alive():
+                logging.error(f"Cluster worker {worker.index} did not stop in time, terminating")
+                worker.process.terminate()
+                worker.process.join()
+
+    def stats(self):
+        now = time.monotonic()
+        workers = {}
+        with self._lock:
+            for worker in self._workers:
+                beat = worker.heartbeat or {}
+                workers[str(worker.index)] = {
+                    'pid': worker.process.pid if worker.process else 0,
+                    'healthy': worker.process is not None and self._healthy(worker, now),
+                    'routed': worker.routed,
+                    'queue_depth': self._depth(worker),
+                    'restarts': worker.restarts,
+                    'lost': worker.lost,
+                    'heartbeat_age': now - beat['received_at'] if beat else -1,
+                    'processed': beat.get('processed', 0),
+                    'executor': beat.get('executor', {}),
+                }
+        return {
+            'workers_total': len(self._workers),
+            'workers_healthy': sum(1 for worker in workers.values() if worker['healthy']),
+            'queue_size': self.queue_size,
+            'routed': sum(worker['routed'] for worker in workers.values()),
+            'workers': workers,
+        }
+
+def poll_updates(bot, cluster, stop, poll_timeout=CLUSTER_POLL_TIMEOUT):
+    # Long polling в главном процессе; апдейт подтверждается (offset) только после передачи воркеру
+    bot.delete_webhook()
+    offset = None
+    backoff = 1
+    while not stop.is_set():
+        try:
+            updates = bot.get_updates(offset=offset, timeout=poll_timeout)
+        except RetryAfter as e:
+            stop.wait(e.retry_after)
+            continue
+        except TelegramError as e:
+            logging.error(f"getUpdates failed: {e}")
+            stop.wait(backoff)
+            backoff = min(backoff * 2, 30)
+            continue
+        backoff = 1
+        for update in updates:
+            # Переполненная очередь воркера тормозит получение, а не теряет апдейты
+            while not stop.is_set():
+                try:
+                    cluster.put(update, timeout=1)
+                    break
+                except queue.Full:
+                    logging.warning(f"Cluster worker queue is full, update {update.update_id} is waiting")
+            else:
+                return
+            offset = update.update_id + 1
+
+def run_cluster(workers=CLUSTER_WORKERS):
+    from bot.database.manager import db_manager
+    from bot.scheduler import scheduler_tasks
+    from bot.utils.logging import logging_stats
+    from bot.utils.metrics import registry, start_metrics_server
+    from bot.webhook import create_webhook_server
+
+    bot = Bot(TELEGRAM_BOT_TOKEN, base_url=TELEGRAM_BASE_URL,
+              request=Request(con_pool_size=4, read_timeout=CLUSTER_POLL_TIMEOUT + 10))
+    cluster = Cluster(workers)
+    cluster.start()
+
+    # Плановые задачи выполняются один раз - в главном процессе, а не в каждом воркере
+    expiry_engine = scheduler_tasks.setup_scheduler(db_manager)
+    registry.register_stats('cluster', cluster.stats)
+    registry.register_stats('expiry', expiry_engine.stats)
+    registry.register_stats('logging', logging_stats)
+    if METRICS_PORT:
+        start_metrics_server(METRICS_LISTEN, METRICS_PORT)
+
+    stop = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda signum, frame: stop.set())
+
+    server = None
+    if BOT_MODE == 'webhook':
+        server = create_webhook_server(bot, cluster, queue_size=max(WEBHOOK_QUEUE_SIZE, workers * cluster.queue_size))
+    if server is not None:
+        registry.register_stats('webhook', server.stats)
+        threading.Thread(target=server.serve_forever, name='webhook', daemon=True).start()
+        listen, port = server.server_address[:2]
+        logging.info(f"Cluster of {workers} workers, webhook listening on {listen}:{port}{server.url_path}")
+        stop.wait()
+        server.shutdown()
+    else:
+        logging.info(f"Cluster of {workers} workers, polling for updates")
+        poll_updates(bot, cluster, stop)
+
+    logging.info("Stopping cluster")
+    cluster.stop()
+    expiry_engine.scheduler.shutdown(wait=False)
@@ -0,0 +1,39 @@
+# bot/commands/broadcast.py
+
+from telegram import Update
+from telegram.ext import CallbackContext
+from bot.utils.broadcast import broadcast_runner
+from config.settings import ADMIN_TELEGRAM_ID
+
+USAGE = ("Использование:\n"
+         "/broadcast <текст> - начать рассылку всем пользователям\n"
+         "/broadcast status - прогресс последней рассылки\n"
+         "/broadcast stop - приостановить\n"
+         "/broadcast resume - продолжить с места остановки")
+
+def broadcast(update: Update, context: CallbackContext) -> None:
+    if update.message.from_user.id != ADMIN_TELEGRAM_ID:
+        return
+
+    command = context.args[0].lower() if len(context.args) == 1 else None
+    if not context.args:
+        update.message.reply_text(USAGE)
+    elif command == 'status':
+        update.message.reply_text(broadcast_runner.status())
+    elif command == 'stop':
+        broadcast_runner.pause()
+        update.message.reply_text(f"Рассылка приостановлена. {broadcast_runner.status()}")
+    elif command == 'resume':
+        broadcast_id = broadcast_runner.resume()
+        if broadcast_id is None:
+            update.message.reply_text("Нет рассылки, которую можно продолжить, или рассылка уже идет.")
+        else:
+            update.message.reply_text(f"Рассылка #{broadcast_id} продолжена.")
+    else:
+        # Текст берем из сообщения целиком, чтобы сохранить переносы строк
+        text = update.message.text.split(maxsplit=1)[1]
+        broadcast_id = broadcast_runner.start(text)
+        if broadcast_id is None:
+            update.message.reply_text("Рассылка уже идет. Дождитесь окончания или остановите ее: /broadcast stop")
+        else:
+            update.message.reply_text(f"Рассылка #{broadcast_id} запущена.")
@@ -4,12 +4,11 @@ from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton, ReplyKe
 from telegram.ext import CallbackContext
 from bot.api.freekassa import generate_payment_link
 from config.settings import PREMIUM_SUBSCRIPTION_PRICE, MERCHANT_ID, SECRET_KEY_1, MAX_QUESTIONS_PER_HOUR_PREMIUM, MAX_QUESTIONS_PER_HOUR_REGULAR
-from bot.database.manager import DatabaseManager
+from bot.database.manager import db_manager
 from bot.common import check_message_limit
+from bot.utils.rate_limiter import rate_limiter
 import logging
 
-db_manager = DatabaseManager(MAX_QUESTIONS_PER_HOUR_PREMIUM, MAX_QUESTIONS_PER_HOUR_REGULAR)
-
 def handle_payment(update: Update, context: CallbackContext) -> None:
     user_id = update.message.from_user.id
     payment_link = generate_payment_link(user_id, PREMIUM_SUBSCRIPTION_PRICE)
@@ -27,8 +26,7 @@ def handle_new_chat_button(update: Update, context: CallbackContext) -> None:
     logging.info(f"User {user_id} clicked 'New Chat' button")
 
     if db_manager.check_premium_status(user_id):
-        context.user_data[f'message_count_{user_id}'] = 0
-        db_manager.update_message_count(user_id)  # Обнуляем счетчик сообщений в базе данных
+        rate_limiter.reset(user_id)  # Обнуляем счетчик сообщений
         update.message.reply_text("Новый чат начат с премиум доступом!")
     else:
         # Проверка лимита сообщений
@@ -42,7 +40,6 @@ def handle_new_chat_button(update: Update, context: CallbackContext) -> None:
                 ])
             )
         else:
-            context.user_data[f'message_count_{user_id}'] = 0
             update.message.reply_text("Новый чат начат!")
             # Добавляем сообщение о возможности покупки премиума
             payment_link = generate_payment_link(user_id, PREMIUM_SUBSCRIPTION_PRICE, MERCHANT_ID, SECRET_KEY_1)
@@ -2,12 +2,10 @@
 
 from telegram import Update, ReplyKeyboardMarkup, KeyboardButton
 from telegram.ext import CallbackContext
-from bot.database.manager import DatabaseManager
+from bot.database.manager import db_manager
 from config.settings import PREMIUM_SUBSCRIPTION_PRICE, WELCOME_MESSAGE, MAX_QUESTIONS_PER_HOUR_PREMIUM, MAX_QUESTIONS_PER_HOUR_REGULAR
 from bot.commands.payment import get_base_reply_markup
 
-db_manager = DatabaseManager(MAX_QUESTIONS_PER_HOUR_PREMIUM, MAX_QUESTIONS_PER_HOUR_REGULAR)
-
 # Command handler for /start
 def start(update: Update, context: CallbackContext) -> None:
     user_id = update.message.from_user.id
@@ -1,54 +1,104 @@
 # bot/database/manager.py
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, scoped_session
-from sqlalchemy.exc import SQLAlchemyError
-from bot.database.models import Base, User, Query
-from config.settings import DATABASE_URL
+from sqlalchemy import select, update
+from sqlalchemy.orm import scoped_session
+from sqlalchemy.exc import SQLAlchemyError, IntegrityError
+from bot.database.models import User, Query, Payment
+from bot.database.storage import Session, begin_write
+from bot.database.query_writer import query_writer
 from bot.utils.admin_notifications import send_telegram_notification_to_admin
-from datetime import datetime
+from bot.utils.metrics import instrument_methods
+from bot.utils.ttl_cache import TTLCache
+from config.settings import USER_CACHE_TTL, USER_CACHE_MAX_SIZE, MAX_QUESTIONS_PER_HOUR_PREMIUM, MAX_QUESTIONS_PER_HOUR_REGULAR
+from datetime import datetime, timedelta
 import logging
 
-engine = create_engine(DATABASE_URL, echo=False)
-Session = sessionmaker(bind=engine)
-Base.metadata.create_all(engine)
+USER_COLUMNS = [column.name for column in User.__table__.columns]
 
+# Кэш строк users внутри процесса (TTL + LRU); общий для всех экземпляров DatabaseManager,
+# чтобы запись через любой из них сбрасывала устаревшую копию
+user_cache = TTLCache(USER_CACHE_TTL, USER_CACHE_MAX_SIZE)
+
+def _snapshot(user):
+    return {name: getattr(user, name) for name in USER_COLUMNS}
+
+# Время каждого публичного метода - этап db.<метод> в /metrics
+@instrument_methods('db')
 class DatabaseManager:
     def __init__(self, max_questions_premium, max_questions_regular):
         self.session = scoped_session(Session)
         self.max_questions_premium = max_questions_premium
         self.max_questions_regular = max_questions_regular
-    
+        self.user_cache = user_cache
+
+    def _get_user_snapshot(self, user_id):
+        user_id = int(user_id)
+        snapshot = self.user_cache.get(user_id)
+        if snapshot is None:
+            with self.session() as session:
+                user = session.query(User).filter(User.id == user_id).first()
+                if user is None:
+                    return None
+                snapshot = _snapshot(user)
+            self.user_cache.set(user_id, snapshot)
+        return snapshot
+
     def get_user_by_id(self, user_id):
         try:
-            with self.session() as session:
-                return session.query(User).filter(User.id == user_id).first()
+            snapshot = self._get_user_snapshot(user_id)
+            # Отдаем отдельную копию: изменения вызывающего кода не должны попадать в кэш
+            return User(**snapshot) if snapshot else None
         except SQLAlchemyError as e:
             logging.error(f"Database error in get_user_by_id: {e}")
             return None
 
-    def expire_premium_subscriptions(self):
+    def cache_stats(self):
+        return self.user_cache.stats()
+
+    def expire_premium_subscriptions(self, now=None):
+        # Один UPDATE по индексу (is_premium, premium_expiration) вместо обхода пользователей по одному;
+        # id выбираются в той же транзакции записи, поэтому совпадают с обновленными строками
+        now = now or datetime.now()
+        overdue = (User.is_premium == True) & (User.premium_expiration < now)
+        expired_ids = []
         try:
             with self.session() as session:
-                # Find all users with expired subscriptions
-                expired_users = session.query(User).filter(
-                    User.is_premium == True,
-                    User.premium_expiration < datetime.now()
-                ).all()
-
-                # Update their premium status
-                for user in expired_users:
-                    user.is_premium = False
-                    user.premium_expiration = None  # Имя поля исправлено на premium_expiration
-
+                begin_write(session)
+                expired_ids = [row[0] for row in session.execute(select(User.id).where(overdue))]
+                if expired_ids:
+                    session.execute(
+                        update(User).where(overdue).values(is_premium=False, premium_expiration=None)
+                        .execution_options(synchronize_session=False)
+                    )
                 session.commit()
+            for user_id in expired_ids:
+                self.user_cache.invalidate(user_id)
         except SQLAlchemyError as e:
             logging.error(f"Database error in expire_premium_subscriptions: {e}")
             session.rollback()
+            return []
+        return expired_ids
+
+    def get_upcoming_expirations(self, until):
+        try:
+            with self.session() as session:
+                return session.execute(
+                    select(User.id, User.premium_expiration)
+                    .where(User.is_premium == True, User.premium_expiration != None, User.premium_expiration <= until)
+                ).all()
+        except SQLAlchemyError as e:
+            logging.error(f"Database error in get_upcoming_expirations: {e}")
+            return []
 
     def add_or_update_user(self, user_id, username, first_name, last_name, chat_id):
         try:
+            # На каждом сообщении данные обычно не меняются - тогда запись не нужна
+            cached = self.user_cache.get(int(user_id))
+            if cached and (cached['username'], cached['first_name'], cached['last_name'], cached['chat_id']) == \
+                    (username, first_name, last_name, chat_id):
+                return
             with self.session() as session:
+                begin_write(session)
                 user = session.query(User).filter(User.id == user_id).first()
                 is_new_user = False
                 if user:
@@ -63,6 +113,7 @@ class DatabaseManager:
                     session.add(new_user)
                     is_new_user = True
                 session.commit()
+                self.user_cache.invalidate(int(user_id))
 
                 # Отправка уведомления администратору о новом пользователе
                 if is_new_user:
@@ -76,14 +127,8 @@ class DatabaseManager:
         send_telegram_notification_to_admin(message, self)
     
     def add_query(self, user_id, text, response):
-        try:
-            with self.session() as session:
-                new_query = Query(user_id=user_id, text=text, response=response)
-                session.add(new_query)
-                session.commit()
-        except SQLAlchemyError as e:
-            logging.error(f"Database error in add_query: {e}")
-            session.rollback()
+        # Запись уходит в фоновый writer и попадет в базу вместе с пачкой соседних
+        query_writer.submit(user_id, text, response)
 
     def __del__(self):
         if hasattr(self, 'session'):
@@ -97,6 +142,20 @@ class DatabaseManager:
             logging.error(f"Database error in get_all_users: {e}")
             return []
 
+    def get_user_chats_after(self, after_id, limit):
+        # Keyset-пагинация по первичному ключу: без OFFSET и без загрузки всех пользователей в память
+        try:
+            with self.session() as session:
+                return session.execute(
+                    select(User.id, User.chat_id)
+                    .where(User.id > after_id, User.chat_id != None)
+                    .order_by(User.id)
+                    .limit(limit)
+                ).all()
+        except SQLAlchemyError as e:
+            logging.error(f"Database error in get_user_chats_after: {e}")
+            return None
+
     def get_all_queries(self):
         try:
             with self.session() as session:
@@ -108,60 +167,159 @@ class DatabaseManager:
     def update_premium_status(self, user_id, is_premium, expiration_date):
         try:
             with self.session() as session:
+                begin_write(session)
                 user = session.query(User).filter(User.id == user_id).first()
                 if user:
                     user.is_premium = is_premium
                     user.premium_expiration = expiration_date  # Убедитесь, что имя поля совпадает
                     session.commit()
+            self.user_cache.invalidate(int(user_id))
         except SQLAlchemyError as e:
             logging.error(f"Database error in update_premium_status: {e}")
             session.rollback()
 
-    def check_premium_status(self, user_id):
+    def update_feedback_time(self, user_id, feedback_time):
+        # Время последнего предложения - для паузы между ними (FEEDBACK_COOLDOWN)
         try:
             with self.session() as session:
-                user = session.query(User).filter(User.id == user_id).first()
-                if user and user.is_premium:
-                    # Исправлено: использование premium_expiration вместо premium_expiration_date
-                    if user.premium_expiration and user.premium_expiration > datetime.now():
-                        return True
-                return False
+                begin_write(session)
+                session.execute(
+                    update(User).where(User.id == user_id).values(last_feedback_time=feedback_time)
+                    .execution_options(synchronize_session=False)
+                )
+                session.commit()
+            self.user_cache.invalidate(int(user_id))
+            return True
         except SQLAlchemyError as e:
-            logging.error(f"Database error in check_premium_status: {e}")
+            logging.error(f"Database error in update_feedback_time: {e}")
+            session.rollback()
             return False
-        
-    def is_within_message_limit(self, user_id):
+
+    def get_payment(self, order_id):
+        # Поиск по уникальному индексу ix_payments_order_id
         try:
             with self.session() as session:
-                user = session.query(User).filter(User.id == user_id).first()
-                if not user:
-                    return False, 0
+                return session.execute(select(Payment).where(Payment.order_id == order_id)).scalar_one_or_none()
+        except SQLAlchemyError as e:
+            logging.error(f"Database error in get_payment: {e}")
+            return None
 
-                now = datetime.now()
-                # Обновляем счетчик, если прошел час с момента последнего сообщения
-                if user.last_message_time and (now - user.last_message_time).total_seconds() >= 3600:
-                    user.message_count = 0
-                    session.commit()
+    def add_payment_event(self, order_id, user_id, amount, provider_status, provider_payment_id=None):
+        # Сохраняет уведомление кассы для фоновой обработки. True - событие новое,
+        # False - этот order_id уже записан (повторное уведомление), None - ошибка базы
+        try:
+            with self.session() as session:
+                begin_write(session)
+                session.add(Payment(order_id=order_id, user_id=user_id, amount=amount, status='received',
+                                    provider_status=provider_status, provider_payment_id=provider_payment_id,
+                                    attempts=0, next_attempt_at=datetime.utcnow()))
+                session.commit()
+                return True
+        except IntegrityError:
+            # Уникальный индекс по order_id: запись уже есть
+            session.rollback()
+            return False
+        except SQLAlchemyError as e:
+            logging.error(f"Database error in add_payment_event: {e}")
+            session.rollback()
+            return None
 
-                remaining_messages = self.max_questions_premium - user.message_count if user.is_premium else self.max_questions_regular - user.message_count
-                return user.message_count < self.max_questions_premium if user.is_premium else user.message_count < self.max_questions_regular, remaining_messages
+    def claim_payments(self, limit, claim_timeout, now=None):
+        # Забирает платежи, которым пора в обработку, и зависшие дольше claim_timeout (воркер упал).
+        # Выбор и UPDATE в одной транзакции записи, поэтому два процесса не возьмут один платеж
+        now = now or datetime.utcnow()
+        ready = ((Payment.status == 'received') & (Payment.next_attempt_at <= now)) | \
+                ((Payment.status == 'processing') & (Payment.claimed_at < now - timedelta(seconds=claim_timeout)))
+        try:
+            with self.session() as session:
+                begin_write(session)
+                rows = session.execute(
+                    select(Payment.id, Payment.order_id, Payment.user_id, Payment.provider_status, Payment.attempts)
+                    .where(ready).order_by(Payment.next_attempt_at).limit(limit)
+                ).all()
+                if rows:
+                    session.execute(
+                        update(Payment).where(Payment.id.in_([row.id for row in rows]))
+                        .values(status='processing', claimed_at=now, attempts=Payment.attempts + 1)
+                        .execution_options(synchronize_session=False)
+                    )
+                session.commit()
+                return rows
         except SQLAlchemyError as e:
-            logging.error(f"Database error in is_within_message_limit: {e}")
-            return False, 0
+            logging.error(f"Database error in claim_payments: {e}")
+            session.rollback()
+            return []
 
-    def update_message_count(self, user_id):
+    def complete_payment(self, payment_id, user_id, status, premium_days=0):
+        # Итог платежа и продление премиума - одной транзакцией. Срок продлевается от текущего окончания,
+        # если оно еще не наступило: оплата до конца подписки не сгорает. Время окончания - локальное без зоны
         try:
             with self.session() as session:
-                user = session.query(User).filter(User.id == user_id).first()
-                if user:
-                    user.message_count += 1
-                    user.last_message_time = datetime.now()
-                    session.commit()
+                begin_write(session)
+                # Платеж, который параллельно завершил другой воркер (перехват по claim_timeout), второй раз не продлевает
+                completed = session.execute(
+                    update(Payment).where(Payment.id == payment_id, Payment.status == 'processing')
+                    .values(status=status, processed_at=datetime.utcnow(), last_error=None)
+                    .execution_options(synchronize_session=False)
+                ).rowcount
+                if completed and premium_days:
+                    now = datetime.now()
+                    current = session.execute(select(User.premium_expiration).where(User.id == user_id)).scalar()
+                    expiration = max(now, current or now) + timedelta(days=premium_days)
+                    session.execute(
+                        update(User).where(User.id == user_id).values(is_premium=True, premium_expiration=expiration)
+                        .execution_options(synchronize_session=False)
+                    )
+                session.commit()
+            self.user_cache.invalidate(int(user_id))
+            return True
         except SQLAlchemyError as e:
-            logging.error(f"Database error in update_message_count: {e}")
+            logging.error(f"Database error in complete_payment: {e}")
             session.rollback()
+            return False
+
+    def retry_payment(self, payment_id, next_attempt_at, error, give_up=False):
+        try:
+            with self.session() as session:
+                begin_write(session)
+                session.execute(
+                    update(Payment).where(Payment.id == payment_id)
+                    .values(status='error' if give_up else 'received', next_attempt_at=next_attempt_at,
+                            claimed_at=None, last_error=error)
+                    .execution_options(synchronize_session=False)
+                )
+                session.commit()
+        except SQLAlchemyError as e:
+            logging.error(f"Database error in retry_payment: {e}")
+            session.rollback()
+
+    def get_payments(self, start, end, status=None):
+        # Сверка с выгрузкой кассы: платежи за период по индексу created_at
+        try:
+            with self.session() as session:
+                query = select(Payment).where(Payment.created_at >= start, Payment.created_at < end)
+                if status is not None:
+                    query = query.where(Payment.status == status)
+                return session.execute(query.order_by(Payment.created_at)).scalars().all()
+        except SQLAlchemyError as e:
+            logging.error(f"Database error in get_payments: {e}")
+            return []
+
+    def check_premium_status(self, user_id):
+        try:
+            user = self._get_user_snapshot(user_id)
+            if user and user['is_premium']:
+                # Исправлено: использование premium_expiration вместо premium_expiration_date
+                if user['premium_expiration'] and user['premium_expiration'] > datetime.now():
+                    return True
+            return False
+        except SQLAlchemyError as e:
+            logging.error(f"Database error in check_premium_status: {e}")
+            return False
+
+# Один экземпляр на процесс: общий scoped_session и кэш пользователей
+db_manager = DatabaseManager(MAX_QUESTIONS_PER_HOUR_PREMIUM, MAX_QUESTIONS_PER_HOUR_REGULAR)
 
-# db_manager = DatabaseManager()
 # users = db_manager.get_all_users()
 # queries = db_manager.get_all_queries()
 
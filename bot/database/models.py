@@ -1,6 +1,6 @@
 # bot/database/models.py
 
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey
+from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, ForeignKey, LargeBinary, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -20,6 +20,10 @@ class User(Base):
     message_count = Column(Integer, default=0, nullable=True)
     last_feedback_time = Column(DateTime, nullable=True)
 
+    __table_args__ = (
+        Index('ix_users_is_premium_premium_expiration', 'is_premium', 'premium_expiration'),
+    )
+
 class Query(Base):
     __tablename__ = 'queries'
     id = Column(Integer, primary_key=True)
@@ -28,3 +32,60 @@ class Query(Base):
     text = Column(String)
     response = Column(String)
     timestamp = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index('ix_queries_user_id_timestamp', 'user_id', 'timestamp'),
+    )
+
+class UserState(Base):
+    __tablename__ = 'user_state'
+    kind = Column(String, primary_key=True)  # 'user' или 'chat'
+    key = Column(Integer, primary_key=True)
+    data = Column(LargeBinary)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class RateLimitState(Base):
+    __tablename__ = 'rate_limits'
+    user_id = Column(Integer, primary_key=True)
+    events = Column(Text)  # JSON-список unix-времени сообщений в текущем окне
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class ResponseCacheEntry(Base):
+    __tablename__ = 'response_cache'
+    key = Column(String(64), primary_key=True)  # sha256 нормализованной истории
+    response = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+class Broadcast(Base):
+    __tablename__ = 'broadcasts'
+    id = Column(Integer, primary_key=True)
+    text = Column(Text)
+    status = Column(String, default='running')  # running, paused, failed, done
+    last_user_id = Column(Integer, default=0)  # Курсор: рассылка продолжается с users.id > last_user_id
+    delivered = Column(Integer, default=0)
+    failed = Column(Integer, default=0)
+    blocked = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+
+class Payment(Base):
+    __tablename__ = 'payments'
+    id = Column(Integer, primary_key=True)
+    order_id = Column(String(64), nullable=False)  # MERCHANT_ORDER_ID, выдается generate_payment_link
+    user_id = Column(Integer, index=True)
+    amount = Column(String(32))  # Сумма в том виде, в каком ее прислала касса (по ней считается подпись)
+    status = Column(String, default='received')  # received, processing, paid, failed, error
+    provider_payment_id = Column(String(64))  # intid FreeKassa
+    provider_status = Column(String(16))  # int_status из уведомления
+    attempts = Column(Integer, default=0)
+    next_attempt_at = Column(DateTime, default=datetime.utcnow)
+    claimed_at = Column(DateTime, nullable=True)  # Когда воркер взял платеж в обработку
+    processed_at = Column(DateTime, nullable=True)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+    __table_args__ = (
+        Index('ix_payments_order_id', 'order_id', unique=True),
+        Index('ix_payments_status_next_attempt_at', 'status', 'next_attempt_at'),
+    )
@@ -0,0 +1,194 @@
+# bot/database/persistence.py
+
+import logging
+import pickle
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.exc import SQLAlchemyError
+from telegram.ext import BasePersistence
+from bot.database.storage import engine, begin_write
+from bot.database.models import UserState
+from config.settings import PERSISTENCE_FLUSH_INTERVAL, PERSISTENCE_BATCH_SIZE, PERSISTENCE_IDLE_TIMEOUT
+
+# Словарь user_data/chat_data, который подгружает записи из базы при первом обращении
+class LazyDataDict(defaultdict):
+    def __init__(self, loader):
+        super().__init__(dict)
+        self._loader = loader
+        self._load_lock = threading.Lock()
+        self.last_access = {}
+
+    def __missing__(self, key):
+        with self._load_lock:
+            if dict.__contains__(self, key):
+                return dict.__getitem__(self, key)
+            value = self._loader(key)
+            dict.__setitem__(self, key, value)
+            return value
+
+    def __getitem__(self, key):
+        self.last_access[key] = time.monotonic()
+        return super().__getitem__(key)
+
+    # BasePersistence.insert_bot копирует полученный словарь; ленивая загрузка должна сохраниться,
+    # поэтому copy(obj) возвращает сам объект, а .copy() - обычный снимок содержимого
+    def __copy__(self):
+        return self
+
+    def copy(self):
+        return dict(self)
+
+class SQLitePersistence(BasePersistence):
+    def __init__(self, flush_interval=PERSISTENCE_FLUSH_INTERVAL, batch_size=PERSISTENCE_BATCH_SIZE,
+                 idle_timeout=PERSISTENCE_IDLE_TIMEOUT):
+        super().__init__(store_user_data=True, store_chat_data=True, store_bot_data=False)
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.idle_timeout = idle_timeout
+        self.table = UserState.__table__
+        self.user_data = LazyDataDict(lambda key: self._load('user', key))
+        self.chat_data = LazyDataDict(lambda key: self._load('chat', key))
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._dirty = {'user': set(), 'chat': set()}
+        self._loaded = 0
+        self._flushes = 0
+        self._rows_written = 0
+        self._evicted = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='persistence-flusher', daemon=True)
+        self._thread.start()
+
+    def _load(self, kind, key):
+        try:
+            with engine.connect() as conn:
+                blob = conn.execute(
+                    select(self.table.c.data).where(self.table.c.kind == kind, self.table.c.key == key)
+                ).scalar()
+        except SQLAlchemyError as e:
+            logging.error(f"Database error while loading {kind} data for {key}: {e}")
+            blob = None
+        with self._lock:
+            self._loaded += 1
+        return pickle.loads(blob) if blob else {}
+
+    def _mark_dirty(self, kind, key):
+        with self._lock:
+            self._dirty[kind].add(key)
+
+    def get_user_data(self):
+        return self.user_data
+
+    def get_chat_data(self):
+        return self.chat_data
+
+    def get_bot_data(self):
+        return {}
+
+    def get_conversations(self, name):
+        return {}
+
+    def update_conversation(self, name, key, new_state):
+        pass
+
+    # Диспетчер передает глубокую копию данных; пишем позже актуальный словарь, здесь только отмечаем ключ
+    def update_user_data(self, user_id, data):
+        self._mark_dirty('user', user_id)
+
+    def update_chat_data(self, chat_id, data):
+        self._mark_dirty('chat', chat_id)
+
+    def update_bot_data(self, data):
+        pass
+
+    def flush(self):
+        with self._flush_lock:
+            rows = []
+            now = datetime.utcnow()
+            for kind, data in (('user', self.user_data), ('chat', self.chat_data)):
+                with self._lock:
+                    dirty, self._dirty[kind] = self._dirty[kind], set()
+                for key in dirty:
+                    value = dict.get(data, key)
+                    if value is None:
+                        continue
+                    try:
+                        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+                    except RuntimeError:
+                        # Обработчик как раз меняет словарь - запишем на следующем цикле
+                        self._mark_dirty(kind, key)
+                        continue
+                    rows.append({'kind': kind, 'key': key, 'data': blob, 'updated_at': now})
+            if not rows:
+                return
+            stmt = insert(self.table)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[self.table.c.kind, self.table.c.key],
+                set_={'data': stmt.excluded.data, 'updated_at': stmt.excluded.updated_at}
+            )
+            for start in range(0, len(rows), self.batch_size):
+                batch = rows[start:start + self.batch_size]
+                try:
+                    with engine.begin() as conn:
+                        begin_write(conn)
+                        conn.execute(stmt, batch)
+                except SQLAlchemyError as e:
+                    logging.error(f"Database error while flushing persistence: {e}")
+                    for row in batch:
+                        self._mark_dirty(row['kind'], row['key'])
+                    continue
+                with self._lock:
+                    self._flushes += 1
+                    self._rows_written += len(batch)
+
+    def evict_idle(self):
+        deadline = time.monotonic() - self.idle_timeout
+        for kind, data in (('user', self.user_data), ('chat', self.chat_data)):
+            idle = [key for key, accessed in list(data.last_access.items()) if accessed < deadline]
+            if not idle:
+                continue
+            # Перед выгрузкой сохраняем несохраненные изменения
+            with self._lock:
+                has_dirty = any(key in self._dirty[kind] for key in idle)
+            if has_dirty:
+                self.flush()
+            with data._load_lock:
+                for key in idle:
+                    if data.last_access.get(key, 0) >= deadline:
+                        continue
+                    with self._lock:
+                        if key in self._dirty[kind]:
+                            continue
+                    dict.pop(data, key, None)
+                    data.last_access.pop(key, None)
+                    with self._lock:
+                        self._evicted += 1
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+                self.evict_idle()
+            except Exception:
+                logging.exception("Unexpected error in persistence flusher")
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        self.flush()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'users_in_memory': len(self.user_data),
+                'chats_in_memory': len(self.chat_data),
+                'dirty': len(self._dirty['user']) + len(self._dirty['chat']),
+                'loaded': self._loaded,
+                'flushes': self._flushes,
+                'rows_written': self._rows_written,
+                'evicted': self._evicted,
+            }
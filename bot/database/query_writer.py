@@ -0,0 +1,119 @@
+# bot/database/query_writer.py
+
+import atexit
+import logging
+import queue
+import threading
+import time
+from datetime import datetime
+from sqlalchemy.exc import SQLAlchemyError
+from bot.database.models import Query
+from bot.database.storage import engine, begin_write
+from config.settings import QUERY_LOG_QUEUE_SIZE, QUERY_LOG_BATCH_SIZE, QUERY_LOG_FLUSH_INTERVAL
+
+_STOP = object()
+
+# Фоновая запись журнала вопросов: обработчик только кладет запись в очередь,
+# поток пишет пачками с одним commit на пачку
+class QueryLogWriter:
+    def __init__(self, max_queue=QUERY_LOG_QUEUE_SIZE, batch_size=QUERY_LOG_BATCH_SIZE, flush_interval=QUERY_LOG_FLUSH_INTERVAL):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.table = Query.__table__
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+        self._batches = 0
+        self._rows_written = 0
+        self._last_batch_size = 0
+        self._max_batch_size = 0
+        self._overflow = 0
+        self._failed = 0
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='query-log-writer', daemon=True)
+                    self._thread.start()
+
+    def submit(self, user_id, text, response):
+        record = {'user_id': user_id, 'text': text, 'response': response, 'timestamp': datetime.utcnow()}
+        if self._closed:
+            self._write([record])
+            return
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            # Очередь переполнена - пишем синхронно, чтобы не терять записи и притормозить источник
+            with self._lock:
+                self._overflow += 1
+            self._write([record])
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            stop = False
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+            self._write(batch)
+            if stop:
+                return
+
+    def _write(self, batch):
+        try:
+            with engine.begin() as conn:
+                begin_write(conn)
+                conn.execute(self.table.insert(), batch)
+        except SQLAlchemyError as e:
+            logging.error(f"Database error while writing {len(batch)} queries: {e}")
+            with self._lock:
+                self._failed += len(batch)
+            return
+        with self._lock:
+            self._batches += 1
+            self._rows_written += len(batch)
+            self._last_batch_size = len(batch)
+            if len(batch) > self._max_batch_size:
+                self._max_batch_size = len(batch)
+
+    def close(self):
+        # Дописываем все, что уже в очереди, и останавливаем поток
+        if self._closed:
+            return
+        self._closed = True
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'queue_depth': self._queue.qsize(),
+                'batches': self._batches,
+                'rows_written': self._rows_written,
+                'last_batch_size': self._last_batch_size,
+                'avg_batch_size': self._rows_written / self._batches if self._batches else 0.0,
+                'max_batch_size': self._max_batch_size,
+                'overflow_sync_writes': self._overflow,
+                'failed_rows': self._failed,
+            }
+
+query_writer = QueryLogWriter()
+atexit.register(query_writer.close)
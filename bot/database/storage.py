@@ -0,0 +1,105 @@
+# bot/database/storage.py
+
+import logging
+import os
+import threading
+import time
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
+from config.settings import (DATABASE_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_BUSY_TIMEOUT_MS,
+                             DB_SYNCHRONOUS, DB_CACHE_SIZE_KB)
+
+# Единый движок SQLite на процесс: бот и веб-хук открывают одну базу, поэтому WAL и busy_timeout обязательны
+engine = create_engine(
+    DATABASE_URL,
+    echo=False,
+    poolclass=QueuePool,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    connect_args={'check_same_thread': False, 'timeout': DB_BUSY_TIMEOUT_MS / 1000},
+)
+Session = sessionmaker(bind=engine)
+
+@event.listens_for(engine, 'connect')
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+    cursor.execute(f"PRAGMA synchronous={DB_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA cache_size=-{DB_CACHE_SIZE_KB}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+class LockStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.acquired = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+        self.locked_errors = 0
+
+    def record_wait(self, wait_time):
+        with self._lock:
+            self.acquired += 1
+            self.wait_time_total += wait_time
+            if wait_time > self.wait_time_max:
+                self.wait_time_max = wait_time
+
+    def record_locked_error(self):
+        with self._lock:
+            self.locked_errors += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'write_locks_acquired': self.acquired,
+                'lock_wait_total': self.wait_time_total,
+                'lock_wait_avg': self.wait_time_total / self.acquired if self.acquired else 0.0,
+                'lock_wait_max': self.wait_time_max,
+                'database_locked_errors': self.locked_errors,
+            }
+
+lock_stats = LockStats()
+
+@event.listens_for(engine, 'handle_error')
+def _count_locked_errors(context):
+    if 'database is locked' in str(context.original_exception):
+        lock_stats.record_locked_error()
+
+def begin_write(connection):
+    # BEGIN IMMEDIATE сразу берет блокировку записи: время этого запроса - ожидание блокировки,
+    # а запись не упадет посреди транзакции при апгрейде блокировки чтения
+    started = time.monotonic()
+    connection.execute(text("BEGIN IMMEDIATE"))
+    lock_stats.record_wait(time.monotonic() - started)
+
+ALEMBIC_DIR = os.path.join(os.path.dirname(__file__), '..', '..', 'alembic')
+
+# Ревизия, которой соответствует база, созданная раньше через create_all без alembic_version
+def _legacy_revision(connection):
+    tables = set(inspect(connection).get_table_names())
+    if 'alembic_version' in tables or 'users' not in tables:
+        return None
+    if {'user_state', 'rate_limits'} <= tables:
+        return '0002'
+    return '0001'
+
+def init_db():
+    config = Config()
+    config.set_main_option('script_location', os.path.abspath(ALEMBIC_DIR))
+    with engine.begin() as connection:
+        config.attributes['connection'] = connection
+        legacy = _legacy_revision(connection)
+        if legacy:
+            logging.info(f"Stamping existing database schema as revision {legacy}")
+            command.stamp(config, legacy)
+        command.upgrade(config, 'head')
+
+def storage_stats():
+    stats = lock_stats.snapshot()
+    stats['pool_status'] = engine.pool.status()
+    return stats
@@ -1,7 +1,7 @@
 # bot/handlers/command_handlers.py
 
 from telegram.ext import CommandHandler
-from bot.commands import start, status, payment
+from bot.commands import start, status, payment, broadcast
 
 def start_handler():
     return CommandHandler("start", start.start)
@@ -10,4 +10,7 @@ def status_handler():
     return CommandHandler("status", status.status)
 
 def payment_handler():
-    return CommandHandler("payment", payment.handle_payment)
\ No newline at end of file
+    return CommandHandler("payment", payment.handle_payment)
+
+def broadcast_handler():
+    return CommandHandler("broadcast", broadcast.broadcast)
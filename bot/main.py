@@ -4,23 +4,36 @@
 from telegram import Update, KeyboardButton, ReplyKeyboardMarkup, InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.ext import Updater, CallbackContext, Filters, CallbackQueryHandler
 from telegram.error import TimedOut
-from bot.database.manager import DatabaseManager
+from bot.database.manager import db_manager
+from bot.database.storage import init_db, storage_stats
+from bot.database.query_writer import query_writer
 from bot.api.hackergpt import HackerGPTAPI
+from bot.api.admission import admission
 import logging
 from bot.api.freekassa import generate_payment_link, get_chat_id_for_user, send_telegram_notification
 from datetime import datetime
-from config.settings import TELEGRAM_BOT_TOKEN, FEEDBACK_COOLDOWN, PREMIUM_SUBSCRIPTION_PRICE,ADMIN_TELEGRAM_ID, ERROR_MESSAGE, MAX_QUESTIONS_PER_HOUR_PREMIUM, MAX_QUESTIONS_PER_HOUR_REGULAR
+from config.settings import TELEGRAM_BOT_TOKEN, FEEDBACK_COOLDOWN, PREMIUM_SUBSCRIPTION_PRICE,ADMIN_TELEGRAM_ID, ERROR_MESSAGE, MAX_QUESTIONS_PER_HOUR_PREMIUM, MAX_QUESTIONS_PER_HOUR_REGULAR, BOT_WORKERS, BOT_MAX_PENDING_UPDATES, PERSISTENCE_ENABLED, BOT_MODE, BOT_LOG_FILE, METRICS_LISTEN, METRICS_PORT, CLUSTER_WORKERS, TELEGRAM_BASE_URL
 from bot.utils.helpers import process_user_message, process_feedback
+from bot.utils.executor import ChatOrderedExecutor
+from bot.utils.logging import setup_logging, log_event, logging_stats
+from bot.utils.metrics import registry, start_metrics_server
+from bot.utils.response_cache import response_cache
+from bot.utils.history import history_manager
+from bot.api.telegram_dispatcher import telegram_dispatcher
+from bot.database.persistence import SQLitePersistence
+from bot.utils.rate_limiter import rate_limiter
+from bot.utils.broadcast import broadcast_runner
 from bot.handlers import command_handlers, message_handlers
+from bot.webhook import start_webhook
 from bot.scheduler import scheduler_tasks
 from bot.handlers.button_handlers import handle_new_chat, handle_tips, handle_feedback
 
 # Set up logging
-logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+setup_logging(BOT_LOG_FILE)
 
-# Create instances for database and API interactions
-db_manager = DatabaseManager(MAX_QUESTIONS_PER_HOUR_PREMIUM, MAX_QUESTIONS_PER_HOUR_REGULAR)
+# Create instances for API interactions
 hackergpt_api = HackerGPTAPI()
+update_executor = ChatOrderedExecutor(BOT_WORKERS, BOT_MAX_PENDING_UPDATES)
 
 def inform_user_about_premium_status(update, context, user_id):
     if db_manager.check_premium_status(user_id):
@@ -31,7 +44,7 @@ def inform_user_about_premium_status(update, context, user_id):
 def handle_message(update: Update, context: CallbackContext) -> None:
     user_id = update.message.from_user.id
     user_message = update.message.text      
-    logging.info(f"Received message from user {user_id}: {user_message}")
+    log_event('message_received', user_id=user_id, payload={'text': user_message})
 
     # Обработка команд
     if user_message.lower() == "начать новый чат":
@@ -44,25 +57,13 @@ def handle_message(update: Update, context: CallbackContext) -> None:
         handle_feedback(update, context)
         return
 
-    # Получаем данные пользователя
-    user = db_manager.get_user_by_id(user_id)
-    if user:
-        now = datetime.now()
-        # Проверяем, не слишком ли рано пользователь отправляет следующее сообщение
-        if user.last_message_time and (now - user.last_message_time).total_seconds() < FEEDBACK_COOLDOWN:
-            update.message.reply_text("Подождите немного, прежде чем отправлять следующее сообщение.")
-            return
-        # Обновляем время последнего сообщения пользователя
-        user.last_message_time = now
-        db_manager.session.commit()
-
     # Проверяем, ожидает ли бот предложения об улучшении
     if context.user_data.get('awaiting_feedback', False):
+        user = db_manager.get_user_by_id(user_id)
         now = datetime.now()
-        if user.last_feedback_time is None or (now - user.last_feedback_time).total_seconds() > FEEDBACK_COOLDOWN:
+        if user is None or user.last_feedback_time is None or (now - user.last_feedback_time).total_seconds() > FEEDBACK_COOLDOWN:
             process_feedback(user_id, user_message, db_manager)  # Исправленный вызов
-            user.last_feedback_time = now
-            db_manager.session.commit()
+            db_manager.update_feedback_time(user_id, now)
             update.message.reply_text("Ваше предложение было отправлено администратору. Спасибо!")
         else:
             cooldown_remaining = int((FEEDBACK_COOLDOWN - (now - user.last_feedback_time).total_seconds()) / 3600)
@@ -70,11 +71,11 @@ def handle_message(update: Update, context: CallbackContext) -> None:
         context.user_data['awaiting_feedback'] = False
         return
 
-    # Проверка лимита сообщений для пользователя
-    within_limit, remaining_messages = db_manager.is_within_message_limit(user_id)
-    logging.info(f"User {user_id} has {remaining_messages} messages remaining this hour.")
+    # Проверка и списание лимита сообщений одним атомарным шагом
+    limit = rate_limiter.try_acquire(user_id, db_manager.check_premium_status(user_id))
+    logging.info(f"User {user_id} has {limit.remaining} messages remaining, window resets in {int(limit.resets_in)}s.")
 
-    if not within_limit:
+    if not limit.allowed:
         logging.info(f"User {user_id} has reached the message limit.")
         payment_link = generate_payment_link(user_id, PREMIUM_SUBSCRIPTION_PRICE)
         update.message.reply_text(
@@ -87,32 +88,104 @@ def handle_message(update: Update, context: CallbackContext) -> None:
         process_user_message(update, context)
 
 # Main function to set up and start the bot
-def main() -> None:
+def add_pooled_handler(dispatcher, handler):
+    callback = handler.callback
+
+    def callback_with_persistence(update, context):
+        try:
+            callback(update, context)
+        finally:
+            # Диспетчер сохраняет данные сразу после постановки в пул, а изменения появляются только здесь
+            dispatcher.update_persistence(update=update)
+
+    # Диспетчер только ставит апдейт в пул, сам обработчик выполняется в update_executor
+    handler.callback = update_executor.wrap(callback_with_persistence)
+    dispatcher.add_handler(handler)
+
+def register_metrics(persistence, expiry_engine=None, start_server=True):
+    # Существующие stats() компонентов попадают в /metrics как bot_component_stat
+    registry.register_stats('update_executor', update_executor.stats)
+    registry.register_stats('user_cache', db_manager.cache_stats)
+    registry.register_stats('storage', storage_stats)
+    registry.register_stats('query_writer', query_writer.stats)
+    registry.register_stats('rate_limiter', rate_limiter.stats)
+    registry.register_stats('response_cache', response_cache.stats)
+    registry.register_stats('history', history_manager.stats)
+    registry.register_stats('telegram_dispatcher', telegram_dispatcher.stats)
+    registry.register_stats('hackergpt_pool', hackergpt_api.pool_stats)
+    registry.register_stats('admission', admission.stats)
+    registry.register_stats('hackergpt', hackergpt_api.resilience_stats)
+    registry.register_stats('logging', logging_stats)
+    if expiry_engine:
+        registry.register_stats('expiry', expiry_engine.stats)
+    if persistence:
+        registry.register_stats('persistence', persistence.stats)
+    if start_server and METRICS_PORT:
+        start_metrics_server(METRICS_LISTEN, METRICS_PORT)
+
+def create_updater():
+    # Updater с зарегистрированными обработчиками; общий для одиночного режима и воркеров кластера
     request_kwargs = {
         'read_timeout': 10,
-        'connect_timeout': 10
+        'connect_timeout': 10,
+        # Каждый поток пула ходит в Bot API, плюс запас под polling и служебные запросы
+        'con_pool_size': BOT_WORKERS + 4
     }
-    updater = Updater(TELEGRAM_BOT_TOKEN, use_context=True, request_kwargs=request_kwargs)
+    # user_data/chat_data переживают перезапуск и подгружаются из SQLite по мере обращения
+    persistence = SQLitePersistence() if PERSISTENCE_ENABLED else None
+    updater = Updater(TELEGRAM_BOT_TOKEN, base_url=TELEGRAM_BASE_URL, use_context=True, request_kwargs=request_kwargs,
+                      persistence=persistence)
     dispatcher = updater.dispatcher
 
     # Регистрация обработчиков команд
-    dispatcher = updater.dispatcher
-    dispatcher.add_handler(command_handlers.start_handler())
-    dispatcher.add_handler(command_handlers.status_handler())
-    dispatcher.add_handler(command_handlers.payment_handler())
-    dispatcher.add_handler(message_handlers.text_handler())
-    dispatcher.add_handler(message_handlers.feedback_handler())
+    add_pooled_handler(dispatcher, command_handlers.start_handler())
+    add_pooled_handler(dispatcher, command_handlers.status_handler())
+    add_pooled_handler(dispatcher, command_handlers.payment_handler())
+    add_pooled_handler(dispatcher, command_handlers.broadcast_handler())
+    add_pooled_handler(dispatcher, message_handlers.text_handler())
+    add_pooled_handler(dispatcher, message_handlers.feedback_handler())
+
+    add_pooled_handler(dispatcher, CallbackQueryHandler(handle_new_chat, pattern='^new_chat$'))
+    add_pooled_handler(dispatcher, CallbackQueryHandler(handle_tips, pattern='^tips$'))
+    add_pooled_handler(dispatcher, CallbackQueryHandler(handle_feedback, pattern='^feedback$'))
+    return updater, persistence
+
+def shutdown(persistence):
+    # Дожидаемся апдейтов, уже принятых в пул, и сохраняем их изменения
+    update_executor.shutdown(wait=True)
+    broadcast_runner.shutdown()
+    if persistence:
+        persistence.close()
+    rate_limiter.close()
+    query_writer.close()
+    response_cache.close()
+
+def main() -> None:
+    init_db()
+
+    # Несколько процессов: апдейты распределяются по воркерам по user_id (bot/cluster.py)
+    if CLUSTER_WORKERS > 1:
+        from bot.cluster import run_cluster
+        run_cluster()
+        return
 
-    dispatcher.add_handler(CallbackQueryHandler(handle_new_chat, pattern='^new_chat$'))
-    dispatcher.add_handler(CallbackQueryHandler(handle_tips, pattern='^tips$'))
-    dispatcher.add_handler(CallbackQueryHandler(handle_feedback, pattern='^feedback$'))
+    updater, persistence = create_updater()
 
     # Настройка планировщика
-    scheduler_tasks.setup_scheduler(db_manager)
+    expiry_engine = scheduler_tasks.setup_scheduler(db_manager)
+    register_metrics(persistence, expiry_engine)
+
+    # Start the bot: webhook if configured, long polling otherwise or if the webhook could not be set
+    webhook_server = start_webhook(updater) if BOT_MODE == 'webhook' else None
+    if webhook_server is None:
+        updater.start_polling()
+    else:
+        registry.register_stats('webhook', webhook_server.stats)
 
-    # Start the bot
-    updater.start_polling()
+    # Рассылка, прерванная остановкой бота, продолжается с сохраненного курсора
+    broadcast_runner.resume_interrupted()
     updater.idle()
+    shutdown(persistence)
 
 # Program entry point
 if __name__ == '__main__':
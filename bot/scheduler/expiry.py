@@ -0,0 +1,90 @@
+# bot/scheduler/expiry.py
+
+import heapq
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from config.settings import EXPIRY_REFRESH_INTERVAL, EXPIRY_LOOKAHEAD
+
+JOB_ID = 'premium-expiry'
+
+# Снятие премиума в момент окончания подписки: ближайшие окончания лежат в куче,
+# планировщик держит одну задачу на время вершины кучи, а само снятие - один UPDATE по всем просроченным.
+# Время в users.premium_expiration - локальное без зоны (так его пишет веб-хук), поэтому и здесь datetime.now()
+class PremiumExpiryEngine:
+    def __init__(self, scheduler, db_manager, refresh_interval=EXPIRY_REFRESH_INTERVAL, lookahead=EXPIRY_LOOKAHEAD):
+        self.scheduler = scheduler
+        self.db_manager = db_manager
+        self.refresh_interval = refresh_interval
+        self.lookahead = lookahead
+        self._heap = []  # (premium_expiration, user_id)
+        self._lock = threading.Lock()
+        self._runs = 0
+        self._rows_total = 0
+        self._last_rows = 0
+        self._last_duration = 0.0
+        self._last_run = None
+
+    def start(self):
+        # Окончания пишет обработчик платежей веб-хука в другом процессе, сигнала оттуда нет: кучу
+        # перечитываем из базы каждые refresh_interval, так что новое окончание попадает в кучу (а уже
+        # наступившее снимается через expire_due) не позже чем через refresh_interval после записи
+        self.scheduler.add_job(self.refresh, 'interval', seconds=self.refresh_interval,
+                               id='premium-expiry-refresh', next_run_time=datetime.now().astimezone())
+
+    def refresh(self):
+        self.expire_due()
+        until = datetime.now() + timedelta(seconds=self.lookahead)
+        upcoming = [(expiration, user_id) for user_id, expiration in self.db_manager.get_upcoming_expirations(until)]
+        heapq.heapify(upcoming)
+        with self._lock:
+            self._heap = upcoming
+        self._schedule_next()
+
+    def expire_due(self):
+        started = time.monotonic()
+        expired_ids = self.db_manager.expire_premium_subscriptions()
+        duration = time.monotonic() - started
+        with self._lock:
+            self._runs += 1
+            self._rows_total += len(expired_ids)
+            self._last_rows = len(expired_ids)
+            self._last_duration = duration
+            self._last_run = datetime.now()
+        if expired_ids:
+            logging.info(f"Premium expired for {len(expired_ids)} users in {duration * 1000:.1f} ms")
+        return expired_ids
+
+    def _on_due(self):
+        now = datetime.now()
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                heapq.heappop(self._heap)
+        # Устаревшие записи кучи (подписку успели продлить) безвредны: UPDATE берет только то, что просрочено в базе
+        self.expire_due()
+        self._schedule_next()
+
+    def _schedule_next(self):
+        with self._lock:
+            if not self._heap:
+                if self.scheduler.get_job(JOB_ID):
+                    self.scheduler.remove_job(JOB_ID)
+                return
+            run_date = self._heap[0][0]
+        # Наивное локальное время переводим в зону планировщика явно
+        self.scheduler.add_job(self._on_due, 'date', run_date=run_date.astimezone(), id=JOB_ID,
+                               replace_existing=True, misfire_grace_time=None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'runs': self._runs,
+                'rows_expired_total': self._rows_total,
+                'last_rows_expired': self._last_rows,
+                'last_duration': self._last_duration,
+                # Время - в секундах эпохи (0 - еще не было): datetime в метрики не попадает
+                'last_run': self._last_run.timestamp() if self._last_run else 0,
+                'pending': len(self._heap),
+                'next_expiration': self._heap[0][0].timestamp() if self._heap else 0,
+            }
@@ -1,19 +1,18 @@
 # bot/utils/admin_notifications.py
 
 import logging
-from bot.api.freekassa import send_telegram_notification, get_chat_id_for_user
+from bot.api.freekassa import send_telegram_notification
+from bot.api.telegram_dispatcher import telegram_dispatcher
 from config.settings import ADMIN_TELEGRAM_ID
 
-def send_telegram_notification_to_admin(user, message, db_manager):
-    admin_chat_id = get_chat_id_for_user(ADMIN_TELEGRAM_ID, db_manager)
-    if admin_chat_id:
-        send_telegram_notification(ADMIN_TELEGRAM_ID, message, db_manager)
-    else:
-        logging.error(f"Chat ID for admin (ID: {ADMIN_TELEGRAM_ID}) not found.")
+def send_telegram_notification_to_admin(message, db_manager):
+    # Личный чат администратора совпадает с его ID, поэтому в базу за chat_id не ходим
+    telegram_dispatcher.remember_chat_id(ADMIN_TELEGRAM_ID, ADMIN_TELEGRAM_ID)
+    send_telegram_notification(ADMIN_TELEGRAM_ID, message, db_manager)
 
 def send_feedback_to_admin(user, feedback, db_manager):
     try:
         message = f"Предложение об улучшении от пользователя @{user.username} ({user.first_name} {user.last_name}): {feedback}"
-        send_telegram_notification_to_admin(user, message, db_manager)
+        send_telegram_notification_to_admin(message, db_manager)
     except Exception as e:
         logging.error(f"Error in send_feedback_to_admin: {e}")
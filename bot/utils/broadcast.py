@@ -0,0 +1,202 @@
+# bot/utils/broadcast.py
+
+import logging
+import threading
+from datetime import datetime
+from sqlalchemy.exc import SQLAlchemyError
+from bot.api.telegram_dispatcher import telegram_dispatcher, TokenBucket, DELIVERED, FAILED, BLOCKED
+from bot.database.manager import db_manager
+from bot.database.models import Broadcast
+from bot.database.storage import Session, begin_write
+from config.settings import BROADCAST_RATE, BROADCAST_BATCH_SIZE, BROADCAST_RESULT_TIMEOUT, ADMIN_TELEGRAM_ID
+
+RUNNING = 'running'
+PAUSED = 'paused'
+DONE = 'done'
+FAILED_STATUS = 'failed'  # Остановлена ошибкой; продолжить можно вручную, как паузу
+
+# Итоги отправки одной страницы пользователей; число ожидаемых итогов известно после отправки
+class BatchResults:
+    def __init__(self):
+        self.expected = None
+        self.counts = {DELIVERED: 0, FAILED: 0, BLOCKED: 0}
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+
+    def _check(self):
+        if self.expected is not None and sum(self.counts.values()) >= self.expected:
+            self._done.set()
+
+    def record(self, message, result):
+        with self._lock:
+            self.counts[result] += 1
+            self._check()
+
+    def wait(self, expected, timeout=None):
+        # Возвращает итоги страницы; сообщения без итога за timeout (поток отправки завис,
+        # очередь не разбирается) считаются неотправленными, а их поздние итоги уже не учитываются
+        with self._lock:
+            self.expected = expected
+            self._check()
+        self._done.wait(timeout)
+        with self._lock:
+            counts = dict(self.counts)
+        missing = expected - sum(counts.values())
+        if missing > 0:
+            logging.error(f"No delivery result for {missing} broadcast messages within {timeout}s")
+            counts[FAILED] += missing
+        return counts
+
+# Рассылка по всем пользователям: страницы users по id (keyset), темп не выше rate,
+# курсор и счетчики сохраняются в broadcasts после каждой страницы. При перезапуске
+# повторно может уйти только страница, которая отправлялась в момент остановки
+class BroadcastRunner:
+    def __init__(self, dispatcher=telegram_dispatcher, rate=BROADCAST_RATE, batch_size=BROADCAST_BATCH_SIZE,
+                 result_timeout=BROADCAST_RESULT_TIMEOUT):
+        self.dispatcher = dispatcher
+        self.rate = rate
+        self.batch_size = batch_size
+        self.result_timeout = result_timeout
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self._stop_status = PAUSED
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, text):
+        with self._lock:
+            if self.is_running():
+                return None
+            with Session() as session:
+                begin_write(session)
+                broadcast = Broadcast(text=text, status=RUNNING, last_user_id=0, delivered=0, failed=0, blocked=0)
+                session.add(broadcast)
+                session.commit()
+                broadcast_id = broadcast.id
+            self._launch(broadcast_id)
+        return broadcast_id
+
+    def resume(self, broadcast_id=None):
+        # Без id продолжаем последнюю незавершенную рассылку
+        with self._lock:
+            if self.is_running():
+                return None
+            with Session() as session:
+                query = session.query(Broadcast).filter(Broadcast.status != DONE)
+                if broadcast_id is not None:
+                    query = query.filter(Broadcast.id == broadcast_id)
+                broadcast = query.order_by(Broadcast.id.desc()).first()
+                if broadcast is None:
+                    return None
+                broadcast_id = broadcast.id
+            self._set_status(broadcast_id, RUNNING)
+            self._launch(broadcast_id)
+        return broadcast_id
+
+    def resume_interrupted(self):
+        # После перезапуска бота продолжаем рассылку, которую не останавливали вручную
+        with Session() as session:
+            broadcast = session.query(Broadcast).filter(Broadcast.status == RUNNING).order_by(Broadcast.id.desc()).first()
+        if broadcast is not None:
+            logging.info(f"Resuming broadcast {broadcast.id} after user {broadcast.last_user_id}")
+            return self.resume(broadcast.id)
+        return None
+
+    def pause(self):
+        self._halt(PAUSED)
+
+    def shutdown(self):
+        # Остановка бота: статус остается running, и после запуска рассылка продолжится сама
+        self._halt(RUNNING)
+
+    def _halt(self, status):
+        self._stop_status = status
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._stop.clear()
+
+    def _launch(self, broadcast_id):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(broadcast_id,), name=f'broadcast-{broadcast_id}', daemon=True)
+        self._thread.start()
+
+    def _set_status(self, broadcast_id, status):
+        with Session() as session:
+            begin_write(session)
+            broadcast = session.get(Broadcast, broadcast_id)
+            broadcast.status = status
+            broadcast.updated_at = datetime.utcnow()
+            if status == DONE:
+                broadcast.finished_at = datetime.utcnow()
+            session.commit()
+
+    def _save_progress(self, broadcast_id, last_user_id, counts):
+        with Session() as session:
+            begin_write(session)
+            broadcast = session.get(Broadcast, broadcast_id)
+            broadcast.last_user_id = last_user_id
+            broadcast.delivered += counts[DELIVERED]
+            broadcast.failed += counts[FAILED]
+            broadcast.blocked += counts[BLOCKED]
+            broadcast.updated_at = datetime.utcnow()
+            session.commit()
+
+    def _run(self, broadcast_id):
+        try:
+            with Session() as session:
+                broadcast = session.get(Broadcast, broadcast_id)
+                text, cursor = broadcast.text, broadcast.last_user_id or 0
+            bucket = TokenBucket(self.rate)
+            while not self._stop.is_set():
+                # В памяти только одна страница получателей, сколько бы ни было пользователей
+                batch = db_manager.get_user_chats_after(cursor, self.batch_size)
+                if batch is None:
+                    raise RuntimeError("could not read recipients")
+                if not batch:
+                    self._set_status(broadcast_id, DONE)
+                    self._report(broadcast_id)
+                    return
+                results = BatchResults()
+                sent = 0
+                sent_until = cursor
+                for user_id, chat_id in batch:
+                    if self._stop.is_set():
+                        break
+                    bucket.acquire()
+                    if not self.dispatcher.send(chat_id, text, on_result=results.record):
+                        results.record(None, FAILED)
+                    sent += 1
+                    sent_until = user_id
+                # Курсор двигаем только после итогов по всем отправленным сообщениям страницы
+                counts = results.wait(sent, self.result_timeout)
+                self._save_progress(broadcast_id, sent_until, counts)
+                cursor = sent_until
+            self._set_status(broadcast_id, self._stop_status)
+        except Exception as e:
+            # Любая ошибка потока рассылки должна остаться в статусе: иначе рассылка навсегда "running"
+            logging.exception(f"Broadcast {broadcast_id} stopped: {e}")
+            try:
+                self._set_status(broadcast_id, FAILED_STATUS)
+            except SQLAlchemyError as e:
+                logging.error(f"Could not save status of broadcast {broadcast_id}: {e}")
+
+    def _report(self, broadcast_id):
+        status = self.status(broadcast_id)
+        self.dispatcher.send(ADMIN_TELEGRAM_ID, f"Рассылка #{broadcast_id} завершена. {status}")
+
+    def status(self, broadcast_id=None):
+        with Session() as session:
+            query = session.query(Broadcast)
+            if broadcast_id is not None:
+                query = query.filter(Broadcast.id == broadcast_id)
+            broadcast = query.order_by(Broadcast.id.desc()).first()
+            if broadcast is None:
+                return "Рассылок еще не было."
+            return (f"Рассылка #{broadcast.id}: {broadcast.status}, доставлено {broadcast.delivered}, "
+                    f"ошибок {broadcast.failed}, заблокировали бота {broadcast.blocked}, "
+                    f"последний пользователь {broadcast.last_user_id}")
+
+broadcast_runner = BroadcastRunner()
@@ -0,0 +1,104 @@
+# bot/utils/executor.py
+
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from config.settings import BUSY_MESSAGE
+
+# Пул потоков для обработки апдейтов: разные чаты идут параллельно,
+# апдейты одного чата - строго по очереди
+class ChatOrderedExecutor:
+    def __init__(self, max_workers, max_pending=0):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='update-worker')
+        self._lock = threading.Lock()
+        self._chains = {}  # chat_id -> очередь апдейтов, ждущих завершения текущего
+        self._pending = 0
+        self._in_flight = 0
+        self._submitted = 0
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._wait_time_total = 0.0
+        self._wait_time_max = 0.0
+
+    def submit(self, chat_id, fn, *args):
+        item = (fn, args, time.monotonic())
+        with self._lock:
+            if self.max_pending and self._pending >= self.max_pending:
+                self._rejected += 1
+                return False
+            self._submitted += 1
+            self._pending += 1
+            chain = self._chains.get(chat_id)
+            if chain is not None:
+                # У чата уже есть задача в работе - встаем за ней
+                chain.append(item)
+                return True
+            self._chains[chat_id] = deque()
+        self._pool.submit(self._run, chat_id, item)
+        return True
+
+    def _run(self, chat_id, item):
+        fn, args, enqueued_at = item
+        wait_time = time.monotonic() - enqueued_at
+        with self._lock:
+            self._pending -= 1
+            self._in_flight += 1
+            self._wait_time_total += wait_time
+            if wait_time > self._wait_time_max:
+                self._wait_time_max = wait_time
+        failed = False
+        try:
+            fn(*args)
+        except Exception:
+            failed = True
+            logging.exception(f"Unhandled error while processing update for chat {chat_id}")
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+                self._completed += 1
+                if failed:
+                    self._failed += 1
+                chain = self._chains[chat_id]
+                next_item = chain.popleft() if chain else None
+                if next_item is None:
+                    del self._chains[chat_id]
+        if next_item is not None:
+            # Следующий апдейт чата идет в конец общей очереди, чтобы болтливый чат не занимал поток
+            try:
+                self._pool.submit(self._run, chat_id, next_item)
+            except RuntimeError:
+                # Пул уже останавливается - дорабатываем очередь чата в текущем потоке
+                self._run(chat_id, next_item)
+
+    def wrap(self, callback):
+        def pooled_callback(update, context):
+            chat_id = update.effective_chat.id if update.effective_chat else None
+            if not self.submit(chat_id, callback, update, context):
+                logging.warning(f"Update queue is full, rejecting update for chat {chat_id}")
+                if update.effective_message:
+                    update.effective_message.reply_text(BUSY_MESSAGE)
+        return pooled_callback
+
+    def stats(self):
+        with self._lock:
+            started = self._completed + self._in_flight
+            return {
+                'max_workers': self.max_workers,
+                'in_flight': self._in_flight,
+                'queue_depth': self._pending,
+                'active_chats': len(self._chains),
+                'submitted': self._submitted,
+                'completed': self._completed,
+                'failed': self._failed,
+                'rejected': self._rejected,
+                'wait_time_avg': self._wait_time_total / started if started else 0.0,
+                'wait_time_max': self._wait_time_max,
+            }
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait)
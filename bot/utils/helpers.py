@@ -1,52 +1,67 @@
 # bot/utils/helpers.py
 
 import logging
-import re
+import requests
 from telegram import Update
+from telegram.error import TelegramError
 from telegram.ext import CallbackContext
-from bot.database.manager import DatabaseManager
+from bot.database.manager import db_manager
 from bot.api.hackergpt import HackerGPTAPI
+from bot.api.admission import AdmissionRejected
+from bot.api.resilience import UpstreamUnavailable
 from bot.api.freekassa import send_telegram_notification, get_chat_id_for_user
-from config.settings import MAX_QUESTIONS_PER_HOUR_PREMIUM, MAX_QUESTIONS_PER_HOUR_REGULAR
+from bot.utils.admin_notifications import send_feedback_to_admin
+from bot.utils.streaming import ProgressiveMessage
+from bot.utils.markdown import render_chunks
+from bot.utils.history import history_manager
+from bot.utils.rate_limiter import rate_limiter
+from bot.utils.response_cache import response_cache
+from bot.utils.logging import log_event
+from bot.utils.metrics import track, timed
+from config.settings import (MAX_QUESTIONS_PER_HOUR_PREMIUM, MAX_QUESTIONS_PER_HOUR_REGULAR, STREAM_RESPONSES,
+                             BUSY_MESSAGE, ERROR_MESSAGE, QUEUE_POSITION_MESSAGE)
 
 hackergpt_api = HackerGPTAPI()
 
-db_manager = DatabaseManager(MAX_QUESTIONS_PER_HOUR_PREMIUM, MAX_QUESTIONS_PER_HOUR_REGULAR)
-
 def update_message_history(context: CallbackContext, role: str, message: str) -> None:
     message_history = context.user_data.get('message_history', [])
     message_history.append({'role': role, 'content': message})
-    context.user_data['message_history'] = message_history
-
-def format_code_block(response_text):
-    # Find code blocks with language hints and replace them without language hints
-    pattern = r'```(\w+)?\s*(.+?)\s*```'
-    formatted_text = re.sub(pattern, r'```\n\2\n```', response_text, flags=re.DOTALL)
-    return formatted_text
-
-def escape_markdown_v2(text):
-    # Escape Markdown V2 special characters outside of code blocks
-    escape_chars = '_*[]()~`>#+-=|{}.!'
-    # Split the text into code blocks and the rest
-    parts = re.split(r'(```.*?```)', text, flags=re.DOTALL)
-    escaped_parts = []
-    for part in parts:
-        if part.startswith('```') and part.endswith('```'):
-            # Don't escape characters inside code blocks
-            escaped_parts.append(part)
-        else:
-            # Escape special characters outside code blocks
-            escaped_parts.append(re.sub(r'([_*\[\]()~`>#\+=\-|{}\.!])', r'\\\1', part))
-    return ''.join(escaped_parts)
+    context.user_data['message_history'] = history_manager.prune(message_history)
+
+def queue_position_reporter(bot, chat_id, message_id):
+    # Пока запрос ждет допуска к HackerGPT, заглушка показывает место в очереди
+    def report(position):
+        with track('telegram.edit_message_text'):
+            bot.edit_message_text(chat_id=chat_id, message_id=message_id,
+                                  text=QUEUE_POSITION_MESSAGE.format(position=position))
+    return report
+
+def _forget_question(context, user_id, user_message):
+    # The question stays unanswered: it does not belong in the history and does not use up the limit
+    rate_limiter.release(user_id)
+    history = context.user_data['message_history']
+    if history and history[-1] == {'role': 'user', 'content': user_message}:
+        history.pop()
+
+def _edit_placeholder(bot, chat_id, message_id, text):
+    try:
+        with track('telegram.edit_message_text'):
+            bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=text)
+    except TelegramError as e:
+        logging.error(f"Could not edit message {message_id} in chat {chat_id}: {e}")
 
 # Process user message
+@timed('handler.process_user_message')
 def process_user_message(update: Update, context: CallbackContext) -> None:
     user_message = update.message.text
     user = update.message.from_user
     chat_id = update.message.chat.id  # Используйте chat.id вместо user.chat_id
 
-    # Log user's message
-    logging.info(f"User {user.id} ({user.username}): {user_message}")
+    # Log user's message: length always, text only truncated and sampled
+    log_event('user_message', user_id=user.id, username=user.username, payload={'text': user_message})
+
+    # A prefixed or excluded request always goes upstream; the prefix is not part of the history
+    user_message, bypass_cache = response_cache.check_bypass(user.id, user_message)
 
     # Update user in database
     db_manager.add_or_update_user(user.id, user.username, user.first_name, user.last_name, chat_id)  # Используйте chat_id здесь
@@ -55,30 +70,74 @@ def process_user_message(update: Update, context: CallbackContext) -> None:
     update_message_history(context, 'user', user_message)
 
     # Send temporary "Generating response..." message
-    temp_message = update.message.reply_text("Генерирую ответ...")
-
-    # Get response from API
-    response_text = hackergpt_api.send_message(context.user_data['message_history'])
+    with track('telegram.reply_text'):
+        temp_message = update.message.reply_text("Генерирую ответ...")
+
+    # Only the budgeted window of the history goes upstream
+    request_history = history_manager.window(context.user_data['message_history'])
+
+    # Identical requests are answered from the cache without a round trip
+    progress = None
+    cached_response = None if bypass_cache else response_cache.get(request_history) or None
+    if cached_response is not None:
+        response_text = cached_response
+    else:
+        # Premium requests are admitted to HackerGPT first; a request that waited too long is shed
+        premium = db_manager.check_premium_status(user.id)
+        on_position = queue_position_reporter(context.bot, chat_id, temp_message.message_id)
+        try:
+            # Get response from API, showing partial text while it streams in
+            if STREAM_RESPONSES:
+                progress = ProgressiveMessage(context.bot, chat_id, temp_message.message_id)
+                for chunk in hackergpt_api.stream_message(request_history, premium, on_position):
+                    progress.append(chunk)
+                response_text = progress.text
+            else:
+                response_text = hackergpt_api.send_message(request_history, premium, on_position)
+            # An empty answer can't be sent to Telegram, and it must not be cached or kept in the history
+            if not response_text.strip():
+                raise UpstreamUnavailable("empty response from HackerGPT")
+        except AdmissionRejected as e:
+            log_event('request_shed', logging.WARNING, user_id=user.id, premium=premium, reason=str(e))
+            _forget_question(context, user.id, user_message)
+            _edit_placeholder(context.bot, chat_id, temp_message.message_id, BUSY_MESSAGE)
+            return
+        except (requests.exceptions.RequestException, UpstreamUnavailable) as e:
+            # The placeholder must not hang after a failed request, even with part of a stream shown
+            log_event('request_failed', logging.ERROR, user_id=user.id, error=type(e).__name__, reason=str(e))
+            _forget_question(context, user.id, user_message)
+            _edit_placeholder(context.bot, chat_id, temp_message.message_id, ERROR_MESSAGE)
+            return
+    if cached_response is None:
+        response_cache.set(request_history, response_text)
+
+    # Keep the assistant's reply so follow-up questions have context
+    update_message_history(context, 'assistant', response_text)
 
     # Log GPT's response
-    logging.info(f"GPT response to {user.id} ({user.username}): {response_text}")
-
-    # Format code blocks in the response
-    formatted_response_text = format_code_block(response_text)
+    log_event('gpt_response', user_id=user.id, cached=cached_response is not None, payload={'response': response_text})
 
-    # Escape Markdown V2 special characters
-    escaped_response_text = escape_markdown_v2(formatted_response_text)
+    # Convert the response to MarkdownV2, split into messages within Telegram's length limit
+    with track('markdown.render_chunks'):
+        chunks = render_chunks(response_text)
 
     # Record query and response in the database
-    db_manager.add_query(user.id, user_message, escaped_response_text)
-
-    # Edit the temporary message with the actual response
-    context.bot.edit_message_text(
-        chat_id=update.message.chat_id,
-        message_id=temp_message.message_id,
-        text=escaped_response_text,
-        parse_mode='MarkdownV2'
-    )
+    db_manager.add_query(user.id, user_message, '\n'.join(chunks))
+
+    # Edit the temporary message with the first part of the response, the rest goes as new messages
+    if progress:
+        progress.finish(chunks[0], parse_mode='MarkdownV2')
+    else:
+        with track('telegram.edit_message_text'):
+            context.bot.edit_message_text(
+                chat_id=update.message.chat_id,
+                message_id=temp_message.message_id,
+                text=chunks[0],
+                parse_mode='MarkdownV2'
+            )
+    for chunk in chunks[1:]:
+        with track('telegram.send_message'):
+            context.bot.send_message(chat_id=chat_id, text=chunk, parse_mode='MarkdownV2')
 
 def process_feedback(user_id, feedback_text, db_manager):
     try:
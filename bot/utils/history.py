@@ -0,0 +1,123 @@
+# bot/utils/history.py
+
+import threading
+from config.settings import (HISTORY_BUDGET, HISTORY_BUDGET_UNIT, HISTORY_KEEP_LAST, HISTORY_TRIM_MODE,
+                             HISTORY_STORE_FACTOR, HISTORY_COLLAPSE_SNIPPET)
+
+CHARS_PER_TOKEN = 4  # Грубая оценка без токенизатора
+MESSAGE_OVERHEAD_TOKENS = 4  # Служебные токены роли и разделителей на каждое сообщение
+
+# Скользящее окно истории диалога в пределах бюджета символов или токенов
+class HistoryManager:
+    def __init__(self, budget=HISTORY_BUDGET, unit=HISTORY_BUDGET_UNIT, keep_last=HISTORY_KEEP_LAST,
+                 mode=HISTORY_TRIM_MODE, store_factor=HISTORY_STORE_FACTOR):
+        if unit not in ('chars', 'tokens'):
+            raise ValueError(f"Unknown history budget unit: {unit}")
+        if mode not in ('drop', 'collapse'):
+            raise ValueError(f"Unknown history trim mode: {mode}")
+        self.budget = budget
+        self.unit = unit
+        self.keep_last = keep_last
+        self.mode = mode
+        self.store_factor = store_factor
+        self._lock = threading.Lock()
+        self._windows = 0
+        self._trimmed_windows = 0
+        self._messages_trimmed = 0
+        self._units_trimmed = 0
+        self._messages_pruned = 0
+
+    def measure(self, message):
+        length = len(message.get('content') or '')
+        if self.unit == 'chars':
+            return length
+        return length // CHARS_PER_TOKEN + MESSAGE_OVERHEAD_TOKENS
+
+    def window(self, history):
+        # Системные сообщения и последние keep_last реплик остаются всегда, остальное - сколько влезет
+        system = [m for m in history if m['role'] == 'system']
+        turns = [m for m in history if m['role'] != 'system']
+        used = sum(self.measure(m) for m in system)
+        kept = []
+        for i, message in enumerate(reversed(turns)):
+            cost = self.measure(message)
+            if i >= self.keep_last and used + cost > self.budget:
+                break
+            kept.append(message)
+            used += cost
+        kept.reverse()
+        dropped = turns[:len(turns) - len(kept)]
+
+        note = None
+        if dropped and self.mode == 'collapse':
+            note = self._collapse(dropped, self.budget - used)
+            # Освобождаем место под заметку за счет самых старых из сохраненных реплик
+            while note is None and len(kept) > self.keep_last:
+                released = kept.pop(0)
+                used -= self.measure(released)
+                dropped.append(released)
+                note = self._collapse(dropped, self.budget - used)
+
+        with self._lock:
+            self._windows += 1
+            if dropped:
+                self._trimmed_windows += 1
+                self._messages_trimmed += len(dropped)
+                self._units_trimmed += sum(self.measure(m) for m in dropped)
+
+        if note:
+            return system + [note] + kept
+        return system + kept
+
+    def _collapse(self, dropped, remaining):
+        # Сворачиваем отброшенные вопросы пользователя в одну короткую заметку
+        header = f"Ранее в диалоге опущено сообщений: {len(dropped)}. Вопросы пользователя:"
+        lines = [header]
+        note = {'role': 'system', 'content': header}
+        if self.measure(note) > remaining:
+            return None
+        for message in reversed(dropped):
+            if message['role'] != 'user':
+                continue
+            snippet = ' '.join((message.get('content') or '').split())
+            if len(snippet) > HISTORY_COLLAPSE_SNIPPET:
+                snippet = snippet[:HISTORY_COLLAPSE_SNIPPET] + '…'
+            candidate = {'role': 'system', 'content': '\n'.join(lines + [f"- {snippet}"])}
+            if self.measure(candidate) > remaining:
+                break
+            lines.append(f"- {snippet}")
+            note = candidate
+        return note
+
+    def prune(self, history):
+        # Хранить историю дальше нескольких окон бессмысленно - в запрос она все равно не попадет
+        limit = self.budget * self.store_factor
+        total = sum(self.measure(m) for m in history)
+        turns = sum(1 for m in history if m['role'] != 'system')
+        pruned = 0
+        index = 0
+        while total > limit and turns > self.keep_last and index < len(history):
+            if history[index]['role'] == 'system':
+                index += 1
+                continue
+            total -= self.measure(history.pop(index))
+            turns -= 1
+            pruned += 1
+        if pruned:
+            with self._lock:
+                self._messages_pruned += pruned
+        return history
+
+    def stats(self):
+        with self._lock:
+            return {
+                'budget': self.budget,
+                'unit': self.unit,
+                'windows': self._windows,
+                'trimmed_windows': self._trimmed_windows,
+                'messages_trimmed': self._messages_trimmed,
+                'units_trimmed': self._units_trimmed,
+                'messages_pruned': self._messages_pruned,
+            }
+
+history_manager = HistoryManager()
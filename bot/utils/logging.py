@@ -1,8 +1,105 @@
 # bot/utils/logging.py
 
+import atexit
+import json
 import logging
+import os
+import queue
+import random
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from config.settings import (LOG_LEVEL, LOG_FORMAT, LOG_MAX_BYTES, LOG_BACKUP_COUNT, LOG_QUEUE_SIZE,
+                             LOG_PAYLOAD_MAX_CHARS, LOG_PAYLOAD_SAMPLE_RATE)
 
-def setup_logging():
-    # Настройте формат, уровень и другие параметры логирования здесь
-    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 
+# Очередь не блокирует вызывающий поток: при переполнении запись отбрасывается и учитывается в logging_stats()
+class DroppingQueueHandler(QueueHandler):
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+# Поля события (record.fields) выводятся как key=value после сообщения или как JSON-объект
+class StructuredFormatter(logging.Formatter):
+    def __init__(self, json_output=False):
+        super().__init__(TEXT_FORMAT)
+        self.json_output = json_output
+
+    def format(self, record):
+        fields = getattr(record, 'fields', None)
+        if not self.json_output:
+            line = super().format(record)
+            if fields:
+                line += ' ' + ' '.join(f"{key}={json.dumps(value, ensure_ascii=False, default=str)}"
+                                       for key, value in fields.items())
+            return line
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+_listener = None
+_queue_handler = None
+
+def setup_logging(log_file=None, level=LOG_LEVEL, json_output=LOG_FORMAT == 'json'):
+    # Единая настройка для бота и веб-хука: вызывающие потоки только кладут запись в очередь,
+    # форматирование и запись в консоль/файл - в потоке QueueListener. Повторный вызов ничего не меняет
+    global _listener, _queue_handler
+    if _listener is not None:
+        return
+    formatter = StructuredFormatter(json_output)
+    handlers = [logging.StreamHandler()]
+    if log_file:
+        os.makedirs(os.path.dirname(log_file) or '.', exist_ok=True)
+        handlers.append(RotatingFileHandler(log_file, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT,
+                                            encoding='utf-8'))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    _queue_handler = DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_queue_handler)
+    root.setLevel(level)
+
+    _listener = QueueListener(_queue_handler.queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+def _payload_value(value):
+    # Полный текст сообщения или ответа попадает в лог только в доле записей и не длиннее LOG_PAYLOAD_MAX_CHARS
+    value = str(value)
+    if len(value) > LOG_PAYLOAD_MAX_CHARS:
+        return value[:LOG_PAYLOAD_MAX_CHARS] + '...'
+    return value
+
+def log_event(event, level=logging.INFO, payload=None, logger=None, **fields):
+    # Структурированная запись: fields выводятся всегда, у payload - длина и, выборочно, усеченный текст
+    logger = logger or logging.getLogger()
+    if not logger.isEnabledFor(level):
+        return
+    if payload:
+        sampled = random.random() < LOG_PAYLOAD_SAMPLE_RATE
+        for name, value in payload.items():
+            fields[f'{name}_len'] = len(value) if value is not None else 0
+            if sampled and value is not None:
+                fields[name] = _payload_value(value)
+    logger.log(level, event, extra={'fields': fields})
+
+def logging_stats():
+    if _queue_handler is None:
+        return {}
+    return {'queue_depth': _queue_handler.queue.qsize(), 'dropped': _queue_handler.dropped}
@@ -0,0 +1,372 @@
+# bot/utils/markdown.py
+
+import re
+from bot.utils.streaming import TELEGRAM_MESSAGE_LIMIT
+
+# Перевод ответа модели (обычный Markdown) в MarkdownV2 Telegram за один проход по тексту.
+# Блоки кода и строки рендерятся независимо и всегда сбалансированы, поэтому длинный ответ
+# можно резать на сообщения по их границам
+
+SPECIAL_CHARS = '_*[]()~`>#+-=|{}.!\\'
+
+
+def _escaper(chars):
+    # Цепочка str.replace только по встречающимся символам: для коротких кусочков текста это
+    # быстрее и str.translate со строковой таблицей, и re.sub с шаблоном замены
+    others = [(char, '\\' + char) for char in chars if char != '\\']
+
+    def escape(text):
+        if '\\' in text:
+            text = text.replace('\\', '\\\\')
+        for char, replacement in others:
+            if char in text:
+                text = text.replace(char, replacement)
+        return text
+    return escape
+
+
+escape_text = _escaper(SPECIAL_CHARS)
+escape_code = _escaper('`\\')
+escape_url = _escaper(')\\')
+
+STYLE_MARKERS = {'bold': '*', 'italic': '_', 'strike': '~'}
+LANG_RE = re.compile(r'[\w+#.-]{0,32}')  # Длиннее - это уже первая строка кода, а не язык
+LINK_RE = re.compile(r'\[([^\[\]\n]+)\]\(([^()\s]+)\)')
+HEADING_RE = re.compile(r'#{1,6}\s+(.*)')
+MARKUP_RE = re.compile(r'[\\`\[*_~]')
+
+
+def _delimiter(line, i):
+    # Возвращает (стиль, длина разделителя) для *, **, _, __, ~~ или None
+    char = line[i]
+    double = line.startswith(char * 2, i)
+    if char == '~':
+        return ('strike', 2) if double else None
+    if double:
+        return 'bold', 2
+    return 'italic', 1
+
+
+def _close(pieces, entry):
+    # Пустую сущность не выводим: открывающий кусочек просто убираем
+    if entry[1] == len(pieces) - 1:
+        pieces.pop()
+    else:
+        pieces.append(('close', entry[0]))
+
+
+def _inline_pieces(line, base_style=None):
+    # Кусочки строки: ('text', сырой текст), ('open'/'close', стиль), ('code', код), ('link', текст, url)
+    pieces = []
+    stack = []  # (стиль, индекс открывающего кусочка, исходный разделитель)
+    text_start = 0
+    i = 0
+    n = len(line)
+
+    def flush(end):
+        if end > text_start:
+            pieces.append(('text', line[text_start:end]))
+
+    while i < n:
+        # Обычный текст пропускаем целиком до следующего символа разметки
+        match = MARKUP_RE.search(line, i)
+        if not match:
+            break
+        i = match.start()
+        char = line[i]
+        if char == '\\' and i + 1 < n and line[i + 1] in SPECIAL_CHARS:
+            # Экранирование из исходного Markdown: символ идет как текст
+            flush(i)
+            pieces.append(('text', line[i + 1]))
+            i += 2
+            text_start = i
+            continue
+        if char == '`':
+            end = line.find('`', i + 1)
+            if end > i + 1:
+                flush(i)
+                pieces.append(('code', line[i + 1:end]))
+                i = end + 1
+                text_start = i
+                continue
+        elif char == '[':
+            match = LINK_RE.match(line, i)
+            if match:
+                flush(i)
+                pieces.append(('link', match.group(1), match.group(2)))
+                i = match.end()
+                text_start = i
+                continue
+        elif char in '*_~':
+            delimiter = _delimiter(line, i)
+            if delimiter:
+                style, size = delimiter
+                prev_char = line[i - 1] if i > 0 else ' '
+                next_char = line[i + size] if i + size < n else ' '
+                delimiter_text = line[i:i + size]
+                open_styles = [entry[0] for entry in stack]
+                # _ внутри слова (my_var) - не разметка ни при открытии, ни при закрытии
+                intraword = char == '_' and prev_char.isalnum() and next_char.isalnum()
+                if style == base_style:
+                    # Заголовок уже жирный: внутренние ** просто опускаем
+                    flush(i)
+                    i += size
+                    text_start = i
+                    continue
+                # Закрывает только тот же разделитель, которым стиль открыт: * и _ оба курсив, но *a_ не пара
+                closes = any(entry[2] == delimiter_text for entry in stack)
+                if closes and not prev_char.isspace() and not intraword:
+                    flush(i)
+                    # Закрываем вложенные стили выше и открываем их заново, чтобы вложенность осталась корректной
+                    reopen = []
+                    while stack[-1][2] != delimiter_text:
+                        inner = stack.pop()
+                        _close(pieces, inner)
+                        reopen.append(inner[2])
+                    _close(pieces, stack.pop())
+                    for inner_delimiter in reversed(reopen):
+                        inner_style = _delimiter(inner_delimiter, 0)[0]
+                        stack.append((inner_style, len(pieces), inner_delimiter))
+                        pieces.append(('open', inner_style))
+                    i += size
+                    text_start = i
+                    continue
+                if style not in open_styles and not next_char.isspace() and not intraword:
+                    flush(i)
+                    stack.append((style, len(pieces), delimiter_text))
+                    pieces.append(('open', style))
+                    i += size
+                    text_start = i
+                    continue
+                i += size
+                continue
+        i += 1
+    flush(n)
+
+    # Незакрытые разделители - обычный текст
+    for style, index, delimiter_text in stack:
+        pieces[index] = ('text', delimiter_text)
+    if base_style and pieces:
+        pieces = [('open', base_style)] + pieces + [('close', base_style)]
+    return pieces
+
+
+def _render_piece(piece):
+    kind = piece[0]
+    if kind == 'text':
+        return escape_text(piece[1])
+    if kind in ('open', 'close'):
+        return STYLE_MARKERS[piece[1]]
+    if kind == 'code':
+        return '`' + escape_code(piece[1]) + '`'
+    return '[' + escape_text(piece[1]) + '](' + escape_url(piece[2]) + ')'
+
+
+def _line_pieces(line):
+    heading = HEADING_RE.match(line)
+    if heading:
+        return _inline_pieces(heading.group(1), base_style='bold')
+    return _inline_pieces(line)
+
+
+def _blocks(text):
+    # Единицы вывода: ('line', кусочки) для каждой строки текста и ('pre', язык, код) для блоков кода
+    blocks = []
+    pos = 0
+    n = len(text)
+    after_fence = False
+    while pos < n:
+        start = text.find('```', pos)
+        prose = text[pos:start if start != -1 else n]
+        if after_fence and prose.startswith('\n'):
+            prose = prose[1:]
+        if start != -1 and prose.endswith('\n'):
+            prose = prose[:-1]
+        if prose or start == -1:
+            blocks.extend(('line', _line_pieces(line)) for line in prose.split('\n'))
+        if start == -1:
+            break
+        header_start = start + 3
+        newline = text.find('\n', header_start)
+        header = text[header_start:newline].strip() if newline != -1 else None
+        if header is not None and LANG_RE.fullmatch(header):
+            language, body_start = header, newline + 1
+        else:
+            language, body_start = '', header_start
+        end = text.find('```', body_start)
+        code = text[body_start:end if end != -1 else n]
+        blocks.append(('pre', language, code.strip('\n')))
+        pos = end + 3 if end != -1 else n
+        after_fence = True
+    return blocks
+
+
+def _render_pre(language, code):
+    return '```' + language + '\n' + escape_code(code) + '\n```'
+
+
+def render(text):
+    return '\n'.join(
+        _render_pre(block[1], block[2]) if block[0] == 'pre' else ''.join(map(_render_piece, block[1]))
+        for block in _blocks(text)
+    )
+
+
+def _split_raw(raw, escape, budget):
+    # Режет сырой текст так, чтобы каждая часть после экранирования укладывалась в budget,
+    # по возможности по пробелу и никогда - между обратной косой чертой и символом
+    parts = []
+    start = 0
+    length = 0
+    last_space = -1
+    for i, char in enumerate(raw):
+        size = len(escape(char))
+        if length + size > budget and i > start:
+            cut = last_space + 1 if last_space >= start else i
+            length = len(escape(raw[cut:i]))
+            if length + size > budget:
+                cut, length = i, 0
+            parts.append(raw[start:cut])
+            start = cut
+            last_space = -1
+        length += size
+        if char.isspace():
+            last_space = i
+    parts.append(raw[start:])
+    return parts
+
+
+def _split_pre(language, code, limit):
+    # Язык, который съедает больше половины сообщения, выводим без подсветки
+    if len(_render_pre(language, '')) > limit // 2:
+        language = ''
+    overhead = len(_render_pre(language, ''))
+    budget = max(limit - overhead, 1)
+    parts = []
+    current = []
+    length = 0
+    for line in code.split('\n'):
+        for segment in _split_raw(line, escape_code, budget):
+            size = len(escape_code(segment)) + (1 if current else 0)
+            if current and length + size > budget:
+                parts.append(_render_pre(language, '\n'.join(current)))
+                current, length = [], 0
+                size -= 1
+            current.append(segment)
+            length += size
+    parts.append(_render_pre(language, '\n'.join(current)))
+    return parts
+
+
+def _split_line(pieces, limit):
+    # Слишком длинная строка: режем между кусочками, закрывая открытые стили и открывая их в следующей части
+    parts = []
+    stack = []
+    current = []  # (текст, вид кусочка)
+    length = 0
+    base = 0  # длина открывающих маркеров в начале текущей части
+
+    def reserve():
+        return sum(len(STYLE_MARKERS[style]) for style in stack)
+
+    def cut():
+        nonlocal current, length, base
+        # Стили, открытые в самом конце части, переносим целиком в следующую, чтобы не было пустых сущностей
+        trailing = 0
+        while current and current[-1][1] == 'open':
+            current.pop()
+            trailing += 1
+        closing = stack[:len(stack) - trailing]
+        parts.append(''.join(text for text, _ in current) + ''.join(STYLE_MARKERS[style] for style in reversed(closing)))
+        current = [(STYLE_MARKERS[style], 'open') for style in stack]
+        length = base = sum(len(text) for text, _ in current)
+
+    def add(text, kind):
+        nonlocal length
+        current.append((text, kind))
+        length += len(text)
+
+    for piece in pieces:
+        kind = piece[0]
+        rendered = _render_piece(piece)
+        if kind == 'close':
+            # Место под закрывающий маркер уже зарезервировано
+            stack.pop()
+            add(rendered, kind)
+            continue
+        extra = len(rendered) if kind == 'open' else 0
+        if length + len(rendered) + reserve() + extra <= limit:
+            add(rendered, kind)
+            if kind == 'open':
+                stack.append(piece[1])
+            continue
+        if kind == 'text' or len(rendered) + 2 * reserve() > limit:
+            # Длинный текст режем по пробелам; код или ссылку длиннее сообщения отдаем как обычный текст
+            for segment in _split_raw(piece[1], escape_text, max(limit - 2 * reserve(), 1)):
+                rendered = escape_text(segment)
+                if length + len(rendered) + reserve() > limit and length > base:
+                    cut()
+                add(rendered, 'text')
+            continue
+        cut()
+        add(rendered, kind)
+        if kind == 'open':
+            stack.append(piece[1])
+    parts.append(''.join(text for text, _ in current))
+    return parts
+
+
+def render_chunks(text, limit=TELEGRAM_MESSAGE_LIMIT):
+    # Готовые сообщения MarkdownV2 не длиннее limit; режем в первую очередь по блокам кода и пустым строкам
+    units = []  # (текст, можно ли резать после него)
+    for block in _blocks(text):
+        if block[0] == 'pre':
+            rendered = [_render_pre(block[1], block[2])]
+            if len(rendered[0]) > limit:
+                rendered = _split_pre(block[1], block[2], limit)
+            units.extend((part, True) for part in rendered)
+        else:
+            rendered = ''.join(map(_render_piece, block[1]))
+            if len(rendered) > limit:
+                units.extend((part, False) for part in _split_line(block[1], limit))
+            else:
+                units.append((rendered, not rendered))
+
+    chunks = []
+    current = []
+    length = 0
+    for unit in units:
+        size = len(unit[0]) + (1 if current else 0)
+        if current and length + size > limit:
+            # Отступаем к последней границе абзаца, если она не слишком близко к началу сообщения
+            boundary = None
+            running = 0
+            for index, (part, is_boundary) in enumerate(current):
+                running += len(part) + (1 if index else 0)
+                if is_boundary and running >= limit // 2:
+                    boundary = index
+            carry = []
+            if boundary is not None and boundary < len(current) - 1:
+                carry = current[boundary + 1:]
+                current = current[:boundary + 1]
+            chunks.append('\n'.join(part for part, _ in current).strip('\n'))
+            current = carry
+            length = sum(len(part) for part, _ in current) + max(len(current) - 1, 0)
+            size = len(unit[0]) + (1 if current else 0)
+            if current and length + size > limit:
+                chunks.append('\n'.join(part for part, _ in current).strip('\n'))
+                current, length, size = [], 0, len(unit[0])
+        current.append(unit)
+        length += size
+    chunks.append('\n'.join(part for part, _ in current).strip('\n'))
+    chunks = [chunk for chunk in chunks if chunk]
+    if any(len(chunk) > limit for chunk in chunks):
+        # Последний рубеж: Telegram не примет сообщение длиннее limit, поэтому отдаем ответ
+        # без разметки - экранированный текст можно резать где угодно, кроме экранирования
+        chunks = _raw_chunks(text, limit)
+    # Разметка без текста (например, "_*") дает пустой рендер, а пустое сообщение Telegram не примет
+    return chunks or _raw_chunks(text, limit)
+
+
+def _raw_chunks(text, limit):
+    return [escape_text(part) for part in _split_raw(text, escape_text, limit) if part.strip()]
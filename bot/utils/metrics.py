@@ -0,0 +1,222 @@
+# bot/utils/metrics.py
+
+import functools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from config.settings import METRICS_ALLOWED_IPS
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def header(self):
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._values)
+
+    def render(self):
+        with self._lock:
+            values = dict(self._values)
+        return self.header() + [f'{self.name}{_labels(self.labelnames, key)} {_number(value)}'
+                                for key, value in sorted(values.items())]
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels, value):
+        with self._lock:
+            self._values[labels] = value
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets) + (float('inf'),)
+
+    def observe(self, *labels, value):
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][index] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def snapshot(self):
+        # {метки: {'count', 'sum'}} - для отчетов без разбора текстового формата
+        with self._lock:
+            return {key: {'count': count, 'sum': total} for key, (counts, total, count) in self._values.items()}
+
+    def render(self):
+        with self._lock:
+            values = {key: (list(counts), total, count) for key, (counts, total, count) in self._values.items()}
+        lines = self.header()
+        for key, (counts, total, count) in sorted(values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{_labels(self.labelnames, key, [("le", _number(bound))])} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}')
+            lines.append(f'{self.name}_count{_labels(self.labelnames, key)} {count}')
+        return lines
+
+# Реестр процесса: метрики этапов и коллекторы, которые при каждом запросе /metrics
+# переводят уже существующие stats() компонентов в gauge
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def register_stats(self, component, stats_fn):
+        with self._lock:
+            self._collectors[component] = stats_fn
+
+    def _collect_stats(self):
+        lines = ['# HELP bot_component_stat Values from component stats()',
+                 '# TYPE bot_component_stat gauge']
+        with self._lock:
+            collectors = list(self._collectors.items())
+        for component, stats_fn in collectors:
+            try:
+                stats = stats_fn()
+            except Exception as e:
+                logging.error(f"Could not collect stats for {component}: {e}")
+                continue
+            for key, value in _flatten(stats):
+                lines.append(f'bot_component_stat{_labels(("component", "stat"), (component, key))} {_number(value)}')
+        return lines
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        lines.extend(self._collect_stats())
+        return '\n'.join(lines) + '\n'
+
+def _flatten(stats, prefix=''):
+    # Вложенные словари разворачиваются в ключи вида pool.checkouts; нечисловые значения пропускаются
+    for key, value in stats.items():
+        name = f'{prefix}{key}'
+        if isinstance(value, dict):
+            yield from _flatten(value, name + '.')
+        elif isinstance(value, bool):
+            yield name, int(value)
+        elif isinstance(value, (int, float)):
+            yield name, value
+
+registry = MetricsRegistry()
+
+stage_duration = registry.register(Histogram(
+    'bot_stage_duration_seconds', 'Time spent in a request stage', ('stage',)))
+stage_errors = registry.register(Counter(
+    'bot_stage_errors_total', 'Exceptions raised by a request stage', ('stage', 'error')))
+stage_in_flight = registry.register(Gauge(
+    'bot_stage_in_flight', 'Calls of a request stage currently running', ('stage',)))
+
+@contextmanager
+def track(stage):
+    # Замер этапа: время в гистограмму, исключение - в счетчик ошибок, число одновременных вызовов - в gauge
+    stage_in_flight.inc(stage)
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        stage_errors.inc(stage, type(e).__name__)
+        raise
+    finally:
+        stage_duration.observe(stage, value=time.perf_counter() - started)
+        stage_in_flight.dec(stage)
+
+def timed(stage):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with track(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def instrument_methods(prefix):
+    # Декоратор класса: все публичные методы замеряются как этапы prefix.<метод>
+    def decorator(cls):
+        for name, value in list(vars(cls).items()):
+            if not name.startswith('_') and callable(value):
+                setattr(cls, name, timed(f'{prefix}.{name}')(value))
+        return cls
+    return decorator
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        if self.client_address[0] not in METRICS_ALLOWED_IPS:
+            self.send_error(403)
+            return
+        body = registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug("Metrics %s - %s", self.address_string(), format % args)
+
+def start_metrics_server(listen, port):
+    # Отдельный порт для /metrics: у бота в режиме polling нет своего HTTP-сервера
+    server = ThreadingHTTPServer((listen, port), MetricsRequestHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    logging.info(f"Metrics available on http://{listen}:{port}/metrics")
+    return server
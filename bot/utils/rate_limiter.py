@@ -0,0 +1,155 @@
+# bot/utils/rate_limiter.py
+
+import json
+import logging
+import threading
+import time
+from collections import deque, namedtuple
+from datetime import datetime
+from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.exc import SQLAlchemyError
+from bot.database.storage import engine, begin_write
+from bot.database.models import RateLimitState
+from config.settings import (MAX_QUESTIONS_PER_HOUR_PREMIUM, MAX_QUESTIONS_PER_HOUR_REGULAR,
+                             RATE_LIMIT_WINDOW, RATE_LIMIT_FLUSH_INTERVAL)
+
+RateLimitResult = namedtuple('RateLimitResult', ['allowed', 'limit', 'remaining', 'resets_in'])
+
+# Лимит вопросов в скользящем окне: проверка и списание атомарны в памяти,
+# состояние сохраняется в SQLite фоновым потоком
+class SlidingWindowRateLimiter:
+    def __init__(self, limit_premium, limit_regular, window=RATE_LIMIT_WINDOW, flush_interval=RATE_LIMIT_FLUSH_INTERVAL):
+        self.limit_premium = limit_premium
+        self.limit_regular = limit_regular
+        self.window = window
+        self.flush_interval = flush_interval
+        self.table = RateLimitState.__table__
+        self._events = {}  # user_id -> deque с временем принятых сообщений
+        self._lock = threading.Lock()
+        self._dirty = set()
+        self._allowed = 0
+        self._rejected = 0
+        self._released = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='rate-limit-flusher', daemon=True)
+        self._thread.start()
+
+    def _load(self, user_id):
+        try:
+            with engine.connect() as conn:
+                raw = conn.execute(
+                    select(self.table.c.events).where(self.table.c.user_id == user_id)
+                ).scalar()
+        except SQLAlchemyError as e:
+            logging.error(f"Database error while loading rate limit state for {user_id}: {e}")
+            raw = None
+        return deque(json.loads(raw)) if raw else deque()
+
+    def _user_events(self, user_id):
+        # Вызывается под self._lock; чтение из базы - только при первом обращении к пользователю
+        events = self._events.get(user_id)
+        if events is None:
+            self._lock.release()
+            try:
+                loaded = self._load(user_id)
+            finally:
+                self._lock.acquire()
+            events = self._events.setdefault(user_id, loaded)
+        return events
+
+    def _evaluate(self, events, limit, now):
+        while events and events[0] <= now - self.window:
+            events.popleft()
+        resets_in = events[0] + self.window - now if events else 0.0
+        return len(events) < limit, limit - len(events), resets_in
+
+    def try_acquire(self, user_id, is_premium):
+        limit = self.limit_premium if is_premium else self.limit_regular
+        now = time.time()
+        with self._lock:
+            events = self._user_events(user_id)
+            allowed, remaining, resets_in = self._evaluate(events, limit, now)
+            if allowed:
+                events.append(now)
+                remaining -= 1
+                self._dirty.add(user_id)
+                self._allowed += 1
+                if len(events) == 1:
+                    resets_in = float(self.window)
+            else:
+                self._rejected += 1
+        return RateLimitResult(allowed, limit, remaining, resets_in)
+
+    def release(self, user_id):
+        # Возврат списанного сообщения, на которое пользователь не получил ответа (отказ или сбой upstream)
+        with self._lock:
+            events = self._events.get(user_id)
+            if not events:
+                return
+            events.pop()
+            self._dirty.add(user_id)
+            self._released += 1
+
+    def peek(self, user_id, is_premium):
+        limit = self.limit_premium if is_premium else self.limit_regular
+        with self._lock:
+            allowed, remaining, resets_in = self._evaluate(self._user_events(user_id), limit, time.time())
+        return RateLimitResult(allowed, limit, remaining, resets_in)
+
+    def reset(self, user_id):
+        with self._lock:
+            self._events[user_id] = deque()
+            self._dirty.add(user_id)
+
+    def flush(self):
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            rows = [
+                {'user_id': user_id, 'events': json.dumps(list(self._events.get(user_id, ()))), 'updated_at': datetime.utcnow()}
+                for user_id in dirty
+            ]
+            # Окна без актуальных событий в памяти не нужны - при следующем обращении состояние прочитается из базы
+            expired_before = time.time() - self.window
+            for user_id in [user_id for user_id, events in self._events.items() if not events or events[-1] <= expired_before]:
+                if user_id not in self._dirty:
+                    del self._events[user_id]
+        if not rows:
+            return
+        stmt = insert(self.table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[self.table.c.user_id],
+            set_={'events': stmt.excluded.events, 'updated_at': stmt.excluded.updated_at}
+        )
+        try:
+            with engine.begin() as conn:
+                begin_write(conn)
+                conn.execute(stmt, rows)
+        except SQLAlchemyError as e:
+            logging.error(f"Database error while saving rate limit state: {e}")
+            with self._lock:
+                self._dirty.update(row['user_id'] for row in rows)
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception:
+                logging.exception("Unexpected error in rate limit flusher")
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        self.flush()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'tracked_users': len(self._events),
+                'dirty': len(self._dirty),
+                'allowed': self._allowed,
+                'rejected': self._rejected,
+                'released': self._released,
+            }
+
+rate_limiter = SlidingWindowRateLimiter(MAX_QUESTIONS_PER_HOUR_PREMIUM, MAX_QUESTIONS_PER_HOUR_REGULAR)
@@ -0,0 +1,204 @@
+# bot/utils/response_cache.py
+
+import hashlib
+import atexit
+import json
+import logging
+import queue
+import re
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.exc import SQLAlchemyError
+from bot.database.models import ResponseCacheEntry
+from bot.database.storage import engine, begin_write
+from bot.utils.ttl_cache import TTLCache
+from config.settings import (RESPONSE_CACHE_ENABLED, RESPONSE_CACHE_TTL, RESPONSE_CACHE_MAX_SIZE, RESPONSE_CACHE_DISK_TTL,
+                             RESPONSE_CACHE_WRITE_QUEUE_SIZE, RESPONSE_CACHE_BYPASS_PREFIX, RESPONSE_CACHE_BYPASS_USERS)
+
+PRUNE_EVERY = 100  # Через сколько записей удалять устаревшие строки из SQLite
+WRITE_BATCH_SIZE = 50
+_STOP = object()
+
+# Кэш ответов по истории, которая уходит в HackerGPT: память (TTL + LRU) и SQLite,
+# переживающий перезапуск. Ключ - sha256 истории с нормализованными пробелами.
+# В SQLite пишет фоновый поток пачками, как журнал вопросов: обработчик не ждет блокировку записи
+class ResponseCache:
+    def __init__(self, enabled=RESPONSE_CACHE_ENABLED, ttl=RESPONSE_CACHE_TTL, max_size=RESPONSE_CACHE_MAX_SIZE,
+                 disk_ttl=RESPONSE_CACHE_DISK_TTL, bypass_prefix=RESPONSE_CACHE_BYPASS_PREFIX,
+                 bypass_users=RESPONSE_CACHE_BYPASS_USERS, write_queue_size=RESPONSE_CACHE_WRITE_QUEUE_SIZE):
+        self.enabled = enabled
+        self.disk_ttl = disk_ttl
+        self.bypass_prefix = bypass_prefix
+        self.bypass_users = set(bypass_users)
+        self.table = ResponseCacheEntry.__table__
+        self.memory = TTLCache(ttl, max_size)
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=write_queue_size)
+        self._thread = None
+        self._closed = False
+        self._memory_hits = 0
+        self._disk_hits = 0
+        self._misses = 0
+        self._bypassed = 0
+        self._stores = 0
+        self._dropped = 0
+        self._failed = 0
+
+    @staticmethod
+    def key(history):
+        normalized = [
+            [message.get('role'), re.sub(r'\s+', ' ', message.get('content') or '').strip()]
+            for message in history
+        ]
+        payload = json.dumps(normalized, ensure_ascii=False, separators=(',', ':'))
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def check_bypass(self, user_id, message):
+        # Возвращает текст без префикса и признак, что кэш для этого запроса не используется
+        bypass = not self.enabled or user_id in self.bypass_users
+        # Сообщение из одного префикса - не команда, а обычный текст: иначе вопрос ушел бы пустым
+        remainder = message[len(self.bypass_prefix):].lstrip() if message.startswith(self.bypass_prefix) else ''
+        if remainder.strip():
+            message = remainder
+            bypass = True
+        if bypass and self.enabled:
+            with self._lock:
+                self._bypassed += 1
+        return message, bypass
+
+    def get(self, history):
+        if not self.enabled:
+            return None
+        key = self.key(history)
+        response = self.memory.get(key)
+        if response is not None:
+            with self._lock:
+                self._memory_hits += 1
+            return response
+        response = self._load(key)
+        with self._lock:
+            if response is None:
+                self._misses += 1
+            else:
+                self._disk_hits += 1
+        if response is not None:
+            self.memory.set(key, response)
+        return response
+
+    def set(self, history, response):
+        if not self.enabled or not response:
+            return
+        key = self.key(history)
+        self.memory.set(key, response)
+        if self._closed:
+            return
+        self._ensure_started()
+        try:
+            self._queue.put_nowait({'key': key, 'response': response, 'created_at': datetime.utcnow()})
+        except queue.Full:
+            # Это только кэш: при отставании записи ответ остается в памяти, но не в SQLite
+            with self._lock:
+                self._dropped += 1
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='response-cache-writer', daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            batch = [item]
+            stop = False
+            # Все, что накопилось, пока шла прошлая запись, - одной транзакцией
+            while len(batch) < WRITE_BATCH_SIZE:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+            self._write(batch)
+            if stop:
+                return
+
+    def _write(self, batch):
+        # В пачке может дважды встретиться один ключ: остается последний ответ
+        rows = list({row['key']: row for row in batch}.values())
+        stmt = insert(self.table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[self.table.c.key],
+            set_={'response': stmt.excluded.response, 'created_at': stmt.excluded.created_at}
+        )
+        try:
+            with engine.begin() as conn:
+                begin_write(conn)
+                conn.execute(stmt, rows)
+        except SQLAlchemyError as e:
+            logging.error(f"Database error while storing {len(rows)} cached responses: {e}")
+            with self._lock:
+                self._failed += len(rows)
+            return
+        with self._lock:
+            prune = self._stores // PRUNE_EVERY != (self._stores + len(rows)) // PRUNE_EVERY
+            self._stores += len(rows)
+        if prune:
+            self.prune()
+
+    def close(self):
+        # Дописываем ответы, уже стоящие в очереди, и останавливаем поток
+        if self._closed:
+            return
+        self._closed = True
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join()
+
+    def _load(self, key):
+        cutoff = datetime.utcnow() - timedelta(seconds=self.disk_ttl)
+        try:
+            with engine.connect() as conn:
+                return conn.execute(
+                    select(self.table.c.response).where(self.table.c.key == key, self.table.c.created_at >= cutoff)
+                ).scalar()
+        except SQLAlchemyError as e:
+            logging.error(f"Database error while reading cached response: {e}")
+            return None
+
+    def prune(self):
+        cutoff = datetime.utcnow() - timedelta(seconds=self.disk_ttl)
+        try:
+            with engine.begin() as conn:
+                begin_write(conn)
+                conn.execute(delete(self.table).where(self.table.c.created_at < cutoff))
+        except SQLAlchemyError as e:
+            logging.error(f"Database error while pruning response cache: {e}")
+
+    def stats(self):
+        with self._lock:
+            hits = self._memory_hits + self._disk_hits
+            lookups = hits + self._misses
+            return {
+                'enabled': self.enabled,
+                'memory_size': self.memory.stats()['size'],
+                'memory_hits': self._memory_hits,
+                'disk_hits': self._disk_hits,
+                'misses': self._misses,
+                'hit_rate': hits / lookups if lookups else 0.0,
+                'bypassed': self._bypassed,
+                'stores': self._stores,
+                'write_queue_depth': self._queue.qsize(),
+                'write_dropped': self._dropped,
+                'write_failed': self._failed,
+            }
+
+response_cache = ResponseCache()
+atexit.register(response_cache.close)
@@ -0,0 +1,72 @@
+# bot/utils/streaming.py
+
+import logging
+import time
+from telegram.error import BadRequest, RetryAfter, TelegramError
+from bot.utils.metrics import track
+from config.settings import STREAM_EDIT_INTERVAL, STREAM_EDIT_MIN_CHARS
+
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+# Накапливает ответ по частям и редактирует сообщение-заглушку не чаще, чем позволяет Telegram
+class ProgressiveMessage:
+    def __init__(self, bot, chat_id, message_id, min_interval=STREAM_EDIT_INTERVAL, min_chars=STREAM_EDIT_MIN_CHARS):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.min_interval = min_interval
+        self.min_chars = min_chars
+        self.edits = 0
+        self._parts = []
+        self._length = 0
+        self._shown_length = 0
+        self._next_edit_at = 0.0
+
+    @property
+    def text(self):
+        return ''.join(self._parts)
+
+    def append(self, chunk):
+        self._parts.append(chunk)
+        self._length += len(chunk)
+        # Превью уже упирается в лимит Telegram, дальше оно не меняется до финальной отправки
+        if self._shown_length >= TELEGRAM_MESSAGE_LIMIT:
+            return
+        if self._length - self._shown_length < self.min_chars or time.monotonic() < self._next_edit_at:
+            return
+        text = self.text
+        if len(text) > TELEGRAM_MESSAGE_LIMIT:
+            text = text[:TELEGRAM_MESSAGE_LIMIT - 1] + '…'
+        # Превью уходит без parse_mode: незакрытая разметка на середине ответа ломает MarkdownV2
+        self._edit(text)
+        self._shown_length = self._length
+
+    def finish(self, text, parse_mode=None):
+        self._edit(text, parse_mode=parse_mode, final=True)
+
+    def _edit(self, text, parse_mode=None, final=False):
+        try:
+            with track('telegram.edit_message_text'):
+                self.bot.edit_message_text(
+                    chat_id=self.chat_id,
+                    message_id=self.message_id,
+                    text=text,
+                    parse_mode=parse_mode
+                )
+            self.edits += 1
+            self._next_edit_at = time.monotonic() + self.min_interval
+        except RetryAfter as e:
+            logging.warning(f"Edit rate limited for chat {self.chat_id}, pausing for {e.retry_after}s")
+            self._next_edit_at = time.monotonic() + e.retry_after
+            if final:
+                # Финальный текст терять нельзя: дожидаемся окна и повторяем
+                time.sleep(e.retry_after)
+                self._edit(text, parse_mode=parse_mode, final=True)
+        except TelegramError as e:
+            if isinstance(e, BadRequest) and 'message is not modified' in str(e).lower():
+                return
+            # Сбой промежуточного кадра не должен обрывать ответ: следующий кадр или finish() его перекроют
+            if final:
+                raise
+            logging.warning(f"Skipped preview edit for chat {self.chat_id}: {e}")
+            self._next_edit_at = time.monotonic() + self.min_interval
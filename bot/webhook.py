@@ -0,0 +1,143 @@
+# bot/webhook.py
+
+import hmac
+import json
+import logging
+import queue
+import secrets
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from telegram import Update
+from telegram.error import TelegramError
+from config.settings import (WEBHOOK_URL, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET_TOKEN,
+                             WEBHOOK_MAX_CONNECTIONS, WEBHOOK_QUEUE_SIZE)
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+MAX_BODY_SIZE = 1024 * 1024
+
+class WebhookRequestHandler(BaseHTTPRequestHandler):
+    # Keep-alive: Telegram держит до max_connections постоянных соединений
+    protocol_version = 'HTTP/1.1'
+
+    def _reply(self, status, body=b''):
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        if status == 503:
+            self.send_header('Retry-After', '1')
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+        self.server.record(status)
+
+    def do_POST(self):
+        server = self.server
+        if self.path != server.url_path:
+            self._reply(404)
+            return
+        length = int(self.headers.get('Content-Length') or 0)
+        if not hmac.compare_digest(self.headers.get(SECRET_HEADER, ''), server.secret_token):
+            self.rfile.read(min(length, MAX_BODY_SIZE))
+            self._reply(403)
+            return
+        if length <= 0 or length > MAX_BODY_SIZE:
+            self.close_connection = True
+            self._reply(413 if length > MAX_BODY_SIZE else 400)
+            return
+        body = self.rfile.read(length)
+        try:
+            update = Update.de_json(json.loads(body), server.bot)
+        except (ValueError, TypeError, KeyError) as e:
+            logging.warning(f"Malformed webhook update: {e}")
+            self._reply(400)
+            return
+        if update is None:
+            self._reply(400)
+            return
+        # Очередь переполнена: 503, Telegram повторит доставку позже
+        if server.update_queue.qsize() >= server.queue_size:
+            self._reply(503)
+            return
+        try:
+            server.update_queue.put_nowait(update)
+        except queue.Full:
+            self._reply(503)
+            return
+        self._reply(200)
+
+    def do_GET(self):
+        self._reply(405)
+
+    def log_message(self, format, *args):
+        logging.debug("Webhook %s - %s", self.address_string(), format % args)
+
+# HTTP-сервер приема апдейтов: проверяет секрет, разбирает Update и кладет его в очередь диспетчера.
+# Очередь ограничена queue_size; проверка по qsize, поэтому допускается превышение не больше числа соединений
+class WebhookServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Очередь accept по умолчанию (5) мала для max_connections параллельных соединений Telegram
+    request_queue_size = 128
+
+    def __init__(self, address, bot, update_queue, url_path, secret_token, queue_size):
+        super().__init__(address, WebhookRequestHandler)
+        self.bot = bot
+        self.update_queue = update_queue
+        self.url_path = url_path
+        self.secret_token = secret_token
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._responses = {}
+
+    def record(self, status):
+        with self._lock:
+            self._responses[status] = self._responses.get(status, 0) + 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'responses': dict(self._responses),
+                'queue_depth': self.update_queue.qsize(),
+                'queue_size': self.queue_size,
+            }
+
+def create_webhook_server(bot, update_queue, url=WEBHOOK_URL, listen=WEBHOOK_LISTEN, port=WEBHOOK_PORT,
+                          url_path=WEBHOOK_PATH, secret_token=WEBHOOK_SECRET_TOKEN,
+                          max_connections=WEBHOOK_MAX_CONNECTIONS, queue_size=WEBHOOK_QUEUE_SIZE):
+    # Регистрирует вебхук и создает сервер (не запуская его); None - зарегистрировать не удалось, нужен polling
+    if not secret_token:
+        # Несколько воркеров за балансировщиком должны получить общий WEBHOOK_SECRET_TOKEN из окружения
+        secret_token = secrets.token_urlsafe(32)
+        logging.warning("WEBHOOK_SECRET_TOKEN is not set, using a random token for this process")
+
+    if url:
+        try:
+            bot.set_webhook(
+                url=url.rstrip('/') + url_path,
+                max_connections=max_connections,
+                api_kwargs={'secret_token': secret_token},
+            )
+        except TelegramError as e:
+            logging.error(f"Could not set webhook, falling back to polling: {e}")
+            return None
+    else:
+        logging.warning("WEBHOOK_URL is not set: webhook is not registered, updates are expected from a local proxy or stub")
+
+    return WebhookServer((listen, port), bot, update_queue, url_path, secret_token, queue_size)
+
+def start_webhook(updater, **kwargs):
+    # Возвращает сервер или None, если вебхук зарегистрировать не удалось и нужно остаться на polling
+    server = create_webhook_server(updater.bot, updater.update_queue, **kwargs)
+    if server is None:
+        return None
+
+    # Запускаем то же, что Updater.start_webhook, но с собственным сервером; updater.stop() остановит его через httpd
+    dispatcher_ready = threading.Event()
+    updater.running = True
+    updater.job_queue.start()
+    threading.Thread(target=updater.dispatcher.start, kwargs={'ready': dispatcher_ready},
+                     name='dispatcher', daemon=True).start()
+    threading.Thread(target=server.serve_forever, name='webhook', daemon=True).start()
+    updater.httpd = server
+    dispatcher_ready.wait()
+    listen, port = server.server_address[:2]
+    logging.info(f"Webhook listening on {listen}:{port}{server.url_path}")
+    return server
@@ -12,7 +12,7 @@ load_dotenv(dotenv_path=dotenv_path)
 ADMIN_TELEGRAM_ID = 188095989  # Замените на ваш реальный Telegram ID
 
 # Настройки базы данных
-DATABASE_URL = "sqlite:///bot_database.db"
+DATABASE_URL = getenv('DATABASE_URL', "sqlite:///bot_database.db")
 
 # Токены и ключи API
 FREEKASSA_API_KEY = getenv('FREEKASSA_API_KEY')
@@ -22,6 +22,136 @@ SECRET_KEY_2 = getenv('FREEKASSA_SECRET_KEY_2')
 TELEGRAM_BOT_TOKEN = getenv('TELEGRAM_BOT_TOKEN')
 HACKERGPT_API_KEY = getenv('HACKERGPT_API_KEY')
 HACKERGPT_LINK = getenv('HACKERGPT_LINK')
+TELEGRAM_BASE_URL = getenv('TELEGRAM_BASE_URL', 'https://api.telegram.org/bot')  # Другой адрес - локальный Bot API или заглушка
+
+# Пул обработки апдейтов: параллельно между чатами, по порядку внутри чата
+BOT_WORKERS = int(getenv('BOT_WORKERS', 8))
+BOT_MAX_PENDING_UPDATES = int(getenv('BOT_MAX_PENDING_UPDATES', 500))  # 0 - без ограничения
+BUSY_MESSAGE = "Бот сейчас перегружен, попробуйте отправить сообщение чуть позже."
+
+# Несколько процессов: главный получает апдейты и раздает их воркерам по user_id (0 или 1 - один процесс)
+CLUSTER_WORKERS = int(getenv('CLUSTER_WORKERS', 0))
+CLUSTER_QUEUE_SIZE = int(getenv('CLUSTER_QUEUE_SIZE', 1000))  # Апдейтов в очереди одного воркера
+CLUSTER_HEARTBEAT_INTERVAL = float(getenv('CLUSTER_HEARTBEAT_INTERVAL', 5))
+CLUSTER_HEARTBEAT_TIMEOUT = float(getenv('CLUSTER_HEARTBEAT_TIMEOUT', 30))  # Без сигнала дольше - воркер перезапускается
+CLUSTER_POLL_TIMEOUT = int(getenv('CLUSTER_POLL_TIMEOUT', 10))  # Long polling getUpdates в главном процессе
+
+# Получение апдейтов: 'polling' или 'webhook' (при ошибке регистрации вебхука бот остается на polling)
+BOT_MODE = getenv('BOT_MODE', 'polling')
+WEBHOOK_URL = getenv('WEBHOOK_URL')  # Публичный адрес без пути, например https://bot.example.com
+WEBHOOK_LISTEN = getenv('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(getenv('WEBHOOK_PORT', 8443))
+WEBHOOK_PATH = getenv('WEBHOOK_PATH', '/telegram')
+WEBHOOK_SECRET_TOKEN = getenv('WEBHOOK_SECRET_TOKEN')  # Общий для всех воркеров за балансировщиком
+WEBHOOK_MAX_CONNECTIONS = int(getenv('WEBHOOK_MAX_CONNECTIONS', 40))
+WEBHOOK_QUEUE_SIZE = int(getenv('WEBHOOK_QUEUE_SIZE', 1000))
+
+# Пул соединений к HackerGPT (maxsize подбирается под число воркеров)
+HACKERGPT_POOL_CONNECTIONS = int(getenv('HACKERGPT_POOL_CONNECTIONS', 4))
+HACKERGPT_POOL_MAXSIZE = int(getenv('HACKERGPT_POOL_MAXSIZE', BOT_WORKERS))
+HACKERGPT_POOL_BLOCK = True  # Ждать свободное соединение вместо открытия лишних
+
+# Несколько адресов/ключей HackerGPT: "url|key|max_concurrent,..." (ключ и лимит можно опустить);
+# без HACKERGPT_ENDPOINTS используется HACKERGPT_LINK с HACKERGPT_API_KEY
+HACKERGPT_ENDPOINTS = getenv('HACKERGPT_ENDPOINTS', '')
+HACKERGPT_ENDPOINT_MAX_CONCURRENT = int(getenv('HACKERGPT_ENDPOINT_MAX_CONCURRENT', 0))  # На ключ для всего бота (в кластере делится между воркерами), 0 - без ограничения
+BALANCER_EWMA_DECAY = float(getenv('BALANCER_EWMA_DECAY', 0.3))  # Вес нового замера в скользящих средних
+BALANCER_INITIAL_LATENCY = float(getenv('BALANCER_INITIAL_LATENCY', 1.0))  # Оценка задержки нового адреса, с
+BALANCER_EJECT_ERROR_RATE = float(getenv('BALANCER_EJECT_ERROR_RATE', 0.5))  # Доля ошибок, при которой адрес исключается
+BALANCER_EJECT_MIN_REQUESTS = int(getenv('BALANCER_EJECT_MIN_REQUESTS', 10))
+
+# Повторы запросов к HackerGPT: все попытки и паузы между ними укладываются в HACKERGPT_DEADLINE
+HACKERGPT_DEADLINE = float(getenv('HACKERGPT_DEADLINE', 45))
+HACKERGPT_ATTEMPT_TIMEOUT = float(getenv('HACKERGPT_ATTEMPT_TIMEOUT', 20))
+HACKERGPT_MAX_ATTEMPTS = int(getenv('HACKERGPT_MAX_ATTEMPTS', 3))
+HACKERGPT_RETRY_BASE_DELAY = float(getenv('HACKERGPT_RETRY_BASE_DELAY', 0.5))
+HACKERGPT_RETRY_MAX_DELAY = float(getenv('HACKERGPT_RETRY_MAX_DELAY', 5))
+# Размыкатель цепи: после BREAKER_FAILURE_THRESHOLD сбоев подряд запросы сразу получают ошибку,
+# через BREAKER_RECOVERY_TIMEOUT секунд upstream проверяется пробными запросами
+BREAKER_FAILURE_THRESHOLD = int(getenv('BREAKER_FAILURE_THRESHOLD', 5))
+BREAKER_RECOVERY_TIMEOUT = float(getenv('BREAKER_RECOVERY_TIMEOUT', 30))
+BREAKER_HALF_OPEN_CALLS = int(getenv('BREAKER_HALF_OPEN_CALLS', 1))
+
+# Допуск запросов к HackerGPT: не больше ADMISSION_MAX_CONCURRENT одновременно, остальные потоки пула
+# ждут в очереди с приоритетом премиум-пользователей (0 - без ограничения)
+ADMISSION_MAX_CONCURRENT = int(getenv('ADMISSION_MAX_CONCURRENT', max(1, BOT_WORKERS // 2)))
+ADMISSION_MAX_QUEUE = int(getenv('ADMISSION_MAX_QUEUE', 200))  # Больше ожидающих - отказ сразу
+ADMISSION_QUEUE_TIMEOUT = float(getenv('ADMISSION_QUEUE_TIMEOUT', 60))  # Дольше в очереди - отказ
+ADMISSION_PREMIUM_HEAD_START = float(getenv('ADMISSION_PREMIUM_HEAD_START', 20))  # Секунд форы премиум-запросу
+ADMISSION_POSITION_INTERVAL = float(getenv('ADMISSION_POSITION_INTERVAL', 3))  # Как часто обновлять место в очереди
+QUEUE_POSITION_MESSAGE = "Генерирую ответ... Ваше место в очереди: {position}"
+
+# Исходящие уведомления через Bot API (лимиты Telegram: ~30 сообщений в секунду, 1 в секунду в один чат)
+TELEGRAM_SEND_RATE = float(getenv('TELEGRAM_SEND_RATE', 30))
+TELEGRAM_CHAT_INTERVAL = float(getenv('TELEGRAM_CHAT_INTERVAL', 1.0))
+TELEGRAM_SENDER_THREADS = int(getenv('TELEGRAM_SENDER_THREADS', 4))
+TELEGRAM_SEND_QUEUE_SIZE = int(getenv('TELEGRAM_SEND_QUEUE_SIZE', 10000))
+TELEGRAM_SEND_MAX_ATTEMPTS = int(getenv('TELEGRAM_SEND_MAX_ATTEMPTS', 5))
+TELEGRAM_CHAT_ID_CACHE_SIZE = int(getenv('TELEGRAM_CHAT_ID_CACHE_SIZE', 10000))
+
+# Рассылка администратора по всем пользователям
+BROADCAST_RATE = float(getenv('BROADCAST_RATE', 20))  # Сообщений в секунду, с запасом под обычные уведомления
+BROADCAST_BATCH_SIZE = int(getenv('BROADCAST_BATCH_SIZE', 500))  # Пользователей на страницу; прогресс сохраняется после каждой
+BROADCAST_RESULT_TIMEOUT = float(getenv('BROADCAST_RESULT_TIMEOUT', 600))  # Сколько ждать итогов страницы, секунд; не дождавшиеся считаются ошибками
+
+# Обработка уведомлений FreeKassa: веб-хук сохраняет событие и сразу отвечает YES, остальное - в фоне
+PREMIUM_DURATION_DAYS = int(getenv('PREMIUM_DURATION_DAYS', 30))
+PAYMENT_POLL_INTERVAL = float(getenv('PAYMENT_POLL_INTERVAL', 5))  # Секунд между проверками таблицы payments
+PAYMENT_BATCH_SIZE = int(getenv('PAYMENT_BATCH_SIZE', 50))
+PAYMENT_MAX_ATTEMPTS = int(getenv('PAYMENT_MAX_ATTEMPTS', 8))
+PAYMENT_RETRY_BASE_DELAY = float(getenv('PAYMENT_RETRY_BASE_DELAY', 5))  # Пауза перед повтором, удваивается
+PAYMENT_CLAIM_TIMEOUT = int(getenv('PAYMENT_CLAIM_TIMEOUT', 300))  # Через сколько зависший платеж берет другой воркер
+
+# Продакшн-запуск веб-хука через gunicorn (web/gunicorn.conf.py)
+WEB_BIND = getenv('WEB_BIND', '0.0.0.0:5000')
+WEB_WORKERS = int(getenv('WEB_WORKERS', 2))
+WEB_THREADS = int(getenv('WEB_THREADS', 4))
+WEB_TIMEOUT = int(getenv('WEB_TIMEOUT', 30))
+
+# Пул соединений и режим работы SQLite
+DB_POOL_SIZE = int(getenv('DB_POOL_SIZE', BOT_WORKERS + 4))
+DB_MAX_OVERFLOW = int(getenv('DB_MAX_OVERFLOW', 4))
+DB_POOL_TIMEOUT = float(getenv('DB_POOL_TIMEOUT', 10))  # Секунд ожидания свободного соединения
+DB_BUSY_TIMEOUT_MS = int(getenv('DB_BUSY_TIMEOUT_MS', 5000))  # Сколько ждать блокировку записи
+DB_SYNCHRONOUS = getenv('DB_SYNCHRONOUS', 'NORMAL')  # В режиме WAL NORMAL не теряет целостность
+DB_CACHE_SIZE_KB = int(getenv('DB_CACHE_SIZE_KB', 16384))
+
+# Потоковая выдача ответа с постепенным редактированием сообщения
+STREAM_RESPONSES = getenv('STREAM_RESPONSES', 'true').lower() in ('1', 'true', 'yes')
+STREAM_EDIT_INTERVAL = float(getenv('STREAM_EDIT_INTERVAL', 1.5))  # Секунд между правками одного сообщения
+STREAM_EDIT_MIN_CHARS = int(getenv('STREAM_EDIT_MIN_CHARS', 40))  # Минимальный прирост текста для новой правки
+
+# Окно истории диалога, отправляемое в HackerGPT
+HISTORY_BUDGET_UNIT = getenv('HISTORY_BUDGET_UNIT', 'tokens')  # 'tokens' (оценка) или 'chars'
+HISTORY_BUDGET = int(getenv('HISTORY_BUDGET', 3000))
+HISTORY_KEEP_LAST = int(getenv('HISTORY_KEEP_LAST', 2))  # Последние реплики, которые не обрезаются никогда
+HISTORY_TRIM_MODE = getenv('HISTORY_TRIM_MODE', 'collapse')  # 'drop' или 'collapse'
+HISTORY_COLLAPSE_SNIPPET = 120  # Длина фрагмента вопроса в свернутой заметке
+HISTORY_STORE_FACTOR = 2  # Сколько бюджетов истории держим в user_data
+
+# Хранение user_data/chat_data в SQLite
+PERSISTENCE_ENABLED = getenv('PERSISTENCE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+PERSISTENCE_FLUSH_INTERVAL = float(getenv('PERSISTENCE_FLUSH_INTERVAL', 5))  # Секунд между записями изменений
+PERSISTENCE_BATCH_SIZE = int(getenv('PERSISTENCE_BATCH_SIZE', 500))  # Строк в одной транзакции
+PERSISTENCE_IDLE_TIMEOUT = int(getenv('PERSISTENCE_IDLE_TIMEOUT', 3600))  # Через сколько секунд простоя выгружать пользователя из памяти
+
+# Фоновая запись журнала вопросов пачками
+QUERY_LOG_QUEUE_SIZE = int(getenv('QUERY_LOG_QUEUE_SIZE', 10000))
+QUERY_LOG_BATCH_SIZE = int(getenv('QUERY_LOG_BATCH_SIZE', 200))
+QUERY_LOG_FLUSH_INTERVAL = float(getenv('QUERY_LOG_FLUSH_INTERVAL', 1))  # Максимальная задержка записи, секунд
+
+# Кэш ответов HackerGPT на одинаковые запросы (по умолчанию выключен)
+RESPONSE_CACHE_ENABLED = getenv('RESPONSE_CACHE_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+RESPONSE_CACHE_TTL = int(getenv('RESPONSE_CACHE_TTL', 3600))  # Время жизни ответа в памяти, секунд
+RESPONSE_CACHE_MAX_SIZE = int(getenv('RESPONSE_CACHE_MAX_SIZE', 1000))
+RESPONSE_CACHE_DISK_TTL = int(getenv('RESPONSE_CACHE_DISK_TTL', 86400))  # Время жизни ответа в SQLite, секунд
+RESPONSE_CACHE_WRITE_QUEUE_SIZE = int(getenv('RESPONSE_CACHE_WRITE_QUEUE_SIZE', 1000))  # Ответы, ждущие записи в SQLite; сверх - не сохраняются
+RESPONSE_CACHE_BYPASS_PREFIX = '!nocache'  # Сообщение с этим префиксом всегда уходит в HackerGPT
+RESPONSE_CACHE_BYPASS_USERS = [int(user_id) for user_id in getenv('RESPONSE_CACHE_BYPASS_USERS', '').split(',') if user_id.strip()]
+
+# Кэш пользователей в DatabaseManager (бот и веб-хук - разные процессы, поэтому TTL небольшой)
+USER_CACHE_TTL = float(getenv('USER_CACHE_TTL', 60))
+USER_CACHE_MAX_SIZE = int(getenv('USER_CACHE_MAX_SIZE', 10000))
 
 # Настройки приложения и сообщений
 WELCOME_MESSAGE = "Привет! Я BlackGPT бот. Задайте мне вопрос."
@@ -32,11 +162,28 @@ PREMIUM_SUBSCRIPTION_PRICE = 10
 MAX_QUESTIONS_PER_HOUR_PREMIUM = 10
 MAX_QUESTIONS_PER_HOUR_REGULAR = 1
 FEEDBACK_COOLDOWN = 86400  # 1 час
+RATE_LIMIT_WINDOW = 3600  # Скользящее окно лимита, секунд
+RATE_LIMIT_FLUSH_INTERVAL = float(getenv('RATE_LIMIT_FLUSH_INTERVAL', 5))  # Как часто сохранять состояние лимитов в базу
+
+# Снятие истекших премиум-подписок
+EXPIRY_REFRESH_INTERVAL = int(getenv('EXPIRY_REFRESH_INTERVAL', 600))  # Как часто перечитывать ближайшие окончания из базы, секунд
+EXPIRY_LOOKAHEAD = int(getenv('EXPIRY_LOOKAHEAD', 86400))  # На сколько вперед держать окончания в памяти, секунд
 
 # Дополнительные настройки
 FREEKASSA_IPS = ['168.119.157.136', '168.119.60.227', '138.201.88.124', '178.154.197.79']
 
-# Настройки логирования
-LOG_FILE = 'logs/yourapp.log'
-LOG_MAX_BYTES = 10240
-LOG_BACKUP_COUNT = 10
+# Метрики Prometheus: бот отдает /metrics на отдельном порту (0 - выключено), веб-хук - на своем
+METRICS_LISTEN = getenv('METRICS_LISTEN', '127.0.0.1')
+METRICS_PORT = int(getenv('METRICS_PORT', 9100))
+METRICS_ALLOWED_IPS = [ip.strip() for ip in getenv('METRICS_ALLOWED_IPS', '127.0.0.1,::1').split(',') if ip.strip()]
+
+# Настройки логирования (bot/utils/logging.py): запись через очередь в фоновом потоке
+LOG_FILE = getenv('LOG_FILE', 'logs/yourapp.log')  # Лог веб-хука
+BOT_LOG_FILE = getenv('BOT_LOG_FILE', 'logs/bot.log')
+LOG_LEVEL = getenv('LOG_LEVEL', 'INFO')
+LOG_FORMAT = getenv('LOG_FORMAT', 'text')  # 'text' или 'json'
+LOG_MAX_BYTES = int(getenv('LOG_MAX_BYTES', 10 * 1024 * 1024))
+LOG_BACKUP_COUNT = int(getenv('LOG_BACKUP_COUNT', 5))
+LOG_QUEUE_SIZE = int(getenv('LOG_QUEUE_SIZE', 10000))  # При переполнении записи отбрасываются, а не блокируют
+LOG_PAYLOAD_MAX_CHARS = int(getenv('LOG_PAYLOAD_MAX_CHARS', 200))  # Сколько символов сообщения/ответа попадает в лог
+LOG_PAYLOAD_SAMPLE_RATE = float(getenv('LOG_PAYLOAD_SAMPLE_RATE', 0.1))  # Доля событий, где текст логируется вообще
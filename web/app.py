@@ -1,45 +1,39 @@
 # web/app.py
 
-from config.settings import MERCHANT_ID, SECRET_KEY_2, FREEKASSA_IPS, MAX_QUESTIONS_PER_HOUR_PREMIUM, MAX_QUESTIONS_PER_HOUR_REGULAR
-from bot.database.manager import DatabaseManager
-from bot.api.freekassa import send_telegram_notification
-from flask import Flask, request, jsonify
-from logging.handlers import RotatingFileHandler
+from config.settings import LOG_FILE, METRICS_ALLOWED_IPS, MERCHANT_ID, SECRET_KEY_2, FREEKASSA_IPS, MAX_QUESTIONS_PER_HOUR_PREMIUM, MAX_QUESTIONS_PER_HOUR_REGULAR
+from bot.database.manager import db_manager
+from bot.database.storage import init_db, storage_stats
+from bot.api.payment_processor import payment_processor
+from web.request_metrics import request_metrics
+from bot.utils.logging import setup_logging, logging_stats
+from bot.utils.metrics import registry, CONTENT_TYPE
+from flask import Flask, Response, request, jsonify
 import traceback
-import datetime
 import hashlib
-import logging
-import os
+import hmac
 
+# Логирование настраивается до первого обращения к app.logger, чтобы Flask не добавил свой обработчик
+setup_logging(LOG_FILE)
 app = Flask(__name__)
-db_manager = DatabaseManager(MAX_QUESTIONS_PER_HOUR_PREMIUM, MAX_QUESTIONS_PER_HOUR_REGULAR)
-
-# Настройка логирования
-if not os.path.exists('logs'):
-    os.mkdir('logs')
-file_handler = RotatingFileHandler('logs/yourapp.log', maxBytes=10240, backupCount=10)
-file_handler.setFormatter(logging.Formatter(
-    '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'))
-file_handler.setLevel(logging.INFO)
-app.logger.addHandler(file_handler)
-
-app.logger.setLevel(logging.INFO)
+
 app.logger.info('YourApp startup')
 
+request_metrics.install(app)
+registry.register_stats('payment_processor', payment_processor.stats)
+registry.register_stats('user_cache', db_manager.cache_stats)
+registry.register_stats('storage', storage_stats)
+registry.register_stats('logging', logging_stats)
+
 def is_valid_signature(data, secret_key):
-    app.logger.info(f"Validating signature with data: {data}")
     # Проверка наличия необходимых ключей
     required_keys = ['MERCHANT_ID', 'AMOUNT', 'MERCHANT_ORDER_ID']
     if not all(key in data for key in required_keys):
         return False
-    
-    # Формирование подписи
+
+    # Формирование подписи (строку подписи не логируем: в ней секретный ключ)
     generated_signature_str = f"{data['MERCHANT_ID']}:{data['AMOUNT']}:{secret_key}:{data['MERCHANT_ORDER_ID']}"
-    app.logger.info(f"Generated signature string: {generated_signature_str}")
     generated_signature = hashlib.md5(generated_signature_str.encode()).hexdigest()
-    app.logger.info(f"Generated signature: {generated_signature} | Received signature: {data.get('SIGN')}")
-
-    return generated_signature == data.get('SIGN')  
+    return hmac.compare_digest(generated_signature, data.get('SIGN', ''))
 
 def is_valid_ip(ip):
     # Проверка IP-адреса отправителя
@@ -47,30 +41,15 @@ def is_valid_ip(ip):
 
 @app.route('/payment_webhook', methods=['POST'])
 def payment_webhook():
-    # Логируем заголовки и данные формы
-    app.logger.info('Headers: %s', request.headers)
-    app.logger.info('Form data: %s', request.form)
-
-    # Обработка уведомлений
+    # Только проверка и сохранение события: активация премиума и уведомление - в payment_processor,
+    # чтобы касса получала YES быстро и не повторяла уведомления при всплесках платежей
     data = request.form.to_dict()
-    app.logger.info(f"Parsed data: {data}")
+    app.logger.debug('Payment notification: %s', data)
 
     if not is_valid_signature(data, SECRET_KEY_2):
-        app.logger.error("Invalid signature. Data: {data}")
+        app.logger.error(f"Invalid signature for order {data.get('MERCHANT_ORDER_ID')}")
         return jsonify({'error': 'Invalid signature'}), 400
 
-    # Получаем данные платежа
-    user_id = data.get('us_user_id')
-    payment_status = data.get('int_status')  # Уточните название поля у FreeKassa
-
-    # Проверяем наличие необходимых данных
-    if user_id is None:
-        app.logger.error("Missing user_id in payment data")
-        return jsonify({'error': 'Missing user_id'}), 400
-    if payment_status is None:
-        app.logger.warning(f"Missing payment status for user_id {user_id}. Assuming payment success.")
-        payment_status = "1"  # Предполагаем успешный платеж, если статус не указан
-
     # Handle test notifications
     if 'status_check' in request.form:
         # if is_valid_ip(request.remote_addr):
@@ -85,43 +64,54 @@ def payment_webhook():
     # Проверяем IP-адрес
     # if not is_valid_ip(request.remote_addr):
     #     app.logger.warning(f"Invalid IP: {request.remote_addr}")
-    #     return jsonify({'error': 'Invalid IP address'}), 403  
-    
-    required_keys = ['MERCHANT_ID', 'AMOUNT', 'MERCHANT_ORDER_ID', 'SIGN']
-    if not all(key in data for key in required_keys):
-        missing_keys = [key for key in required_keys if key not in data]
-        app.logger.warning(f"Missing required payment data fields: {missing_keys}")
-        return jsonify({'error': 'Invalid payment data'}), 400
+    #     return jsonify({'error': 'Invalid IP address'}), 403
+
+    # Повторное уведомление по уже записанному заказу: один поиск по индексу, без повторной обработки
+    order_id = data['MERCHANT_ORDER_ID']
+    if db_manager.get_payment(order_id) is not None:
+        app.logger.info(f"Duplicate notification for order {order_id}, already recorded")
+        return 'YES', 200
 
-    # Получаем данные платежа
     user_id = data.get('us_user_id')  # Дополнительные параметры с префиксом us_
+    if user_id is None or not user_id.isdigit():
+        app.logger.error(f"Missing user_id in payment data for order {order_id}")
+        return jsonify({'error': 'Missing user_id'}), 400
     payment_status = data.get('int_status', '1')  # Используем значение '1' по умолчанию, если статус не передан
 
-    if payment_status == "1":  # Успешный платеж
-        app.logger.info(f"Processing successful payment for user {user_id}")
-        new_expiration_date = datetime.datetime.now() + datetime.timedelta(days=30)
-
-        # Получение пользователя из базы данных
-        user = db_manager.get_user_by_id(user_id)
-        if user:
-            db_manager.update_premium_status(user_id, True, new_expiration_date)
-            if user.chat_id:
-                send_telegram_notification(user_id, "Ваша подписка активирована! Наслаждайтесь премиум-возможностями.", db_manager)
-            else:
-                app.logger.error(f"Chat ID not found for user {user_id}")
-        else:
-            app.logger.error(f"User not found for user_id {user_id}")
-    else:
-        app.logger.warning(f"Payment failed or unknown status for user {user_id}")
-        send_telegram_notification(user_id, "Не удалось обработать ваш платеж.", db_manager)
-
-    # Отправляем подтверждение обработки платежа
+    created = db_manager.add_payment_event(order_id, int(user_id), data['AMOUNT'], payment_status, data.get('intid'))
+    if created is None:
+        # Ошибка базы: не подтверждаем, касса пришлет уведомление повторно
+        return jsonify({'error': 'Payment was not recorded'}), 500
+    if created:
+        app.logger.info(f"Payment notification for order {order_id}, user {user_id}, status {payment_status} recorded")
+        payment_processor.notify()
+
+    # Отправляем подтверждение получения платежа
     return 'YES', 200
 
+@app.route('/stats', methods=['GET'])
+def stats():
+    # Только напрямую с локального адреса (запросы через прокси приходят с X-Forwarded-For):
+    # время ответа веб-хука и состояние фоновой обработки этого воркера
+    if request.remote_addr not in ('127.0.0.1', '::1') or 'X-Forwarded-For' in request.headers:
+        return jsonify({'error': 'Forbidden'}), 403
+    return jsonify(requests=request_metrics.stats(), payments=payment_processor.stats())
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    # Формат Prometheus; значения - этого воркера gunicorn
+    if request.remote_addr not in METRICS_ALLOWED_IPS or 'X-Forwarded-For' in request.headers:
+        return jsonify({'error': 'Forbidden'}), 403
+    return Response(registry.render(), content_type=CONTENT_TYPE)
+
 @app.errorhandler(Exception)
 def handle_general_error(error):
     app.logger.warning(f"An error occurred: {error}", exc_info=True)
     return jsonify(error=str(error), traceback=str(traceback.format_exc())), 500
 
 if __name__ == "__main__":
-    app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
+    # Локальный запуск; в продакшне - gunicorn -c web/gunicorn.conf.py web.wsgi:app,
+    # миграции там применяет хук on_starting
+    init_db()
+    payment_processor.start()
+    app.run(host='0.0.0.0', port=5000, threaded=True)
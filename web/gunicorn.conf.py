@@ -0,0 +1,33 @@
+# web/gunicorn.conf.py
+#
+# Запуск веб-хука оплаты: gunicorn -c web/gunicorn.conf.py web.wsgi:app
+
+import os
+
+# Под gunicorn лог приложения идет в stderr вместе с логом gunicorn: RotatingFileHandler не рассчитан
+# на несколько процессов, а файл на каждый pid плодил бы новые файлы при каждом перезапуске воркера (max_requests)
+os.environ.setdefault('LOG_FILE', '')
+
+from config.settings import WEB_BIND, WEB_WORKERS, WEB_THREADS, WEB_TIMEOUT
+
+bind = WEB_BIND
+workers = WEB_WORKERS
+threads = WEB_THREADS  # gthread: запрос веб-хука короткий, потоки дешевле процессов
+worker_class = 'gthread'
+timeout = WEB_TIMEOUT
+graceful_timeout = WEB_TIMEOUT
+# Приложение импортируется в каждом воркере уже после fork: потоки и соединения SQLite не наследуются
+preload_app = False
+max_requests = 10000
+max_requests_jitter = 1000
+
+accesslog = '-'
+# %(L)s - время обработки запроса в секундах
+access_log_format = '%(h)s "%(r)s" %(s)s %(b)s %(L)ss'
+
+def on_starting(server):
+    # Миграции - один раз в мастер-процессе до запуска воркеров, иначе воркеры применяют их наперегонки
+    from bot.database.storage import engine, init_db
+    init_db()
+    # Воркеры наследуют модуль после fork: соединения мастера им не передаются
+    engine.dispose()
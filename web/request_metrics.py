@@ -0,0 +1,57 @@
+# web/request_metrics.py
+
+import threading
+import time
+from collections import deque
+from flask import g, request
+from bot.utils.metrics import stage_duration, stage_errors
+
+# Время обработки запросов по эндпоинтам: счетчики и перцентили по последним window запросам.
+# У каждого воркера gunicorn свои значения
+class RequestMetrics:
+    def __init__(self, window=1000):
+        self.window = window
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    def install(self, app):
+        @app.before_request
+        def _start_timer():
+            g.request_started = time.perf_counter()
+
+        @app.after_request
+        def _record_latency(response):
+            started = g.pop('request_started', None)
+            if started is not None:
+                self.record(request.endpoint or request.path, response.status_code, time.perf_counter() - started)
+            return response
+
+    def record(self, endpoint, status_code, duration):
+        stage_duration.observe(f'http.{endpoint}', value=duration)
+        if status_code >= 500:
+            stage_errors.inc(f'http.{endpoint}', str(status_code))
+        with self._lock:
+            entry = self._endpoints.get(endpoint)
+            if entry is None:
+                entry = self._endpoints[endpoint] = {'count': 0, 'errors': 0, 'total': 0.0, 'max': 0.0,
+                                                     'recent': deque(maxlen=self.window)}
+            entry['count'] += 1
+            if status_code >= 500:
+                entry['errors'] += 1
+            entry['total'] += duration
+            entry['max'] = max(entry['max'], duration)
+            entry['recent'].append(duration)
+
+    def stats(self):
+        with self._lock:
+            snapshot = {endpoint: dict(entry, recent=sorted(entry['recent'])) for endpoint, entry in self._endpoints.items()}
+        result = {}
+        for endpoint, entry in snapshot.items():
+            recent = entry.pop('recent')
+            entry['avg'] = entry['total'] / entry['count'] if entry['count'] else 0.0
+            for name, fraction in (('p50', 0.5), ('p95', 0.95), ('p99', 0.99)):
+                entry[name] = recent[min(int(len(recent) * fraction), len(recent) - 1)] if recent else 0.0
+            result[endpoint] = entry
+        return result
+
+request_metrics = RequestMetrics()
@@ -0,0 +1,7 @@
+# web/wsgi.py
+
+from web.app import app
+from bot.api.payment_processor import payment_processor
+
+# Точка входа для gunicorn: в каждом воркере свой поток обработки платежей
+payment_processor.start()